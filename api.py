@@ -0,0 +1,257 @@
+import os
+import io
+import json
+import base64
+import logging
+from dataclasses import asdict
+from urllib.parse import parse_qs
+from dotenv import load_dotenv
+from utils import (
+    generate_embedding, insert_embeddings, search_similar_videos, iter_similar_videos,
+    get_rag_response, batching_metrics, search_cache_metrics, BROWSE_MAX_RESULTS
+)
+from results import iter_matches_csv
+from scheduler import scheduler
+from resilience import dependency_metrics
+from profiling import profile_request
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Bearer token required by the ingestion endpoint; ingestion is disabled when unset
+API_INGEST_TOKEN = os.getenv('API_INGEST_TOKEN')
+# Largest accepted request body (images are the biggest payloads)
+API_MAX_BODY_BYTES = int(os.getenv('API_MAX_BODY_BYTES', str(10 * 1024 * 1024)))
+
+PRODUCT_FIELDS = ("product_id", "title", "desc", "link", "video_url")
+# Rows fetched per search iterator page when exporting
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+FILTER_PARAMS = ("product_id", "category", "min_price", "max_price")
+
+
+# Response body produced while it is sent, e.g. a CSV export
+class StreamingBody:
+
+    def __init__(self, chunks, content_type, filename=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.filename = filename
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _read_body(environ):
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise ApiError('400 Bad Request', "Invalid Content-Length")
+    if length > API_MAX_BODY_BYTES:
+        raise ApiError('413 Payload Too Large', "Request body too large")
+    return environ['wsgi.input'].read(length) if length else b""
+
+
+def _read_json(environ):
+    return parse_json(_read_body(environ))
+
+
+def parse_json(body):
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        raise ApiError('400 Bad Request', "Request body must be JSON")
+
+
+# Search filters from a JSON "filters" object, or from query parameters
+# (repeat product_id or category to match any of several values)
+def _read_filters(payload=None, query=None):
+    if payload is not None:
+        filters = payload.get("filters") or {}
+        if not isinstance(filters, dict):
+            raise ApiError('400 Bad Request', "'filters' must be an object")
+        return filters
+    filters = {}
+    for name in FILTER_PARAMS:
+        values = (query or {}).get(name)
+        if values:
+            filters[name] = values if name in ("product_id", "category") else values[0]
+    return filters
+
+
+def handle_health(environ):
+    return {"status": "ok"}
+
+
+# Provider queue depths, retry counters, dependency health and batching of this worker
+def handle_metrics(environ):
+    return {
+        "providers": scheduler.metrics(),
+        "dependencies": dependency_metrics(),
+        "batching": batching_metrics(),
+        "search_cache": search_cache_metrics()
+    }
+
+
+# Question and filters of a /rag request body
+def parse_rag_request(body):
+    payload = parse_json(body)
+    question = str(payload.get("question", "")).strip()
+    if not question:
+        raise ApiError('400 Bad Request', "Missing 'question'")
+    return question, _read_filters(payload)
+
+
+# Image bytes, top_k and filters of a /search/image request. Accepts either
+# a raw image body or JSON with a base64 encoded "image" field.
+def parse_image_request(content_type, query_string, body):
+    query = parse_qs(query_string)
+    if content_type.startswith('application/json'):
+        payload = parse_json(body)
+        try:
+            image_bytes = base64.b64decode(payload.get("image", ""), validate=True)
+        except ValueError:
+            raise ApiError('400 Bad Request', "'image' must be base64 encoded")
+        top_k = payload.get("top_k", 5)
+        filters = _read_filters(payload)
+    else:
+        image_bytes = body
+        top_k = query.get("top_k", [5])[0]
+        filters = _read_filters(query=query)
+
+    if not image_bytes:
+        raise ApiError('400 Bad Request', "Missing image")
+    try:
+        top_k = max(1, min(100, int(top_k)))
+    except (TypeError, ValueError):
+        raise ApiError('400 Bad Request', "'top_k' must be an integer")
+    return image_bytes, top_k, filters
+
+
+# Text question -> RAG answer with its sources
+def handle_rag(environ):
+    question, filters = parse_rag_request(_read_body(environ))
+    try:
+        return get_rag_response(question, filters=filters).to_dict()
+    except ValueError as e:
+        raise ApiError('400 Bad Request', str(e))
+
+
+# Image -> similar video segments
+def handle_image_search(environ):
+    image_bytes, top_k, filters = parse_image_request(
+        environ.get('CONTENT_TYPE', ''), environ.get('QUERY_STRING', ''), _read_body(environ)
+    )
+    try:
+        results = search_similar_videos(io.BytesIO(image_bytes), top_k=top_k, filters=filters)
+    except ValueError as e:
+        raise ApiError('400 Bad Request', str(e))
+    if results is None:
+        raise ApiError('502 Bad Gateway', "Visual search failed")
+    return {"results": [asdict(result) for result in results]}
+
+
+# Image -> CSV of up to ?limit similar video segments, best first. Rows are
+# streamed as the search iterators page through the collection.
+def handle_image_export(environ):
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    image_bytes, _, filters = parse_image_request(
+        environ.get('CONTENT_TYPE', ''), environ.get('QUERY_STRING', ''), _read_body(environ)
+    )
+    try:
+        limit = max(1, min(BROWSE_MAX_RESULTS, int(query.get("limit", [BROWSE_MAX_RESULTS])[0])))
+    except ValueError:
+        raise ApiError('400 Bad Request', "'limit' must be an integer")
+    try:
+        batches = iter_similar_videos(image_bytes, filters=filters, batch_size=EXPORT_BATCH_SIZE, limit=limit)
+    except ValueError as e:
+        raise ApiError('400 Bad Request', str(e))
+    except Exception:
+        logger.exception("Error starting export")
+        raise ApiError('502 Bad Gateway', "Visual search failed")
+    return StreamingBody(iter_matches_csv(batches), 'text/csv; charset=utf-8', "similar-videos.csv")
+
+
+# Encode a streamed body; errors after the headers went out can only be logged
+def _stream(chunks):
+    try:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+    except Exception:
+        logger.exception("Error while streaming response")
+    finally:
+        chunks.close()
+
+
+# Product fields -> embeddings generated and inserted
+def handle_ingest(environ):
+    if not API_INGEST_TOKEN:
+        raise ApiError('403 Forbidden', "Ingestion is disabled")
+    if environ.get('HTTP_AUTHORIZATION') != f"Bearer {API_INGEST_TOKEN}":
+        raise ApiError('401 Unauthorized', "Invalid ingestion token")
+
+    product_info = _read_json(environ)
+    missing = [field for field in PRODUCT_FIELDS if not product_info.get(field)]
+    if missing:
+        raise ApiError('400 Bad Request', f"Missing fields: {', '.join(missing)}")
+
+    embeddings, error = generate_embedding(product_info)
+    if error:
+        raise ApiError('502 Bad Gateway', f"Error processing product: {error}")
+    if not insert_embeddings(embeddings, product_info):
+        raise ApiError('502 Bad Gateway', "Failed to add product data")
+    return {"status": "inserted", "product_id": product_info["product_id"]}
+
+
+ROUTES = {
+    ('GET', '/health'): handle_health,
+    ('GET', '/metrics'): handle_metrics,
+    ('POST', '/rag'): handle_rag,
+    ('POST', '/search/image'): handle_image_search,
+    ('POST', '/search/image/export'): handle_image_export,
+    ('POST', '/ingest'): handle_ingest,
+}
+
+
+# WSGI entry point, served by gunicorn (see gunicorn.conf.py). Requests
+# with ?profile=1 (or selected by PROFILE / PROFILE_SAMPLE_RATE) are profiled
+# and answer with the profile's ID in X-Profile-Id.
+def app(environ, start_response):
+    route = (environ.get('REQUEST_METHOD', 'GET'), environ.get('PATH_INFO', '/').rstrip('/') or '/')
+    handler = ROUTES.get(route)
+    requested = parse_qs(environ.get('QUERY_STRING', '')).get('profile') == ['1']
+    with profile_request(route[1].strip('/').replace('/', '_') or 'root', requested=requested and handler is not None) as profile:
+        try:
+            if handler is None:
+                raise ApiError('404 Not Found', "Not found")
+            status, payload = '200 OK', handler(environ)
+        except ApiError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception:
+            logger.exception("Unhandled error on %s %s", *route)
+            status, payload = '500 Internal Server Error', {"error": "Internal server error"}
+
+        if isinstance(payload, StreamingBody):
+            headers = [('Content-Type', payload.content_type)]
+            if payload.filename:
+                headers.append(('Content-Disposition', f'attachment; filename="{payload.filename}"'))
+            if profile is not None:
+                headers.append(('X-Profile-Id', profile.request_id))
+            start_response(status, headers)
+            return _stream(payload.chunks)
+
+        body = json.dumps(payload, default=str).encode('utf-8')
+
+    headers = [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body)))
+    ]
+    if profile is not None:
+        headers.append(('X-Profile-Id', profile.request_id))
+    start_response(status, headers)
+    return [body]
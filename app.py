@@ -1,9 +1,20 @@
 import streamlit as st
 from dotenv import load_dotenv
-from utils import generate_embedding, insert_embeddings, collection, get_rag_response
+from utils import ERROR_RESPONSE
+from async_pipeline import get_rag_response_async, run_coroutine
+from results import RagResponse
+from rendering import render_results_section, render_results_summary, session_closed
+from warmup import SUGGESTIONS, start_warmup
+from history import append_message, expand_turn
+from profiling import profile_request, cprofile_stage, current_profile
 
 load_dotenv()
 
+# Assistant turns that always render their product cards and players
+HISTORY_FULL_TURNS = 2
+# Messages shown per page of chat history
+HISTORY_PAGE_SIZE = 20
+
 st.markdown("""
 <style>
     .main {
@@ -70,114 +81,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Create an embedded video player with timestamp support
-def create_video_embed(video_url, start_time=0, end_time=0):
-    try:
-        if 'vimeo.com' in video_url:
-            video_id = video_url.split('/')[-1].split('?')[0]
-            start_seconds = str(int(float(start_time)))
-            return f"""
-                <iframe 
-                    width="100%" 
-                    height="315" 
-                    src="https://player.vimeo.com/video/{video_id}#t={start_seconds}s"
-                    frameborder="0" 
-                    allow="fullscreen; picture-in-picture" 
-                    allowfullscreen>
-                </iframe>
-            """
-        else:
-            return f"""
-                <video 
-                    width="100%" 
-                    height="315" 
-                    controls 
-                    preload="auto"
-                    id="video-player">
-                    <source src="{video_url}" type="video/mp4">
-                    Your browser does not support the video tag.
-                </video>
-                <script>
-                    var video = document.getElementById('video-player');
-                    video.addEventListener('loadedmetadata', function() {{
-                        this.currentTime = {start_time};
-                    }});
-                </script>
-            """
-    except Exception as e:
-        st.error(f"Error creating video embed: {str(e)}")
-        return f"<p>Error creating video embed for URL: {video_url}</p>"
-
-
-def render_product_details(source):
-    with st.container():
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-
-            # Determine section title and button text
-            is_video = source.get("type") == "video"
-            section_title = "📹 Video Segment" if is_video else "📝 Product Details"
-            
-            store_link_html = ""
-            if source.get('link') and isinstance(source['link'], str) and len(source['link'].strip()) > 0:
-                store_link_html = f"""
-                    <div style="margin-top: 1rem;">
-                        <a href="{source['link']}" 
-                           target="_blank" 
-                           style="
-                               display: inline-block;
-                               background-color: #81E831;
-                               color: white;
-                               padding: 10px 20px;
-                               border-radius: 20px;
-                               text-decoration: none;
-                               font-weight: 500;
-                               margin-top: 10px;
-                               border: none;
-                               cursor: pointer;
-                           ">
-                            View on Store
-                        </a>
-                    </div>
-                """
-            # Product Card
-            card_html = f"""
-                <div style="background-color: white; padding: 1.5rem; border-radius: 10px; box-shadow: 0 2px 5px rgba(0,0,0,0.1);">
-                    <h3 style="color: #333; margin-bottom: 1rem;">{section_title}</h3>
-                    <h4 style="color: #81E831;">{source.get('title', 'No Title')}</h4>
-                    <div style="margin: 1rem 0;">
-                        <div style="background: linear-gradient(90deg, #81E831 {source.get('similarity', 0)}%, #f1f1f1 {source.get('similarity', 0)}%); 
-                             height: 6px; border-radius: 3px; margin-bottom: 0.5rem;"></div>
-                        <p style="color: #666;">Similarity Score: {source.get('similarity', 0)}%</p>
-                    </div>
-                    <p style="color: #333; font-size: 1.1em;">{source.get('description', 'No description available')}</p>
-                    <p style="color: #666;">Product ID: {source.get('product_id', 'N/A')}</p>
-                    {f'<p style="color: #666;">Segment Time: {source.get("start_time", 0):.1f}s - {source.get("end_time", 0):.1f}s</p>' if is_video else ''}
-                </div>
-            """
-            
-            st.markdown(card_html, unsafe_allow_html=True)
-            if store_link_html:
-                st.markdown(store_link_html, unsafe_allow_html=True)
-                
-        
-        with col2:
-            if source.get('video_url'):
-                if source.get('type') == 'video':
-                    st.markdown(
-                        create_video_embed(
-                            source['video_url'],
-                            source.get('start_time', 0),
-                            source.get('end_time', 0)
-                        ),
-                        unsafe_allow_html=True
-                    )
-                else:
-                    # For non-segmented videos, use st.video with autoplay disabled
-                    st.video(source['video_url'], start_time=0)
-
-
 def create_suggestion_button(text):
     return f"""
         <button 
@@ -203,16 +106,6 @@ def create_suggestion_button(text):
     
 def render_suggestions():
     st.markdown("### Try asking about:")
-    
-    # Define your example queries
-    suggestions = [
-        "Show me black dresses for a party",
-        "I'm looking for men's black t-shirts",
-        "What are the latest bridal collection designs?",
-        "Find me a casual black dress",
-        "Show me t-shirts for men",
-        "Can you suggest bridal wear?"
-    ]
 
     # Style for the container
     st.markdown("""
@@ -228,7 +121,7 @@ def render_suggestions():
 
     cols = st.columns(3)
     
-    for idx, suggestion in enumerate(suggestions):
+    for idx, suggestion in enumerate(SUGGESTIONS):
         col_idx = idx % 3
         with cols[col_idx]:
             if st.button(suggestion, key=f"suggestion_{idx}", use_container_width=True):
@@ -236,44 +129,84 @@ def render_suggestions():
                 st.session_state.query = suggestion
                 st.rerun()
 
-# Utitily function to render results in the chat interface
-def render_results_section(response_data):
+# Render the visible part of the conversation. Only the newest turns get
+# their product cards and players; older answers show a summary whose
+# products load on demand, so each rerun costs the same however long the
+# conversation gets.
+def render_chat_history():
+    messages = st.session_state.messages
+    first_visible = max(0, len(messages) - st.session_state.history_limit)
 
-    if response_data.get("metadata") and response_data["metadata"].get("sources"):
-        with st.expander("View Product Details 🛍️", expanded=True):
-            metadata = response_data["metadata"]
+    if first_visible > 0:
+        if st.button(f"Load earlier messages ({first_visible} hidden)", key="load_earlier"):
+            st.session_state.history_limit += HISTORY_PAGE_SIZE
+            st.rerun()
 
-            st.markdown(f"""
-                <div style="margin-bottom: 2rem; padding: 1rem; background-color: #f8f9fa; border-radius: 8px;">
-                    <h4 style="color: #333;">Search Results Summary</h4>
-                    <p>Found {metadata["total_sources"]} relevant matches:</p>
-                    <ul>
-                        <li>{metadata["text_sources"]} product descriptions</li>
-                        <li>{metadata["video_sources"]} video segments</li>
-                    </ul>
-                </div>
-            """, unsafe_allow_html=True)
-            
-            text_sources = [s for s in metadata["sources"] if s.get("type") == "text"]
-            if text_sources:
-                st.markdown("### 📝 Retrieved Products")
-                for source in text_sources:
-                    render_product_details(source)
-                    st.markdown('<hr style="margin: 2rem 0;">', unsafe_allow_html=True)
-            
-            video_sources = [s for s in metadata["sources"] if s.get("type") == "video"]
-            if video_sources:
-                st.markdown("### 📹 Matching Product Videos")
-                for source in video_sources:
-                    render_product_details(source)
-                    st.markdown('<hr style="margin: 2rem 0;">', unsafe_allow_html=True)
-                    
+    assistant_indexes = [idx for idx, message in enumerate(messages) if message["role"] == "assistant"]
+    full_turns = set(assistant_indexes[-HISTORY_FULL_TURNS:])
+
+    for idx in range(first_visible, len(messages)):
+        message = messages[idx]
+        with st.chat_message(message["role"], avatar="👤" if message["role"] == "user" else "👗"):
+            if message["role"] != "assistant":
+                st.markdown(message["content"])
+                continue
+
+            turn = message["content"]
+            st.markdown(turn.response)
+            if idx in full_turns or idx in st.session_state.expanded_turns:
+                render_results_section(expand_turn(turn))
+            elif turn.has_sources:
+                render_results_summary(turn.text_count, turn.video_count)
+                if st.button("Show products", key=f"show_products_{idx}"):
+                    st.session_state.expanded_turns.add(idx)
+                    st.rerun()
+
+# Store a chat message compactly, keeping expanded turns aligned when the
+# oldest messages are evicted
+def add_message(role, content):
+    with cprofile_stage("store_message"):
+        evicted = append_message(st.session_state.messages, role, content)
+    if evicted:
+        st.session_state.expanded_turns = {
+            idx - evicted for idx in st.session_state.expanded_turns if idx >= evicted
+        }
+
+# Answer a query in an assistant message. The query runs on the async
+# pipeline's loop and is timed by its stages; rendering the answer runs on
+# this thread under cProfile when the page run is profiled.
+def answer_query(query):
+    with st.chat_message("assistant", avatar="👗"):
+        with st.spinner("Finding perfect matches..."):
+            try:
+                response_data = run_coroutine(get_rag_response_async(query), cancelled=session_closed)
+                with cprofile_stage("render"):
+                    st.markdown(response_data.response)
+                    render_results_section(response_data)
+            except Exception as e:
+                st.error(f"An error occurred: {str(e)}")
+                response_data = RagResponse(ERROR_RESPONSE)
+        profile = current_profile()
+        if profile is not None:
+            st.caption(f"Profile saved as {profile.request_id}")
+    return response_data
+
+# Page run profiled end to end when selected by profiling.py (e.g. with
+# ?profile=1 in the URL)
 def chat_page():
+    with profile_request("chat", requested=st.query_params.get("profile") == "1", cprofile=False):
+        render_chat_page()
+
+def render_chat_page():
     # Initialize session state
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "query" not in st.session_state:
         st.session_state.query = ""
+    if "history_limit" not in st.session_state:
+        st.session_state.history_limit = HISTORY_PAGE_SIZE
+    if "expanded_turns" not in st.session_state:
+        st.session_state.expanded_turns = set()
 
     st.markdown("""
         <div style="text-align: center; padding: 2rem 0;">
@@ -294,15 +227,8 @@ def chat_page():
     if not st.session_state.messages:
         render_suggestions()
 
-    # Chat messages display
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"], avatar="👤" if message["role"] == "user" else "👗"):
-            if message["role"] == "assistant":
-                st.markdown(message["content"]["response"])
-                if message["content"].get("metadata") and message["content"]["metadata"].get("sources"):
-                    render_results_section(message["content"])
-            else:
-                st.markdown(message["content"])
+    with cprofile_stage("history"):
+        render_chat_history()
 
     # Handle query from suggestion buttons
     if st.session_state.query:
@@ -310,58 +236,20 @@ def chat_page():
         st.session_state.query = ""  # Clear the query
         
         # Add user message
-        st.session_state.messages.append({
-            "role": "user",
-            "content": query
-        })
-        
-        with st.chat_message("assistant", avatar="👗"):
-            with st.spinner("Finding perfect matches..."):
-                try:
-                    response_data = get_rag_response(query)
-                    st.markdown(response_data["response"])
-                    if response_data.get("metadata") and response_data["metadata"].get("sources"):
-                        render_results_section(response_data)
-                except Exception as e:
-                    st.error(f"An error occurred: {str(e)}")
-                    response_data = {
-                        "response": "I encountered an error while processing your request. Please try again.",
-                        "metadata": None
-                    }
+        add_message("user", query)
         
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": response_data
-        })
+        response_data = answer_query(query)
+        add_message("assistant", response_data)
         
         st.rerun()
 
     # Chat input
     if prompt := st.chat_input("Hey! Ask me anything about fashion - styles, outfits, trends..."):
         # Add user message
-        st.session_state.messages.append({
-            "role": "user",
-            "content": prompt
-        })
+        add_message("user", prompt)
         
-        with st.chat_message("assistant", avatar="👗"):
-            with st.spinner("Finding perfect matches..."):
-                try:
-                    response_data = get_rag_response(prompt)
-                    st.markdown(response_data["response"])
-                    if response_data.get("metadata") and response_data["metadata"].get("sources"):
-                        render_results_section(response_data)
-                except Exception as e:
-                    st.error(f"An error occurred: {str(e)}")
-                    response_data = {
-                        "response": "I encountered an error while processing your request. Please try again.",
-                        "metadata": None
-                    }
-        
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": response_data
-        })
+        response_data = answer_query(prompt)
+        add_message("assistant", response_data)
 
     # Sidebar content
     with st.sidebar:
@@ -381,6 +269,9 @@ def chat_page():
         """, unsafe_allow_html=True)
         
 def main():
+    # Pre-compute answers for the suggestion and popular queries
+    start_warmup()
+
     query_params = st.query_params
     page = query_params.get("page", "chat")[0] if query_params.get("page") else "chat"
 
@@ -0,0 +1,145 @@
+import json
+import asyncio
+import logging
+from dataclasses import asdict
+from urllib.parse import parse_qs
+from api import ApiError, API_MAX_BODY_BYTES, parse_rag_request, parse_image_request, handle_health, handle_metrics
+from async_pipeline import get_rag_response_async, search_similar_videos_async
+from profiling import profile_request
+
+logger = logging.getLogger(__name__)
+
+# ASGI variant of api.py serving the query endpoints from one event loop, so
+# a worker keeps many queries in flight without a thread per request:
+#
+#   uvicorn asgi:app --workers 4
+#
+# A query is cancelled as soon as its client disconnects. Ingestion stays on
+# the WSGI app; it is long-running background work, not a query.
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def _read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunk = message.get('body', b"")
+        size += len(chunk)
+        if size > API_MAX_BODY_BYTES:
+            raise ApiError('413 Payload Too Large', "Request body too large")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b"".join(chunks)
+
+
+async def handle_rag(scope, body):
+    question, filters = parse_rag_request(body)
+    try:
+        response = await get_rag_response_async(question, filters=filters)
+    except ValueError as e:
+        raise ApiError('400 Bad Request', str(e))
+    return response.to_dict()
+
+
+async def handle_image_search(scope, body):
+    headers = dict(scope.get('headers', []))
+    image_bytes, top_k, filters = parse_image_request(
+        headers.get(b'content-type', b"").decode('latin-1'),
+        scope.get('query_string', b"").decode('latin-1'),
+        body
+    )
+    try:
+        results = await search_similar_videos_async(image_bytes, top_k=top_k, filters=filters)
+    except ValueError as e:
+        raise ApiError('400 Bad Request', str(e))
+    if results is None:
+        raise ApiError('502 Bad Gateway', "Visual search failed")
+    return {"results": [asdict(result) for result in results]}
+
+
+async def handle_health_async(scope, body):
+    return handle_health(None)
+
+
+async def handle_metrics_async(scope, body):
+    return handle_metrics(None)
+
+
+ROUTES = {
+    ('GET', '/health'): handle_health_async,
+    ('GET', '/metrics'): handle_metrics_async,
+    ('POST', '/rag'): handle_rag,
+    ('POST', '/search/image'): handle_image_search,
+}
+
+
+# Run the handler until it finishes or the client goes away
+async def _until_disconnect(handler, scope, body, receive):
+    task = asyncio.ensure_future(handler(scope, body))
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        raise ClientDisconnected()
+    return task.result()
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    route = (scope['method'], scope['path'].rstrip('/') or '/')
+    handler = ROUTES.get(route)
+    requested = parse_qs(scope.get('query_string', b"").decode('latin-1')).get('profile') == ['1']
+    # Requests share the loop thread, so a cProfile of one would include
+    # every other request in flight; profiles record stage timings only
+    with profile_request(
+        route[1].strip('/').replace('/', '_') or 'root',
+        requested=requested and handler is not None,
+        cprofile=False
+    ) as profile:
+        try:
+            if handler is None:
+                raise ApiError('404 Not Found', "Not found")
+            body = await _read_body(receive)
+            status, payload = '200 OK', await _until_disconnect(handler, scope, body, receive)
+        except ClientDisconnected:
+            logger.info("Client disconnected; cancelled %s %s", *route)
+            return
+        except ApiError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception:
+            logger.exception("Unhandled error on %s %s", *route)
+            status, payload = '500 Internal Server Error', {"error": "Internal server error"}
+
+    body = json.dumps(payload, default=str).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode())
+    ]
+    if profile is not None:
+        headers.append((b'x-profile-id', profile.request_id.encode()))
+    await send({'type': 'http.response.start', 'status': int(status.split()[0]), 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
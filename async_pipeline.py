@@ -0,0 +1,186 @@
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from clients import get_async_openai_client
+from llm_cache import LLM_CACHE_ENABLED, completion_cache, prompt_fingerprint
+from results import ProductMatch, RagResponse
+from scheduler import scheduler, cancel_on
+from resilience import aguarded
+from profiling import stage, current_profile, attach
+from utils import (
+    LLM_MODEL, LLM_TEMPERATURE, NO_MATCHES_RESPONSE, ERROR_RESPONSE,
+    COLLECTION_NAME, query_scope, embed_query_image, embed_query_text,
+    search_text_matches, search_video_segments, cached_matches, store_matches,
+    remember_products, matches_to_sources, build_rag_messages, chat_request
+)
+
+logger = logging.getLogger(__name__)
+
+# Coroutine versions of the query pipeline for servers that keep many
+# queries in flight on one event loop (see asgi.py) and for Streamlit pages
+# through run_coroutine(). OpenAI is called with the async client. The
+# embedding and search steps reuse utils' synchronous code instead: it is
+# built on pymilvus' ORM Collection (shards, iterators, schema checks) and
+# the sync TwelveLabs client behind the embedding coalescer, and moving to
+# AsyncMilvusClient and the async TwelveLabs client would mean rewriting
+# those steps a second time. They run in worker threads, through the same
+# rate limits, breakers, batching and caches as utils. Cancelling a
+# coroutine abandons its pending provider calls.
+
+
+# Threads for the blocking SDK calls of in-flight queries. A query holds up
+# to two at once (text and video search), so this bounds the queries a
+# process serves concurrently; asyncio's default executor would cap it at
+# min(32, cpus + 4). Guarded calls also run on RESILIENCE_WORKERS threads.
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '256'))
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+
+
+# Run a blocking pipeline step in a worker thread, in the caller's context.
+# If the coroutine is cancelled, the step's provider calls stop queueing and
+# retrying.
+async def _in_thread(fn, *args, **kwargs):
+    cancelled = threading.Event()
+
+    def run():
+        with cancel_on(cancelled):
+            return fn(*args, **kwargs)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, contextvars.copy_context().run, run)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+
+async def aretrieve_matches(question, expr="", shards=None):
+    shards = tuple(shards or [COLLECTION_NAME])
+    cache_key = (question, expr, shards)
+    matches, generation = cached_matches(cache_key)
+    if matches is not None:
+        return matches
+
+    with stage("embed_query"):
+        question_embedding = await _in_thread(embed_query_text, f"fashion product: {question}")
+
+    # Text and video searches are independent; if one fails the other is cancelled
+    with stage("search"):
+        async with asyncio.TaskGroup() as group:
+            text_task = group.create_task(_in_thread(search_text_matches, question_embedding, 2, expr, shards))
+            video_task = group.create_task(_in_thread(search_video_segments, question_embedding, 3, ["metadata"], expr, shards))
+
+    matches = (text_task.result(), video_task.result())
+    store_matches(cache_key, generation, matches)
+    return matches
+
+
+async def acomplete_answer(messages, sources):
+    cache_key = prompt_fingerprint(LLM_MODEL, LLM_TEMPERATURE, messages)
+    answer = await _in_thread(completion_cache.get, cache_key) if LLM_CACHE_ENABLED else None
+    if answer is None:
+        chat_response = await scheduler.acall(
+            'openai', 'chat',
+            aguarded, 'openai_chat',
+            get_async_openai_client().chat.completions.create,
+            **chat_request(messages)
+        )
+        answer = chat_response.choices[0].message.content
+        if LLM_CACHE_ENABLED:
+            await _in_thread(completion_cache.put, cache_key, answer, {source.product_id for source in sources})
+    return answer
+
+
+# Async get_rag_response
+async def get_rag_response_async(question, filters=None):
+    # Resolving the live collection may call Milvus, so not on the loop
+    expr, shards = await _in_thread(query_scope, question, filters)
+
+    try:
+        with stage("retrieve"):
+            text_results, video_results = await aretrieve_matches(question, expr, shards)
+        with stage("sources"):
+            sources = matches_to_sources(text_results, video_results)
+
+        if not sources:
+            return RagResponse(NO_MATCHES_RESPONSE)
+
+        with stage("prompt"):
+            messages = build_rag_messages(question, sources)
+        with stage("complete"):
+            answer = await acomplete_answer(messages, sources)
+        return RagResponse(answer, tuple(sources))
+
+    except Exception:
+        logger.exception("Error in multimodal RAG")
+        return RagResponse(ERROR_RESPONSE)
+
+
+# Async search_similar_videos, taking the image bytes
+async def search_similar_videos_async(image_bytes, top_k=5, filters=None):
+    expr, shards = await _in_thread(query_scope, "", filters)
+
+    try:
+        with stage("embed_image"):
+            image_embedding = await _in_thread(embed_query_image, image_bytes)
+        with stage("search_video"):
+            results = await _in_thread(search_video_segments, image_embedding, top_k, ["metadata"], expr, shards)
+
+        remember_products(hit.metadata for hits in results for hit in hits)
+        matches = [ProductMatch.from_hit("video", hit.metadata, hit.score) for hits in results for hit in hits]
+        matches.sort(key=lambda match: match.similarity, reverse=True)
+        return matches
+
+    except Exception:
+        logger.exception("Error in visual search")
+        return None
+
+
+# Event loop shared by the synchronous callers of this process (Streamlit
+# script threads), started on first use
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _runner_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-pipeline", daemon=True).start()
+    return _loop
+
+
+# Tasks on the shared loop don't inherit the caller's context; carry over
+# its request profile so stages are recorded for the right request
+async def _attached(coro, profile):
+    if profile is None:
+        return await coro
+    with attach(profile):
+        return await coro
+
+
+# Run a coroutine on the shared loop and wait for it. The coroutine is
+# cancelled when cancelled() turns true (e.g. the user's session closed),
+# when the timeout passes, or when the waiting thread is interrupted.
+def run_coroutine(coro, cancelled=None, timeout=None, poll_seconds=0.25):
+    future = asyncio.run_coroutine_threadsafe(_attached(coro, current_profile()), _runner_loop())
+    waited = 0.0
+    try:
+        while True:
+            try:
+                return future.result(timeout=poll_seconds)
+            except FutureTimeoutError:
+                waited += poll_seconds
+                if cancelled is not None and cancelled():
+                    future.cancel()
+                    raise asyncio.CancelledError()
+                if timeout is not None and waited >= timeout:
+                    future.cancel()
+                    raise TimeoutError(f"Query did not finish within {timeout}s")
+    except BaseException:
+        future.cancel()
+        raise
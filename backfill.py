@@ -0,0 +1,57 @@
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+from shards import all_shards, available_shards
+from utils import CLIP_LAYERS, videos_missing_layers, backfill_clip_layers
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Build the coarse clip layers (CLIP_LAYERS) of videos ingested before they
+# existed. Searches fall back to the fine segments of videos without them,
+# so nothing is lost meanwhile, but those videos skip candidate selection.
+# Resumable: only videos still missing the layers are processed.
+#
+#   python backfill.py              # every existing shard
+#   python backfill.py --dry-run    # only list the videos missing layers
+
+
+def backfill(shards=None, dry_run=False, progress=None):
+    report = progress or logger.info
+    totals = {}
+    for shard in shards or available_shards(all_shards()):
+        videos = sorted(videos_missing_layers(shard))
+        report(f"{shard}: {len(videos)} videos without clip layers")
+        inserted = 0
+        for number, video_url in enumerate(videos, 1):
+            if dry_run:
+                report(f"  {video_url}")
+                continue
+            try:
+                inserted += backfill_clip_layers(video_url, shard)
+            except Exception:
+                logger.exception("Error backfilling %s", video_url)
+                continue
+            report(f"  {number}/{len(videos)} {video_url}")
+        totals[shard] = {"videos": len(videos), "inserted": inserted}
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build missing coarse clip layers")
+    parser.add_argument("shards", nargs="*", help="Shards to backfill (default: every existing shard)")
+    parser.add_argument("--dry-run", action="store_true", help="List the videos without changing anything")
+    args = parser.parse_args(argv)
+
+    if len(CLIP_LAYERS) < 2:
+        print("CLIP_LAYERS has a single layer; nothing to backfill")
+        return
+    for shard, total in backfill(args.shards, args.dry_run, progress=print).items():
+        print(f"{shard}: {total['videos']} videos, {total['inserted']} rows inserted")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
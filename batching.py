@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import Future
+from scheduler import call_context, on_behalf_of
+
+
+class _Batch:
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.contexts = []
+        self.full = threading.Event()
+
+
+# Collects calls with the same key that arrive within a short window and runs
+# them as one batch. The first caller of a batch leads it: it waits out the
+# window (or until the batch is full), runs batch_fn(key, items) and fans the
+# results back out to every waiting caller. Provider calls of the batch run
+# in the most urgent lane of its callers and are cancelled only once every
+# caller gave up, not when the leader alone does.
+class Coalescer:
+
+    def __init__(self, batch_fn, window_ms, max_batch):
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key, item):
+        future = Future()
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.contexts.append(call_context())
+            if len(batch.items) >= self.max_batch:
+                del self._pending[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            self._execute(key, batch)
+        return future.result()
+
+    def _execute(self, key, batch):
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch.items)
+        try:
+            with on_behalf_of(batch.contexts):
+                results = self.batch_fn(key, batch.items)
+            if len(results) != len(batch.items):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(batch.items)} items")
+        except BaseException as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+    def metrics(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else None
+        }
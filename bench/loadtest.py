@@ -0,0 +1,243 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Open-loop load generator for capacity planning. Requests arrive as a
+# Poisson process at each target rate, replaying a mix of chat queries and
+# visual searches, and the run reports throughput, latency percentiles,
+# error rate and the first rate at which the instance saturates.
+#
+#   python -m bench.loadtest --path streamlit --rates 2,5,10,20
+#   python -m bench.loadtest --path http --target http://localhost:8000 --rates 5,10
+#
+# The streamlit path runs each request on its own thread, the way Streamlit
+# runs one script thread per session. Chat queries go through run_coroutine
+# to the async pipeline's shared loop, as the chat page does; visual
+# searches call utils synchronously, like the visual search page. The api
+# path drives the WSGI app in-process and the http path a running server
+# (start one on the stand-ins with
+# `gunicorn -c gunicorn.conf.py bench.stub_app:app`).
+
+DEFAULT_IMAGE = "src/tshirt-black.jpg"
+EXTRA_QUERIES = [
+    "Red summer dress with floral print",
+    "Formal white shirt for office",
+    "Comfortable sneakers for running",
+    "Denim jacket for autumn",
+]
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+# Request functions for each path, returning True on success
+def build_requests(args):
+    with open(DEFAULT_IMAGE, "rb") as f:
+        image_bytes = f.read()
+
+    if args.path == "streamlit":
+        from utils import search_similar_videos, ERROR_RESPONSE
+        from async_pipeline import get_rag_response_async, run_coroutine
+
+        def chat(query):
+            return run_coroutine(get_rag_response_async(query)).response != ERROR_RESPONSE
+
+        def visual(top_k):
+            return search_similar_videos(io.BytesIO(image_bytes), top_k=top_k) is not None
+
+        return chat, visual
+
+    if args.path == "api":
+        from api import app
+
+        def call(method, path, body, content_type):
+            statuses = []
+            path, _, query_string = path.partition('?')
+            environ = {
+                'REQUEST_METHOD': method,
+                'PATH_INFO': path,
+                'QUERY_STRING': query_string,
+                'CONTENT_TYPE': content_type,
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body)
+            }
+            b"".join(app(environ, lambda status, headers: statuses.append(status)))
+            return statuses[0].startswith('200')
+    else:
+        def call(method, path, body, content_type):
+            request = urllib.request.Request(
+                args.target.rstrip('/') + path,
+                data=body,
+                method=method,
+                headers={'Content-Type': content_type}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                    response.read()
+                    return response.status == 200
+            except Exception:
+                return False
+
+    def chat(query):
+        return call('POST', '/rag', json.dumps({"question": query}).encode(), 'application/json')
+
+    def visual(top_k):
+        return call('POST', f'/search/image?top_k={top_k}', image_bytes, 'image/jpeg')
+
+    return chat, visual
+
+
+# Offer requests at `rate` per second for `duration` seconds
+def run_step(rate, args, chat, visual, rng):
+    from warmup import SUGGESTIONS
+
+    queries = SUGGESTIONS + EXTRA_QUERIES
+    latencies = []
+    finished = []
+    errors = 0
+    lock = threading.Lock()
+
+    # Latency counts from the scheduled arrival, so time queued behind
+    # --max-in-flight is included
+    def timed(kind, argument, at):
+        nonlocal errors
+        begun = started + at
+        try:
+            ok = chat(argument) if kind == "chat" else visual(argument)
+        except Exception:
+            ok = False
+        now = time.perf_counter()
+        with lock:
+            latencies.append(now - begun)
+            finished.append(now - started)
+            if not ok:
+                errors += 1
+
+    schedule = []
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate)
+        if at >= args.duration:
+            break
+        if rng.random() < args.visual_share:
+            schedule.append((at, "visual", rng.choice([2, 5, 10])))
+        else:
+            schedule.append((at, "chat", rng.choice(queries)))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as pool:
+        for at, kind, argument in schedule:
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(timed, kind, argument, at)
+    elapsed = time.perf_counter() - started
+
+    # Rates over the arrival window: what was actually offered (the Poisson
+    # draw rarely matches the nominal rate) against what completed by its end
+    completed = len(latencies)
+    in_window = sum(1 for at in finished if at <= args.duration)
+    return {
+        "offered_rate": rate,
+        "offered": len(schedule),
+        "arrival_rate": round(len(schedule) / args.duration, 2),
+        "requests": completed,
+        "throughput": round(in_window / args.duration, 2),
+        "drain_s": round(max(0.0, elapsed - args.duration), 2),
+        "error_rate": round(errors / completed, 4) if completed else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p90_ms": round(percentile(latencies, 90) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+# A step is saturated when completions fall behind the requests actually
+# offered, the p95 exceeds the SLO or errors pile up. Requests still in
+# flight when arrivals stop are allowed for: a server keeping up finishes
+# all but about one p95 worth of arrivals within the window.
+def is_saturated(step, args):
+    in_flight_allowance = step["arrival_rate"] * (step["p95_ms"] or 0) / 1000
+    return (
+        step["throughput"] * args.duration < 0.9 * step["offered"] - in_flight_allowance
+        or (step["p95_ms"] or 0) > args.slo_ms
+        or step["error_rate"] > args.max_error_rate
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Concurrent-user load test for the chat and visual search paths")
+    parser.add_argument("--path", choices=["streamlit", "api", "http"], default="streamlit")
+    parser.add_argument("--target", default="http://localhost:8000", help="API base URL for --path http")
+    parser.add_argument("--rates", default="1,2,5,10,20", help="Comma separated arrival rates (requests/s)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per rate step")
+    parser.add_argument("--visual-share", type=float, default=0.2, help="Fraction of visual searches")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Concurrent requests at most")
+    parser.add_argument("--timeout", type=float, default=60, help="HTTP timeout in seconds")
+    parser.add_argument("--slo-ms", type=float, default=5000, help="p95 latency objective")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cold", action="store_true", help="Disable query, search and completion caches")
+    parser.add_argument("--real", action="store_true", help="Use the real services instead of stand-ins")
+    parser.add_argument("--embed-ms", type=float, default=80)
+    parser.add_argument("--search-ms", type=float, default=15)
+    parser.add_argument("--llm-ms", type=float, default=1200)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Cache settings are read when utils is imported, so set them first
+    os.environ.setdefault('WARMUP', '0')
+    if args.cold:
+        os.environ['LLM_CACHE'] = '0'
+        os.environ['QUERY_CACHE_SIZE'] = '0'
+        os.environ['SEARCH_CACHE'] = '0'
+    if args.path != "http" and not args.real:
+        from bench import stubs
+        stubs.install(args.embed_ms, args.search_ms, args.llm_ms, args.products, args.seed)
+
+    chat, visual = build_requests(args)
+    rng = random.Random(args.seed)
+
+    steps = []
+    saturation = None
+    for rate in [float(rate) for rate in args.rates.split(',')]:
+        step = run_step(rate, args, chat, visual, rng)
+        steps.append(step)
+        print(json.dumps(step))
+        if is_saturated(step, args):
+            saturation = rate
+            break
+
+    report = {
+        "path": args.path,
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "steps": steps,
+        "saturation_rate": saturation,
+        "max_sustained_rate": max((step["offered_rate"] for step in steps if not is_saturated(step, args)), default=None)
+    }
+    print(f"Saturated at {saturation} req/s" if saturation else "No saturation within the tested rates")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
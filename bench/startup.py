@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Cold-start budget per entry point. Each run starts a fresh interpreter,
+# executes only the module-level imports of the page (what Streamlit pays
+# before the first widget is drawn, or a server worker before it accepts
+# requests) and reports import time, resident memory and which heavy SDKs
+# got loaded. Provider SDKs are meant to load on first use, so a page
+# importing them at startup shows up here.
+#
+#   python -m bench.startup
+#   python -m bench.startup --runs 5 --budget-ms 500 --json
+#
+# Exits non-zero when a page's median import time exceeds --budget-ms.
+
+ENTRY_POINTS = ["app.py", "pages/visual_search.py", "pages/add_product_page.py", "api.py", "asgi.py"]
+HEAVY_MODULES = ["streamlit", "numpy", "pymilvus", "openai", "twelvelabs", "torch", "torchvision", "pandas", "PIL"]
+
+# Runs in the child interpreter; argv[1] is the page, argv[2] the heavy modules
+_PROBE = """
+import os, sys, ast, json, time
+
+def rss_kib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+path, heavy = sys.argv[1], sys.argv[2].split(',')
+with open(path) as f:
+    tree = ast.parse(f.read(), path)
+imports = ast.Module([node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))], [])
+code = compile(imports, path, 'exec')
+
+baseline_modules = set(sys.modules)
+rss_before = rss_kib()
+started = time.perf_counter()
+exec(code, {'__name__': '__startup__'})
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    'import_ms': elapsed * 1000,
+    'rss_mib': rss_kib() / 1024,
+    'rss_delta_mib': (rss_kib() - rss_before) / 1024,
+    'modules': len(set(sys.modules) - baseline_modules),
+    'heavy': [name for name in heavy if name in sys.modules],
+}))
+"""
+
+
+def measure(page):
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE, page, ",".join(HEAVY_MODULES)],
+        capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(page, runs):
+    samples = [measure(page) for _ in range(runs)]
+    errors = [sample["error"] for sample in samples if "error" in sample]
+    if errors:
+        return {"page": page, "error": errors[0]}
+    return {
+        "page": page,
+        "import_ms": round(statistics.median(sample["import_ms"] for sample in samples), 1),
+        "rss_mib": round(statistics.median(sample["rss_mib"] for sample in samples), 1),
+        "rss_delta_mib": round(statistics.median(sample["rss_delta_mib"] for sample in samples), 1),
+        "modules": samples[-1]["modules"],
+        "heavy": samples[-1]["heavy"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and memory of each page")
+    parser.add_argument("pages", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per page; the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail when a page imports slower than this")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    # Pages import top-level modules, as they do when run from the repo root
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = [summarize(page, args.runs) for page in args.pages]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'page':<28}{'import ms':>10}{'RSS MiB':>9}{'+MiB':>7}{'modules':>9}  heavy")
+        for result in results:
+            if "error" in result:
+                print(f"{result['page']:<28}  error: {result['error']}")
+                continue
+            print(
+                f"{result['page']:<28}{result['import_ms']:>10.1f}{result['rss_mib']:>9.1f}"
+                f"{result['rss_delta_mib']:>7.1f}{result['modules']:>9}  {', '.join(result['heavy']) or '-'}"
+            )
+
+    over_budget = [
+        result for result in results
+        if "error" in result or (args.budget_ms is not None and result["import_ms"] > args.budget_ms)
+    ]
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+from api import app
+from bench import stubs
+
+# API app wired to the local stand-ins, for HTTP load tests:
+#   gunicorn -c gunicorn.conf.py bench.stub_app:app
+stubs.install(
+    embed_ms=float(os.getenv('STUB_EMBED_MS', '80')),
+    search_ms=float(os.getenv('STUB_SEARCH_MS', '15')),
+    llm_ms=float(os.getenv('STUB_LLM_MS', '1200')),
+    products=int(os.getenv('STUB_PRODUCTS', '200'))
+)
@@ -0,0 +1,228 @@
+import re
+import json
+import time
+import asyncio
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+import numpy as np
+
+# Local stand-ins for TwelveLabs, Milvus and OpenAI with configurable
+# latency, used by the load test instead of the real services. install()
+# puts them into the shared client registry in clients.py.
+
+DIMENSION = 1024
+
+
+# Latency model: lognormal around a median, so a few calls land in the tail
+class Latency:
+
+    def __init__(self, median_ms, sigma=0.5, seed=0):
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            return self.median * self._random.lognormvariate(0, self.sigma)
+
+    def sleep(self):
+        time.sleep(self.delay())
+
+    async def asleep(self):
+        await asyncio.sleep(self.delay())
+
+
+# Deterministic unit vector for any text or byte string
+def fake_vector(seed):
+    digest = hashlib.sha256(seed if isinstance(seed, bytes) else seed.encode('utf-8')).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+    vector = rng.standard_normal(DIMENSION).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _segments(vector):
+    return SimpleNamespace(segments=[SimpleNamespace(embeddings_float=vector.tolist())])
+
+
+class FakeEmbed:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, model_name, text=None, image_file=None, **kwargs):
+        self.latency.sleep()
+        if text is not None:
+            return SimpleNamespace(text_embedding=_segments(fake_vector(text)), image_embedding=None)
+        return SimpleNamespace(text_embedding=None, image_embedding=_segments(fake_vector(image_file.read())))
+
+
+class FakeTwelveLabs:
+
+    def __init__(self, latency):
+        self.embed = FakeEmbed(latency)
+
+
+class FakeCompletions:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, model, messages, **kwargs):
+        self.latency.sleep()
+        return _completion(messages)
+
+
+class FakeAsyncCompletions:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def create(self, model, messages, **kwargs):
+        await self.latency.asleep()
+        return _completion(messages)
+
+
+def _completion(messages):
+    content = f"Stub answer for: {messages[-1]['content'][:80]}"
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeOpenAI:
+
+    def __init__(self, latency):
+        self.chat = SimpleNamespace(completions=FakeCompletions(latency))
+
+
+class FakeAsyncOpenAI:
+
+    def __init__(self, latency):
+        self.chat = SimpleNamespace(completions=FakeAsyncCompletions(latency))
+
+
+class FakeHit:
+
+    def __init__(self, row, score):
+        self.id = row['id']
+        self.score = score
+        self.metadata = row['metadata']
+        self.entity = row
+
+
+# In-memory collection with a synthetic catalog. Searches are exact cosine
+# scans, so their CPU cost grows with the catalog like a real flat index.
+class FakeCollection:
+
+    def __init__(self, latency, products=200, segments_per_product=8):
+        self.latency = latency
+        self.rows = []
+        for idx in range(products):
+            metadata = {
+                "product_id": f"P{idx:05d}",
+                "title": f"Product {idx}",
+                "description": f"Synthetic product {idx}",
+                "video_url": f"https://example.com/videos/{idx}.mp4",
+                "link": f"https://example.com/products/{idx}"
+            }
+            self._add("text", fake_vector(f"text-{idx}"), metadata)
+            for segment in range(segments_per_product):
+                start = segment * 6
+                self._add("video", fake_vector(f"video-{idx}-{segment}"), {**metadata, "start_time": start, "end_time": start + 6})
+            for segment in range(0, segments_per_product, 5):
+                start = segment * 6
+                self._add("video_coarse", fake_vector(f"coarse-{idx}-{segment}"), {**metadata, "start_time": start, "end_time": start + 30})
+        self.vectors = np.stack([row['vector'] for row in self.rows])
+        self.types = np.array([row['embedding_type'] for row in self.rows])
+        self.urls = np.array([row['metadata']['video_url'] for row in self.rows])
+
+    def _add(self, embedding_type, vector, metadata):
+        self.rows.append({"id": len(self.rows), "vector": vector, "metadata": metadata, "embedding_type": embedding_type})
+
+    def _mask(self, expr):
+        mask = np.ones(len(self.rows), dtype=bool)
+        embedding_type = re.search(r"embedding_type == '(\w+)'", expr or "")
+        if embedding_type:
+            mask &= self.types == embedding_type.group(1)
+        embedding_types = re.search(r"embedding_type in (\[.*?\])", expr or "")
+        if embedding_types:
+            mask &= np.isin(self.types, json.loads(embedding_types.group(1)))
+        urls = re.search(r'metadata\["video_url"\] in (\[.*?\])', expr or "")
+        if urls:
+            mask &= np.isin(self.urls, json.loads(urls.group(1)))
+        return mask
+
+    # Pre-migration schema: everything but the vector lives in metadata
+    def describe(self, **kwargs):
+        return {
+            "collection_name": "stub",
+            "description": "",
+            "fields": [{"name": name} for name in ("id", "vector", "metadata", "embedding_type")]
+        }
+
+    def search(self, data, anns_field, param, limit, expr=None, output_fields=None, **kwargs):
+        self.latency.sleep()
+        candidates = np.flatnonzero(self._mask(expr))
+        results = []
+        for query in data:
+            scores = self.vectors[candidates] @ np.asarray(query, dtype=np.float32)
+            top = np.argsort(-scores)[:limit]
+            results.append([FakeHit(self.rows[candidates[idx]], float(scores[idx])) for idx in top])
+        return results
+
+    def query(self, expr, output_fields=None, **kwargs):
+        self.latency.sleep()
+        product_ids = re.search(r'metadata\["product_id"\] in (\[.*?\])', expr)
+        wanted = set(json.loads(product_ids.group(1))) if product_ids else None
+        return [
+            row for row in self.rows
+            if row['embedding_type'] == 'text' and (wanted is None or row['metadata']['product_id'] in wanted)
+        ]
+
+    def query_iterator(self, batch_size=1000, expr=None, output_fields=None, **kwargs):
+        rows = [self.rows[idx] for idx in np.flatnonzero(self._mask(expr))]
+        return FakeIterator(self.latency, [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)])
+
+    def search_iterator(self, data, anns_field, param, batch_size=1000, limit=-1, expr=None, output_fields=None, **kwargs):
+        self.latency.sleep()
+        candidates = np.flatnonzero(self._mask(expr))
+        scores = self.vectors[candidates] @ np.asarray(data[0], dtype=np.float32)
+        top = np.argsort(-scores)
+        if limit is not None and limit >= 0:
+            top = top[:limit]
+        hits = [FakeHit(self.rows[candidates[idx]], float(scores[idx])) for idx in top]
+        return FakeIterator(self.latency, [hits[start:start + batch_size] for start in range(0, len(hits), batch_size)])
+
+    def insert(self, entries, **kwargs):
+        self.latency.sleep()
+
+
+# Query and search iterator over precomputed pages, paying the latency of a
+# round trip for each page like the pymilvus iterators
+class FakeIterator:
+
+    def __init__(self, latency, pages):
+        self.latency = latency
+        self.pages = pages
+
+    def next(self):
+        self.latency.sleep()
+        return self.pages.pop(0) if self.pages else []
+
+    def close(self):
+        self.pages = []
+
+
+# Replace the real clients of this process with stand-ins
+def install(embed_ms=80, search_ms=15, llm_ms=1200, products=200, seed=0):
+    import clients
+
+    clients._clients['twelvelabs'] = FakeTwelveLabs(Latency(embed_ms, seed=seed))
+    clients._clients['collection'] = FakeCollection(Latency(search_ms, seed=seed + 1), products=products)
+    clients._clients['openai'] = FakeOpenAI(Latency(llm_ms, seed=seed + 2))
+    # Async clients are registered per event loop as they are first used
+    # (see clients.get_async_openai_client), so swap the factory instead;
+    # every loop's client shares one latency model
+    async_latency = Latency(llm_ms, seed=seed + 3)
+    clients._openai_client = lambda async_client=False: FakeAsyncOpenAI(async_latency) if async_client else clients._clients['openai']
@@ -0,0 +1,73 @@
+import os
+import asyncio
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Load environment variables
+COLLECTION_NAME = os.getenv('COLLECTION_NAME')
+URL = os.getenv('URL')
+TOKEN = os.getenv('TOKEN')
+TWELVELABS_API_KEY = os.getenv('TWELVELABS_API_KEY')
+
+# Shared clients, created on first use so every process (e.g. each gunicorn
+# worker after fork) opens its own connection pool exactly once. The SDKs are
+# imported by the factories too: they dominate import time and memory, and a
+# page that never calls a provider should not pay for them.
+_clients = {}
+# Guards _creating only. Each client is created under its own lock, so a
+# factory may open other clients (a shard opens the base collection) and
+# slow connects don't hold up unrelated clients.
+_clients_lock = threading.Lock()
+_creating = {}
+
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            lock = _creating.setdefault(name, threading.Lock())
+        with lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _twelvelabs_client():
+    from twelvelabs import TwelveLabs
+    return TwelveLabs(api_key=TWELVELABS_API_KEY)
+
+
+def _openai_client(async_client=False):
+    from openai import OpenAI, AsyncOpenAI
+    return AsyncOpenAI() if async_client else OpenAI()
+
+
+def get_twelvelabs_client():
+    return _get_or_create('twelvelabs', _twelvelabs_client)
+
+
+def get_openai_client():
+    return _get_or_create('openai', _openai_client)
+
+
+# Async clients hold connections bound to an event loop, so there is one
+# per loop (normally just the process's serving or runner loop)
+def get_async_openai_client():
+    return _get_or_create(('openai_async', id(asyncio.get_running_loop())), lambda: _openai_client(async_client=True))
+
+
+def _load_collection():
+    from pymilvus import connections, Collection
+
+    connections.connect(uri=URL, token=TOKEN)
+    collection = Collection(COLLECTION_NAME)
+    collection.load()
+    return collection
+
+
+def get_collection():
+    return _get_or_create('collection', _load_collection)
@@ -0,0 +1,16 @@
+# gunicorn settings for the JSON API: gunicorn -c gunicorn.conf.py api:app
+import os
+import multiprocessing
+
+bind = os.getenv('API_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count() * 2 + 1)))
+# Requests spend most of their time waiting on TwelveLabs, Milvus and OpenAI,
+# so each worker serves several of them on threads
+worker_class = 'gthread'
+threads = int(os.getenv('API_THREADS', '4'))
+# Ingestion waits for the video embedding task to finish
+timeout = int(os.getenv('API_TIMEOUT', '600'))
+keepalive = 5
+# Clients are created lazily in each worker, never shared across a fork
+preload_app = False
+accesslog = '-'
@@ -0,0 +1,88 @@
+import os
+from array import array
+from dotenv import load_dotenv
+from results import ProductMatch, RagResponse, score_to_similarity
+from utils import lookup_products
+
+load_dotenv()
+
+# Chat messages kept per session; the oldest are evicted beyond this
+MAX_SESSION_MESSAGES = int(os.getenv('MAX_SESSION_MESSAGES', '100'))
+
+_TEXT, _VIDEO = 0, 1
+
+
+# Assistant turn as stored in session state: the answer text plus the IDs,
+# scores and offsets of its sources. Titles, descriptions and links are looked
+# up in the shared product cache when the turn is displayed.
+class CompactTurn:
+    __slots__ = ("response", "product_ids", "kinds", "scores", "starts", "ends")
+
+    def __init__(self, response, product_ids, kinds, scores, starts, ends):
+        self.response = response
+        self.product_ids = product_ids
+        self.kinds = kinds
+        self.scores = scores
+        self.starts = starts
+        self.ends = ends
+
+    @property
+    def text_count(self):
+        return self.kinds.count(_TEXT)
+
+    @property
+    def video_count(self):
+        return self.kinds.count(_VIDEO)
+
+    @property
+    def has_sources(self):
+        return bool(self.product_ids)
+
+
+def compact_response(response):
+    sources = response.sources
+    return CompactTurn(
+        response.response,
+        tuple(source.product_id for source in sources),
+        array('B', (_VIDEO if source.is_video else _TEXT for source in sources)),
+        array('d', (source.raw_score for source in sources)),
+        array('f', (source.start_time for source in sources)),
+        array('f', (source.end_time for source in sources))
+    )
+
+
+# Rebuild the full RagResponse of a stored turn for display
+def expand_turn(turn):
+    if not turn.has_sources:
+        return RagResponse(turn.response)
+
+    products = lookup_products(set(turn.product_ids))
+    sources = []
+    for idx, product_id in enumerate(turn.product_ids):
+        product = products.get(product_id, {})
+        sources.append(ProductMatch(
+            type="video" if turn.kinds[idx] == _VIDEO else "text",
+            product_id=product_id,
+            title=product.get('title') or 'Untitled',
+            description=product.get('description') or 'No description available',
+            link=product.get('link') or '#',
+            video_url=product.get('video_url') or '',
+            similarity=score_to_similarity(turn.scores[idx]),
+            raw_score=turn.scores[idx],
+            start_time=turn.starts[idx],
+            end_time=turn.ends[idx]
+        ))
+    return RagResponse(turn.response, tuple(sources))
+
+
+# Append a chat message, evicting the oldest ones beyond the session cap.
+# Returns the number of evicted messages.
+def append_message(messages, role, content):
+    if role == "assistant" and isinstance(content, RagResponse):
+        content = compact_response(content)
+    messages.append({"role": role, "content": content})
+
+    evicted = max(0, len(messages) - MAX_SESSION_MESSAGES)
+    if evicted:
+        del messages[:evicted]
+    return evicted
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Completion cache settings
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE', '1') == '1'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '.cache/llm_completions.sqlite3')
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+
+
+# Hash everything that determines a completion into a stable cache key
+def prompt_fingerprint(model, temperature, messages):
+    payload = json.dumps(
+        {"model": model, "temperature": temperature, "messages": messages},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Durable exact-match cache of LLM completions, stored in SQLite so it
+# survives restarts and is shared by every process on the host
+class CompletionCache:
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            # Products referenced by each cached completion, for invalidation
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS completion_products (
+                    product_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (product_id, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS completion_products_key ON completion_products (key)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key, response, product_ids):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO completion_products (product_id, key) VALUES (?, ?)",
+                [(str(product_id), key) for product_id in product_ids if product_id]
+            )
+            self._evict(conn)
+            conn.commit()
+
+    # Drop the least recently used entries beyond max_entries
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        stale = conn.execute(
+            "SELECT key FROM completions ORDER BY accessed_at LIMIT ?", (excess,)
+        ).fetchall()
+        self._delete(conn, [row[0] for row in stale])
+
+    def _delete(self, conn, keys):
+        conn.executemany("DELETE FROM completions WHERE key = ?", [(key,) for key in keys])
+        conn.executemany("DELETE FROM completion_products WHERE key = ?", [(key,) for key in keys])
+
+    # Remove every completion built from any of the given products
+    def invalidate_products(self, product_ids):
+        product_ids = [str(product_id) for product_id in product_ids if product_id]
+        if not product_ids:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            placeholders = ",".join("?" * len(product_ids))
+            keys = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT key FROM completion_products WHERE product_id IN ({placeholders})",
+                product_ids
+            )]
+            self._delete(conn, keys)
+            conn.commit()
+            return len(keys)
+
+
+completion_cache = CompletionCache(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES)
@@ -28,6 +28,8 @@ def add_product_data():
     with col2:
         link = st.text_input("Link", disabled=not ENABLE_INSERTIONS)
         video_url = st.text_input("Video URL", disabled=not ENABLE_INSERTIONS)
+        category = st.text_input("Category (optional)", disabled=not ENABLE_INSERTIONS)
+        price = st.number_input("Price (optional)", min_value=0.0, value=None, disabled=not ENABLE_INSERTIONS)
     
     st.markdown(
         """
@@ -66,16 +68,18 @@ def add_product_data():
                 "title": title,
                 "desc": description,
                 "link": link,
-                "video_url": video_url
+                "video_url": video_url,
+                "category": category,
+                "price": price
             }
             
             with st.spinner("Processing product..."):
-                embeddings, error = generate_embedding(product_data)
+                embeddings, error = generate_embedding(product_data, progress=st.write)
                 
                 if error:
                     st.error(f"Error processing product: {error}")
                 else:
-                    insert_result = insert_embeddings(embeddings, product_data)
+                    insert_result = insert_embeddings(embeddings, product_data, progress=st.write)
                     
                     if insert_result:
                         st.success("Product data added successfully!")
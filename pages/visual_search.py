@@ -1,9 +1,20 @@
 import streamlit as st
-from utils import search_similar_videos, create_video_embed
+from utils import iter_similar_videos, BROWSE_MAX_RESULTS
+from results import iter_matches_csv
+from posters import STATIC_DIR, STATIC_URL_PREFIX
+from rendering import render_visual_match
 import os
-from PIL import Image
+import time
+import uuid
 import io
 
+# Results per page are chosen with the slider; "Next page" pulls the next
+# page from the same search iterators instead of searching again. Only the
+# page on screen is rendered; pages already loaded are kept for "Previous".
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+# CSV exports older than this are deleted when the next one is written
+EXPORT_TTL_SECONDS = float(os.getenv('EXPORT_TTL_SECONDS', '3600'))
+
 
 def load_default_image():
     try:
@@ -15,6 +26,85 @@ def load_default_image():
         st.error(f"Error loading default image: {str(e)}")
     return None
 
+
+# Drop the current browse session and its open search iterators
+def reset_browse():
+    browse = st.session_state.pop("browse", None)
+    if browse is not None:
+        browse.close()
+    st.session_state.pop("browse_pages", None)
+    st.session_state.pop("browse_page", None)
+    st.session_state.pop("browse_export", None)
+
+
+def start_browse(image_bytes, filters, page_size):
+    reset_browse()
+    try:
+        st.session_state.browse = iter_similar_videos(image_bytes, filters=filters, batch_size=page_size)
+    except ValueError as e:
+        st.session_state.browse_error = str(e)
+        return
+    except Exception:
+        st.session_state.browse_error = "Visual search failed"
+        return
+    st.session_state.browse_pages = []
+    st.session_state.browse_page = 0
+    next_page()
+
+
+# Show the next page, fetching it from the search iterators if it was not
+# loaded yet
+def next_page():
+    pages = st.session_state.browse_pages
+    if st.session_state.browse_page + 1 < len(pages):
+        st.session_state.browse_page += 1
+        return
+    browse = st.session_state.get("browse")
+    if browse is None:
+        return
+    try:
+        pages.append(next(browse))
+    except StopIteration:
+        st.session_state.browse = None
+        return
+    except Exception:
+        st.session_state.browse = None
+        st.session_state.browse_error = "Visual search failed"
+        return
+    st.session_state.browse_page = len(pages) - 1
+
+
+def previous_page():
+    st.session_state.browse_page = max(0, st.session_state.browse_page - 1)
+
+
+# Delete exports older than EXPORT_TTL_SECONDS
+def expire_exports(directory):
+    cutoff = time.time() - EXPORT_TTL_SECONDS
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+# Write every match up to BROWSE_MAX_RESULTS to a CSV served from STATIC_DIR
+def export_csv(image_bytes, filters):
+    name = f"exports/{uuid.uuid4().hex}.csv"
+    path = os.path.join(STATIC_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    expire_exports(os.path.dirname(path))
+    try:
+        with open(path, "w", newline="") as f:
+            for chunk in iter_matches_csv(iter_similar_videos(image_bytes, filters=filters, batch_size=EXPORT_BATCH_SIZE)):
+                f.write(chunk)
+    except Exception:
+        st.session_state.browse_error = "Export failed"
+        return
+    st.session_state.browse_export = STATIC_URL_PREFIX + name
+
+
 def main():
     st.set_page_config(page_title="Visual Search", page_icon=":mag:")
     st.markdown(
@@ -127,46 +217,49 @@ def main():
                     unsafe_allow_html=True
                 )
                 
-                if st.button("Search", type="primary", use_container_width=True):
-                    with st.spinner("Searching for similar videos..."):
-                        results = search_similar_videos(uploaded_file, top_k=top_k)
-                        
-                        if not results:
-                            st.warning("No similar videos found")
-                        else:
-                            st.subheader("Results")
-                            for idx, result in enumerate(results, 1):
-                                with st.expander(f"Match #{idx} - Similarity: {result['Similarity']}", expanded=(idx==1)):
-                                    video_col, details_col = st.columns([2, 1])
-                                    
-                                    with video_col:
-                                        st.markdown("#### Video Segment")
-                                        video_embed = create_video_embed(
-                                            result['Video URL'],
-                                            float(result['Start Time'].replace('s', '')),
-                                            float(result['End Time'].replace('s', ''))
-                                        )
-                                        st.markdown(video_embed, unsafe_allow_html=True)
-                                    
-                                    with details_col:
-                                        st.markdown(f"""
-                                            #### Details
-                                            
-                                            📝 **Title**  
-                                            {result['Title']}
-                                            
-                                            📖 **Description**  
-                                            {result['Description']}
-                                            
-                                            🔗 **Link**  
-                                            [Open Product]({result['Link']})
-                                            
-                                            🕒 **Time Range**  
-                                            {result['Start Time']} - {result['End Time']}
-                                            
-                                            📊 **Similarity Score**  
-                                            {result['Similarity']}
-                                        """)
-
-if __name__ == "__main__":
-    main()
+                with st.expander("Filters"):
+                    category = st.text_input("Category", help="Only match products in this category")
+                    max_price = st.number_input("Max price", min_value=0.0, value=None, help="Leave empty for any price")
+                filters = {"category": category or None, "max_price": max_price}
+                
+                image_bytes = uploaded_file.getvalue()
+                st.button(
+                    "Search", type="primary", use_container_width=True,
+                    on_click=start_browse, args=(image_bytes, filters, top_k)
+                )
+
+                error = st.session_state.pop("browse_error", None)
+                if error:
+                    st.error(error)
+
+                pages = st.session_state.get("browse_pages")
+                if pages is not None:
+                    if not pages:
+                        st.warning("No similar videos found")
+                    else:
+                        page = st.session_state.browse_page
+                        first = sum(len(results) for results in pages[:page]) + 1
+                        st.subheader(f"Results {first}-{first + len(pages[page]) - 1}")
+                        for idx, result in enumerate(pages[page], first):
+                            render_visual_match(idx, result)
+
+                        loaded = sum(len(results) for results in pages)
+                        has_next = page + 1 < len(pages) or (
+                            st.session_state.get("browse") is not None and loaded < BROWSE_MAX_RESULTS
+                        )
+                        previous_col, next_col = st.columns(2)
+                        with previous_col:
+                            if page > 0:
+                                st.button("Previous page", use_container_width=True, on_click=previous_page)
+                        with next_col:
+                            if has_next:
+                                st.button("Next page", use_container_width=True, on_click=next_page)
+
+                        st.button(
+                            "Export CSV", use_container_width=True,
+                            on_click=export_csv, args=(image_bytes, filters),
+                            help=f"Up to {BROWSE_MAX_RESULTS} matches, best first"
+                        )
+                        export = st.session_state.get("browse_export")
+                        if export:
+                            st.markdown(f"[Download CSV]({export})")
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import logging
+import urllib.request
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Poster frames of video segments, extracted at ingest and served by
+# Streamlit's static file serving (.streamlit/config.toml). Result lists show
+# these instead of players. Every app host needs the same STATIC_DIR, e.g.
+# a shared volume, since posters are written by whichever host ingests.
+
+POSTERS_ENABLED = os.getenv('POSTERS', '1') == '1'
+STATIC_DIR = os.getenv('STATIC_DIR', 'static')
+STATIC_URL_PREFIX = os.getenv('STATIC_URL_PREFIX', '/app/static/')
+POSTER_WIDTH = int(os.getenv('POSTER_WIDTH', '480'))
+POSTER_QUALITY = int(os.getenv('POSTER_QUALITY', '75'))
+# Seconds to wait on the network when opening or reading a video
+POSTER_TIMEOUT = float(os.getenv('POSTER_TIMEOUT', '20'))
+# Vimeo's player config, which lists the playable files of a video
+VIMEO_CONFIG_URL = "https://player.vimeo.com/video/{}/config"
+
+
+# Poster path under STATIC_DIR. Derived from the segment alone, so results
+# rebuilt from compact history find their posters too.
+def poster_name(video_url, start_time):
+    digest = hashlib.sha1(video_url.encode('utf-8')).hexdigest()[:16]
+    return f"posters/{digest}-{int(round(float(start_time or 0) * 1000))}.jpg"
+
+
+# URL of a poster, or "" when it was never extracted
+def poster_url(name):
+    if name and os.path.isfile(os.path.join(STATIC_DIR, name)):
+        return STATIC_URL_PREFIX + name
+    return ""
+
+
+# Decodable media URL of a video. Vimeo links are player pages, so they are
+# resolved through the player config to the smallest progressive MP4 at
+# least POSTER_WIDTH wide, or to the HLS playlist when there is none.
+def media_url(video_url):
+    if 'vimeo.com' not in video_url:
+        return video_url
+    video_id = video_url.rstrip('/').split('/')[-1].split('?')[0]
+    with urllib.request.urlopen(VIMEO_CONFIG_URL.format(video_id), timeout=POSTER_TIMEOUT) as response:
+        files = json.load(response)['request']['files']
+
+    progressive = sorted(files.get('progressive') or [], key=lambda file: file.get('width') or 0)
+    if progressive:
+        wide_enough = [file for file in progressive if (file.get('width') or 0) >= POSTER_WIDTH]
+        return (wide_enough or progressive[-1:])[0]['url']
+    hls = files['hls']
+    return hls['cdns'][hls['default_cdn']]['url']
+
+
+# Save a decoded frame as a downscaled JPEG
+def save_poster(frame, video_url, start_time):
+    import torch
+    from torchvision.io import write_jpeg
+    from torchvision.transforms.functional import resize
+
+    image = torch.from_numpy(frame.to_ndarray(format='rgb24')).permute(2, 0, 1).contiguous()
+    height, width = image.shape[-2:]
+    if width > POSTER_WIDTH:
+        image = resize(image, [round(height * POSTER_WIDTH / width), POSTER_WIDTH], antialias=True)
+
+    name = poster_name(video_url, start_time)
+    path = os.path.join(STATIC_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_jpeg(image, path, quality=POSTER_QUALITY)
+    return name
+
+
+# Decode the first frame at or after each start time from one open stream,
+# seeking to the keyframe before each start, and save it as a poster.
+# Returns {start_time: poster name, or None when it could not be decoded}.
+def extract_posters(video_url, start_times):
+    import av
+
+    names = {}
+    with av.open(media_url(video_url), timeout=POSTER_TIMEOUT) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        for start_time in sorted(start_times):
+            names[start_time] = None
+            target = int(float(start_time) / stream.time_base) + (stream.start_time or 0)
+            try:
+                container.seek(target, stream=stream)
+                for frame in container.decode(stream):
+                    if frame.pts is not None and frame.pts >= target:
+                        names[start_time] = save_poster(frame, video_url, start_time)
+                        break
+            except Exception:
+                logger.warning("Could not extract poster of %s at %ss", video_url, start_time, exc_info=True)
+    return names
+
+
+# Extract a poster for every distinct segment start and record it in the
+# segment metadata. Returns the number of posters written.
+def attach_posters(segments, video_url):
+    if not POSTERS_ENABLED:
+        return 0
+    try:
+        import av  # noqa: F401
+        import torchvision  # noqa: F401
+    except ImportError:
+        logger.warning("PyAV or torchvision is not installed; skipping posters")
+        return 0
+
+    try:
+        names = extract_posters(video_url, {segment['metadata']['start_time'] for segment in segments})
+    except Exception:
+        logger.warning("Could not open %s for posters", video_url, exc_info=True)
+        return 0
+    for segment in segments:
+        name = names.get(segment['metadata']['start_time'])
+        if name:
+            segment['metadata']['poster'] = name
+    return sum(1 for name in names.values() if name)
@@ -0,0 +1,188 @@
+import os
+import io
+import json
+import time
+import uuid
+import random
+import pstats
+import logging
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Request profiling. A profiled request runs under cProfile and records the
+# wall time of each stage() it passes through; the profile (.prof, readable
+# with pstats or snakeviz) and a JSON summary are saved under PROFILE_DIR,
+# named by request ID. Requests are profiled when PROFILE=1, when the caller
+# asks (?profile=1), or at random with probability PROFILE_SAMPLE_RATE.
+# Unprofiled requests only pay for one context variable lookup per stage.
+#
+# cProfile only sees the thread that enabled it. Requests whose work runs on
+# a shared event loop (the async pipeline) pass cprofile=False: interleaved
+# tasks would pollute a loop-wide profile, so those requests are timed by
+# their stages, and their synchronous stages on the request's own thread
+# (e.g. Streamlit rendering) use cprofile_stage() to run under cProfile.
+# Stage timings follow the request into tasks and worker threads through its
+# context (see attach()).
+
+PROFILE_ALL = os.getenv('PROFILE') == '1'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '.cache/profiles')
+# Functions listed in the JSON summary, by cumulative time
+PROFILE_TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', '25'))
+
+_current = contextvars.ContextVar('profile', default=None)
+# Only one cProfile profiler can be active per interpreter; concurrent
+# profiled requests still record their stage timings
+_profiler_lock = threading.Lock()
+
+
+class RequestProfile:
+
+    def __init__(self, kind, request_id=None):
+        self.kind = kind
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.stages = []
+        self.profiler = None
+        # Whether the profiler runs for the whole request rather than only
+        # during cprofile_stage()s
+        self.whole_request = False
+        self.started = time.perf_counter()
+        self.total = None
+
+    def record(self, name, elapsed):
+        self.stages.append({"stage": name, "ms": round(elapsed * 1000, 2)})
+
+    def summary(self):
+        summary = {
+            "request_id": self.request_id,
+            "kind": self.kind,
+            "created_at": time.time(),
+            "total_ms": round(self.total * 1000, 2),
+            "stages": self.stages,
+            "cprofile": self.profiler is not None
+        }
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler, stream=io.StringIO())
+            summary["top_functions"] = [
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "own_ms": round(own * 1000, 2),
+                    "cumulative_ms": round(cumulative * 1000, 2)
+                }
+                for (filename, line, name), (_, calls, own, cumulative, _) in
+                sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+            ]
+        return summary
+
+    def save(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.kind}-{self.request_id}")
+        if self.profiler is not None:
+            self.profiler.dump_stats(f"{base}.prof")
+        with open(f"{base}.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        return base
+
+
+def should_profile(requested=False):
+    return requested or PROFILE_ALL or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+# Profile the enclosed request if it is selected (see should_profile).
+# Yields the RequestProfile, or None when the request is not profiled.
+@contextmanager
+def profile_request(kind, requested=False, request_id=None, cprofile=True):
+    if _current.get() is not None or not should_profile(requested):
+        yield None
+        return
+
+    profile = RequestProfile(kind, request_id)
+    token = _current.set(profile)
+    if cprofile and _profiler_lock.acquire(blocking=False):
+        profile.profiler = cProfile.Profile()
+        try:
+            profile.profiler.enable()
+            profile.whole_request = True
+        except ValueError:
+            # Another profiling tool (e.g. a debugger) is active
+            profile.profiler = None
+            _profiler_lock.release()
+    try:
+        yield profile
+    finally:
+        if profile.whole_request:
+            profile.profiler.disable()
+            _profiler_lock.release()
+        profile.total = time.perf_counter() - profile.started
+        _current.reset(token)
+        try:
+            path = profile.save()
+            logger.info("Saved %s profile %s (%.0f ms) to %s", kind, profile.request_id, profile.total * 1000, path)
+        except Exception:
+            logger.exception("Error saving profile")
+
+
+# Profile of the request being handled in this context, if any
+def current_profile():
+    return _current.get()
+
+
+# Record the enclosed stages into `profile`, e.g. in a task started on
+# another thread's event loop on behalf of the request
+@contextmanager
+def attach(profile):
+    token = _current.set(profile)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+# Time a stage of the current request when it is being profiled
+@contextmanager
+def stage(name):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record(name, time.perf_counter() - started)
+
+
+# stage() that also runs cProfile over the enclosed code, on the calling
+# thread, for requests profiled with cprofile=False. Every such stage of a
+# request adds to the same profile and .prof file.
+@contextmanager
+def cprofile_stage(name):
+    profile = _current.get()
+    if profile is None or profile.whole_request or not _profiler_lock.acquire(blocking=False):
+        with stage(name):
+            yield
+        return
+    try:
+        if profile.profiler is None:
+            profile.profiler = cProfile.Profile()
+        with stage(name):
+            try:
+                profile.profiler.enable()
+            except ValueError:
+                # Another profiling tool (e.g. a debugger) is active
+                yield
+                return
+            try:
+                yield
+            finally:
+                profile.profiler.disable()
+    finally:
+        _profiler_lock.release()
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from dotenv import load_dotenv
+from pymilvus import Collection, utility
+from clients import COLLECTION_NAME, get_collection, get_twelvelabs_client
+from schema import create_collection, vector_index, collection_properties
+from scheduler import BACKGROUND, priority_lane
+from resilience import guarded
+from shards import SHARD_CATEGORIES, all_shards, shard_model
+from utils import (
+    EMBEDDING_MODEL, SEARCH_PARAMS, CLIP_LAYERS, layer_embedding_type,
+    provider_call, generate_embedding, insert_embeddings
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Zero-downtime re-embedding. COLLECTION_NAME must be a collection alias; the
+# app re-reads which collection it resolves to (and that collection's model)
+# every COLLECTION_REFRESH_SECONDS.
+#
+#   python reindex.py cutover products_v1         # once: rename the COLLECTION_NAME collection, alias it
+#   python reindex.py build products_v2 --model Marengo-retrieval-3.0 --rate 20
+#   python reindex.py verify products_v2
+#   python reindex.py swap products_v2            # verifies again, then moves the alias
+#   python reindex.py rollback                    # moves the alias back to products_v1
+#
+# Products ingested while a build runs go to the live collection only; run
+# build again before swapping (it resumes) and verify reports any missing.
+# Old collections are never dropped by this script.
+#
+# Category shards (SHARD_CATEGORIES) are separate collections outside the
+# alias; swap refuses to move the alias to a model that any existing shard
+# was not embedded with, since queries would then be embedded for the new
+# model and compared with old-model shard vectors.
+
+# Products re-embedded per minute while building a shadow collection
+REINDEX_RATE = float(os.getenv('REINDEX_RATE', '20'))
+# Where swap records the previous collection for rollback
+REINDEX_STATE_PATH = os.getenv('REINDEX_STATE_PATH', '.cache/reindex.json')
+# Recall check: sampled products, search depth and allowed drop versus the live collection
+VERIFY_SAMPLE = int(os.getenv('REINDEX_VERIFY_SAMPLE', '50'))
+VERIFY_TOP_K = int(os.getenv('REINDEX_VERIFY_TOP_K', '5'))
+VERIFY_TOLERANCE = float(os.getenv('REINDEX_VERIFY_TOLERANCE', '0.05'))
+
+
+def open_collection(name):
+    # get_collection() also opens the connection
+    get_collection()
+    collection = Collection(name)
+    collection.load()
+    return collection
+
+
+def model_of(collection):
+    return collection_properties(collection.description).get('embedding_model', EMBEDDING_MODEL)
+
+
+# Collection the alias currently resolves to
+def alias_target(alias=COLLECTION_NAME):
+    return open_collection(alias).describe()['collection_name']
+
+
+# One-time move from a physical collection named COLLECTION_NAME to an alias:
+# Milvus rejects an alias that matches a collection name, so the collection
+# is renamed to `versioned_name` first and the alias created for it. Queries
+# by COLLECTION_NAME fail only between those two calls. Does nothing when
+# COLLECTION_NAME is already an alias.
+def cutover(versioned_name):
+    current = alias_target()
+    if current != COLLECTION_NAME:
+        return {"alias": COLLECTION_NAME, "collection": current, "renamed": False}
+    if utility.has_collection(versioned_name):
+        raise RuntimeError(f"Collection {versioned_name} already exists")
+
+    utility.rename_collection(COLLECTION_NAME, versioned_name)
+    try:
+        utility.create_alias(collection_name=versioned_name, alias=COLLECTION_NAME)
+    except Exception:
+        logger.exception("Creating the alias failed; restoring the collection name")
+        utility.rename_collection(versioned_name, COLLECTION_NAME)
+        raise
+    return {"alias": COLLECTION_NAME, "collection": versioned_name, "renamed": True}
+
+
+# Product fields (as generate_embedding expects them) from the text rows
+def iter_products(collection, batch_size=500):
+    iterator = collection.query_iterator(
+        batch_size=batch_size,
+        expr="embedding_type == 'text'",
+        output_fields=["metadata"]
+    )
+    try:
+        while True:
+            batch = guarded('milvus_query', iterator.next)
+            if not batch:
+                break
+            for row in batch:
+                metadata = row['metadata']
+                yield {
+                    "product_id": metadata['product_id'],
+                    "title": metadata.get('title', ''),
+                    "desc": metadata.get('description', ''),
+                    "link": metadata.get('link', ''),
+                    "video_url": metadata['video_url'],
+                    "category": metadata.get('category'),
+                    "price": metadata.get('price')
+                }
+    finally:
+        iterator.close()
+
+
+def product_ids(collection):
+    return {product['product_id'] for product in iter_products(collection)}
+
+
+# Re-embed every product of the live collection into a shadow collection at
+# `rate` products per minute. Resumable: products already in the shadow
+# collection are skipped.
+def build_shadow(target_name, model_name, rate=REINDEX_RATE, progress=None):
+    report = progress or logger.info
+    source = open_collection(COLLECTION_NAME)
+    if utility.has_collection(target_name):
+        target = open_collection(target_name)
+        if model_of(target) != model_name:
+            raise ValueError(f"{target_name} was built with {model_of(target)}, not {model_name}")
+        done = product_ids(target)
+        report(f"Resuming {target_name}: {len(done)} products already embedded")
+    else:
+        dimension = next(field.params['dim'] for field in source.schema.fields if field.name == 'vector')
+        target = create_collection(target_name, dimension, vector_index(source), {"embedding_model": model_name})
+        done = set()
+
+    interval = 60 / rate if rate > 0 else 0
+    embedded = failed = 0
+    with priority_lane(BACKGROUND):
+        for product_info in iter_products(source):
+            if product_info['product_id'] in done:
+                continue
+            started = time.monotonic()
+            embeddings, error = generate_embedding(product_info, model_name=model_name)
+            if error or not insert_embeddings(embeddings, product_info, collection=target):
+                failed += 1
+                report(f"Failed to re-embed {product_info['product_id']}: {error}")
+            else:
+                embedded += 1
+                done.add(product_info['product_id'])
+                report(f"Re-embedded {product_info['product_id']} ({len(done)} total)")
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+    target.flush()
+    return {"target": target_name, "model": model_name, "embedded": embedded, "failed": failed, "products": len(done)}
+
+
+# Share of sampled products whose own text row is in the top k when searched
+# by their title and description, embedded with the collection's model
+def self_recall(collection, products, top_k):
+    if not products:
+        return None
+    model_name = model_of(collection)
+    twelvelabs_client = get_twelvelabs_client()
+    hits = 0
+    for product in products:
+        vector = provider_call(
+            'twelvelabs_embed', 'twelvelabs', 'embed',
+            twelvelabs_client.embed.create,
+            model_name=model_name,
+            text=f"{product['title']}. {product['desc']}",
+            priority=BACKGROUND
+        ).text_embedding.segments[0].embeddings_float
+        results = guarded(
+            'milvus_search',
+            collection.search,
+            data=[vector],
+            anns_field="vector",
+            param=SEARCH_PARAMS,
+            limit=top_k,
+            expr="embedding_type == 'text'",
+            output_fields=["metadata"]
+        )
+        if any(hit.metadata.get('product_id') == product['product_id'] for hit in results[0]):
+            hits += 1
+    return hits / len(products)
+
+
+def count_rows(collection, embedding_type):
+    result = collection.query(expr=f"embedding_type == '{embedding_type}'", output_fields=["count(*)"])
+    return result[0]["count(*)"]
+
+
+# Compare a shadow collection with the live one: same products, video rows
+# for every layer, and self-retrieval recall no worse than VERIFY_TOLERANCE
+def verify_shadow(target_name, sample=VERIFY_SAMPLE, top_k=VERIFY_TOP_K, tolerance=VERIFY_TOLERANCE):
+    source = open_collection(COLLECTION_NAME)
+    target = open_collection(target_name)
+
+    source_products = {product['product_id']: product for product in iter_products(source)}
+    target_products = product_ids(target)
+    missing = sorted(set(source_products) - target_products)
+
+    counts = {}
+    for embedding_type in ["text"] + [layer_embedding_type(name) for name, _ in CLIP_LAYERS]:
+        counts[embedding_type] = {"live": count_rows(source, embedding_type), "shadow": count_rows(target, embedding_type)}
+    empty_layers = [name for name, count in counts.items() if count["live"] and not count["shadow"]]
+
+    sampled = random.Random(0).sample(sorted(source_products), min(sample, len(source_products)))
+    live_recall = self_recall(source, [source_products[product_id] for product_id in sampled], top_k)
+    shadow_recall = self_recall(target, [source_products[product_id] for product_id in sampled if product_id in target_products], top_k)
+
+    recall_ok = live_recall is None or (shadow_recall is not None and shadow_recall >= live_recall - tolerance)
+    return {
+        "live": source.describe()['collection_name'],
+        "shadow": target_name,
+        "models": {"live": model_of(source), "shadow": model_of(target)},
+        "products": {"live": len(source_products), "shadow": len(target_products), "missing": missing[:20]},
+        "rows": counts,
+        "recall_at_k": {"k": top_k, "sample": len(sampled), "live": live_recall, "shadow": shadow_recall},
+        "ok": not missing and not empty_layers and recall_ok
+    }
+
+
+def _load_state():
+    try:
+        with open(REINDEX_STATE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(state):
+    os.makedirs(os.path.dirname(REINDEX_STATE_PATH) or ".", exist_ok=True)
+    with open(REINDEX_STATE_PATH, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+# Atomically point COLLECTION_NAME at `target_name`, remembering the
+# collection it replaced
+def swap_alias(target_name, force=False):
+    report = None if force else verify_shadow(target_name)
+    if report is not None and not report["ok"]:
+        raise RuntimeError(f"Verification failed, not swapping:\n{json.dumps(report, indent=2)}")
+
+    if SHARD_CATEGORIES:
+        target_model = model_of(open_collection(target_name))
+        stale = [
+            shard for shard in all_shards()[1:]
+            if shard_model(shard, EMBEDDING_MODEL) not in (None, target_model)
+        ]
+        if stale:
+            raise RuntimeError(
+                f"Shards {', '.join(stale)} are not embedded with {target_model}; "
+                "re-embed them before swapping"
+            )
+
+    previous = alias_target()
+    if previous == target_name:
+        return {"alias": COLLECTION_NAME, "collection": target_name, "previous": None}
+    open_collection(target_name)
+    utility.alter_alias(collection_name=target_name, alias=COLLECTION_NAME)
+    _save_state({"alias": COLLECTION_NAME, "collection": target_name, "previous": previous, "swapped_at": time.time()})
+    return {"alias": COLLECTION_NAME, "collection": target_name, "previous": previous, "verification": report}
+
+
+# Point COLLECTION_NAME back at the collection the last swap replaced
+def rollback():
+    state = _load_state()
+    if state.get("alias") != COLLECTION_NAME or not state.get("previous"):
+        raise RuntimeError("No swap to roll back")
+    return swap_alias(state["previous"], force=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-embed the catalog into a shadow collection and swap the alias")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    cutover_parser = subcommands.add_parser(
+        "cutover", help="Rename the COLLECTION_NAME collection and make COLLECTION_NAME an alias of it"
+    )
+    cutover_parser.add_argument("collection", nargs="?", default=f"{COLLECTION_NAME}_v1", help="New name of the collection")
+    build = subcommands.add_parser("build", help="Re-embed every product into a shadow collection")
+    build.add_argument("target")
+    build.add_argument("--model", default=EMBEDDING_MODEL)
+    build.add_argument("--rate", type=float, default=REINDEX_RATE, help="Products per minute (0 for unthrottled)")
+    verify = subcommands.add_parser("verify", help="Compare a shadow collection with the live one")
+    verify.add_argument("target")
+    verify.add_argument("--sample", type=int, default=VERIFY_SAMPLE)
+    verify.add_argument("--top-k", type=int, default=VERIFY_TOP_K)
+    swap = subcommands.add_parser("swap", help="Verify, then point COLLECTION_NAME at the shadow collection")
+    swap.add_argument("target")
+    swap.add_argument("--force", action="store_true", help="Skip verification")
+    subcommands.add_parser("rollback", help="Point COLLECTION_NAME back at the previous collection")
+    args = parser.parse_args(argv)
+
+    if args.command == "cutover":
+        result = cutover(args.collection)
+    elif args.command == "build":
+        result = build_shadow(args.target, args.model, args.rate, progress=print)
+    elif args.command == "verify":
+        result = verify_shadow(args.target, args.sample, args.top_k)
+    elif args.command == "swap":
+        result = swap_alias(args.target, args.force)
+    else:
+        result = rollback()
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,267 @@
+import html
+import json
+from functools import lru_cache
+import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.runtime import get_instance
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from posters import poster_name, poster_url
+
+# Rendering of retrieval results. utils returns plain ProductMatch and
+# RagResponse objects; every page draws them through the helpers below.
+
+
+# Whether the browser session of the running script has gone away, e.g. the
+# user closed the tab; pending queries for it can be cancelled
+def session_closed():
+    ctx = get_script_run_ctx()
+    return ctx is not None and not get_instance().is_active_session(ctx.session_id)
+
+
+# Extract video ID and platform from URL
+def get_video_id_from_url(video_url):
+    if 'vimeo.com' in video_url:
+        video_id = video_url.split('/')[-1].split('?')[0]
+        return video_id, 'vimeo'
+    return video_url, 'direct'
+
+
+# Format time in seconds to URL compatible format
+def format_time_for_url(time_in_seconds):
+    try:
+        return str(int(float(time_in_seconds)))
+    except (TypeError, ValueError):
+        return "0"
+
+
+PLAYER_HEIGHT = 315
+# Precomputed similar products listed on a result card
+SIMILAR_ITEMS_SHOWN = 4
+
+
+# Create an embedded video player starting at start_time. The HTML only
+# depends on its arguments, so it is built once and memoized.
+@lru_cache(maxsize=1024)
+def video_embed_html(video_url, start_time=0, autoplay=False):
+    if not video_url:
+        return "<p>No video available</p>"
+
+    video_id, platform = get_video_id_from_url(video_url)
+    start_seconds = format_time_for_url(start_time)
+    if platform == 'vimeo':
+        return f"""
+            <iframe
+                width="100%"
+                height="{PLAYER_HEIGHT}"
+                src="https://player.vimeo.com/video/{video_id}?autoplay={int(autoplay)}#t={start_seconds}s"
+                frameborder="0"
+                allow="autoplay; fullscreen; picture-in-picture"
+                allowfullscreen>
+            </iframe>
+        """
+    # The media fragment seeks to the segment without any script
+    return f"""
+        <video
+            width="100%"
+            height="{PLAYER_HEIGHT}"
+            controls
+            {"autoplay" if autoplay else ""}
+            preload="metadata">
+            <source src="{html.escape(video_url, quote=True)}#t={start_seconds}" type="video/mp4">
+            Your browser does not support the video tag.
+        </video>
+    """
+
+
+# Click-to-load stand-in for a player: the segment's poster frame (or a plain
+# tile) with a play button. Nothing is fetched from the video host until the
+# user clicks, which swaps in the real player.
+@lru_cache(maxsize=1024)
+def video_facade_html(video_url, start_time, poster):
+    player = video_embed_html(video_url, start_time, autoplay=True)
+    background = f"url({json.dumps(poster)}) center / cover no-repeat, #111" if poster else "#111"
+    return f"""
+        <div id="facade" title="Play video" style="
+            position: relative; width: 100%; height: {PLAYER_HEIGHT}px; cursor: pointer;
+            border-radius: 8px; background: {html.escape(background, quote=True)};">
+            <div style="
+                position: absolute; top: 50%; left: 50%; transform: translate(-50%, -50%);
+                width: 64px; height: 64px; border-radius: 50%; background: rgba(129, 232, 49, 0.9);
+                color: white; font-size: 28px; line-height: 64px; text-align: center;">&#9654;</div>
+            <div style="
+                position: absolute; bottom: 8px; right: 8px; padding: 2px 8px; border-radius: 4px;
+                background: rgba(0, 0, 0, 0.6); color: white; font: 12px sans-serif;">{format_time_for_url(start_time)}s</div>
+        </div>
+        <script>
+            document.getElementById("facade").addEventListener("click", function () {{
+                this.outerHTML = {json.dumps(player)};
+            }}, {{once: true}});
+        </script>
+    """
+
+
+# Render a segment as a click-to-load player
+def render_video(video_url, start_time=0, poster=""):
+    if not video_url:
+        st.markdown("<p>No video available</p>", unsafe_allow_html=True)
+        return
+    poster = poster_url(poster or poster_name(video_url, start_time))
+    components.html(video_facade_html(video_url, start_time, poster), height=PLAYER_HEIGHT + 10)
+
+
+# Store button HTML for a product link, or "" when there is no link
+@lru_cache(maxsize=1024)
+def store_link_html(link):
+    if not link or not link.strip():
+        return ""
+    return f"""
+        <div style="margin-top: 1rem;">
+            <a href="{link}"
+               target="_blank"
+               style="
+                   display: inline-block;
+                   background-color: #81E831;
+                   color: white;
+                   padding: 10px 20px;
+                   border-radius: 20px;
+                   text-decoration: none;
+                   font-weight: 500;
+                   margin-top: 10px;
+                   border: none;
+                   cursor: pointer;
+               ">
+                View on Store
+            </a>
+        </div>
+    """
+
+
+# Product card HTML. Matches are immutable, so each card is built once and
+# reused on every rerun that shows it again.
+@lru_cache(maxsize=1024)
+def product_card_html(source):
+    # Determine section title
+    section_title = "📹 Video Segment" if source.is_video else "📝 Product Details"
+    segment_html = f'<p style="color: #666;">Segment Time: {source.start_time:.1f}s - {source.end_time:.1f}s</p>' if source.is_video else ''
+    return f"""
+        <div style="background-color: white; padding: 1.5rem; border-radius: 10px; box-shadow: 0 2px 5px rgba(0,0,0,0.1);">
+            <h3 style="color: #333; margin-bottom: 1rem;">{section_title}</h3>
+            <h4 style="color: #81E831;">{source.title or 'No Title'}</h4>
+            <div style="margin: 1rem 0;">
+                <div style="background: linear-gradient(90deg, #81E831 {source.similarity}%, #f1f1f1 {source.similarity}%);
+                     height: 6px; border-radius: 3px; margin-bottom: 0.5rem;"></div>
+                <p style="color: #666;">Similarity Score: {source.similarity}%</p>
+            </div>
+            <p style="color: #333; font-size: 1.1em;">{source.description}</p>
+            <p style="color: #666;">Product ID: {source.product_id or 'N/A'}</p>
+            {segment_html}
+        </div>
+    """
+
+
+# "Similar items" list from the precomputed similarity graph (see similar.py).
+# A local lookup; nothing is shown until the graph has been built.
+def render_similar_items(product_id):
+    from similar import similar_products
+
+    items = similar_products(product_id, SIMILAR_ITEMS_SHOWN)
+    if not items:
+        return
+    links = "".join(
+        f'<li><a href="{html.escape(item["link"] or "#", quote=True)}" target="_blank">'
+        f'{html.escape(item["title"] or item["product_id"])}</a></li>'
+        for item in items
+    )
+    st.markdown(
+        f'<div style="margin-top: 1rem; color: #666;">Similar items<ul>{links}</ul></div>',
+        unsafe_allow_html=True
+    )
+
+
+def render_product_details(source):
+    with st.container():
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            st.markdown(product_card_html(source), unsafe_allow_html=True)
+            link_html = store_link_html(source.link)
+            if link_html:
+                st.markdown(link_html, unsafe_allow_html=True)
+            if source.product_id:
+                render_similar_items(source.product_id)
+
+        with col2:
+            if source.video_url:
+                # Product descriptions play the video from the start
+                start_time = source.start_time if source.is_video else 0
+                render_video(source.video_url, start_time, source.poster)
+
+
+# Utitily function to render results in the chat interface
+def render_results_section(response):
+    if not response.sources:
+        return
+
+    with st.expander("View Product Details 🛍️", expanded=True):
+        text_sources = response.text_sources
+        video_sources = response.video_sources
+
+        st.markdown(f"""
+            <div style="margin-bottom: 2rem; padding: 1rem; background-color: #f8f9fa; border-radius: 8px;">
+                <h4 style="color: #333;">Search Results Summary</h4>
+                <p>Found {len(response.sources)} relevant matches:</p>
+                <ul>
+                    <li>{len(text_sources)} product descriptions</li>
+                    <li>{len(video_sources)} video segments</li>
+                </ul>
+            </div>
+        """, unsafe_allow_html=True)
+
+        if text_sources:
+            st.markdown("### 📝 Retrieved Products")
+            for source in text_sources:
+                render_product_details(source)
+                st.markdown('<hr style="margin: 2rem 0;">', unsafe_allow_html=True)
+
+        if video_sources:
+            st.markdown("### 📹 Matching Product Videos")
+            for source in video_sources:
+                render_product_details(source)
+                st.markdown('<hr style="margin: 2rem 0;">', unsafe_allow_html=True)
+
+
+# One-line summary of an older answer, shown instead of its product cards
+def render_results_summary(text_count, video_count):
+    st.caption(f"{text_count} product descriptions, {video_count} video segments")
+
+
+# Render one visual search match as an expander with player and details
+def render_visual_match(idx, result):
+    with st.expander(f"Match #{idx} - Similarity: {result.similarity}%", expanded=(idx==1)):
+        video_col, details_col = st.columns([2, 1])
+
+        with video_col:
+            st.markdown("#### Video Segment")
+            render_video(result.video_url, result.start_time, result.poster)
+
+        with details_col:
+            st.markdown(f"""
+                #### Details
+
+                📝 **Title**  
+                {result.title}
+
+                📖 **Description**  
+                {result.description}
+
+                🔗 **Link**  
+                [Open Product]({result.link})
+
+                🕒 **Time Range**  
+                {result.start_time:.1f}s - {result.end_time:.1f}s
+
+                📊 **Similarity Score**  
+                {result.similarity}%
+            """)
+            if result.product_id:
+                render_similar_items(result.product_id)
@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from scheduler import is_retryable
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Default deadline in seconds per dependency. Override with
+# DEADLINE_<DEPENDENCY>, e.g. DEADLINE_MILVUS_SEARCH=2.
+DEFAULT_DEADLINES = {
+    'twelvelabs_embed': 8.0,
+    'twelvelabs_task': 30.0,
+    'milvus_search': 3.0,
+    'milvus_query': 5.0,
+    'openai_chat': 30.0,
+}
+# Consecutive failures that open a circuit, and seconds before it half-opens
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', '30'))
+# Hedging waits for this latency percentile before sending a duplicate
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+HEDGING_ENABLED = os.getenv('HEDGING', '1') == '1'
+
+# Threads that run guarded calls so callers can stop waiting at the deadline.
+# A guarded call is a single attempt (the scheduler retries around it), so an
+# attempt abandoned at its deadline occupies a thread only until the SDK
+# returns and is never retried.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('RESILIENCE_WORKERS', '256')),
+    thread_name_prefix='dependency'
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# Closed -> open after too many consecutive failures; open -> half-open after
+# the reset timeout, letting a single trial call decide whether to close again
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self.trial_running):
+                raise CircuitOpenError(f"{self.name} is unavailable")
+            if state == "half-open":
+                self.trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuit for %s opened after %d failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+
+# Recent successful call latencies, for percentile-based hedging delays
+class LatencyTracker:
+
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+# An external dependency called with a deadline, a circuit breaker and,
+# for idempotent reads, optional hedged duplicate requests
+class Dependency:
+
+    def __init__(self, name, deadline):
+        self.name = name
+        self.deadline = deadline
+        self.breaker = CircuitBreaker(name, BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+        self.latency = LatencyTracker()
+        self.timeouts = 0
+        self.hedges = 0
+
+    def _submit(self, fn, args, kwargs):
+        # Each attempt runs in its own copy of the caller's context
+        return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def call(self, fn, *args, hedge=False, **kwargs):
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            result = self._run(fn, args, kwargs, hedge and HEDGING_ENABLED, started + self.deadline)
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded) or is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                # The dependency answered; the request itself was bad
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    # call() for coroutine functions; the deadline cancels the coroutine
+    async def acall(self, fn, *args, **kwargs):
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            raise DeadlineExceeded(f"{self.name} did not answer within {self.deadline}s")
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def _run(self, fn, args, kwargs, hedge, deadline):
+        pending = {self._submit(fn, args, kwargs)}
+
+        if hedge and len(self.latency) >= HEDGE_MIN_SAMPLES:
+            delay = min(self.latency.percentile(HEDGE_PERCENTILE), max(0, deadline - time.monotonic()))
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                self.hedges += 1
+                pending.add(self._submit(fn, args, kwargs))
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+
+        if pending:
+            for future in pending:
+                future.cancel()
+            self.timeouts += 1
+            raise DeadlineExceeded(f"{self.name} did not answer within {self.deadline}s")
+        raise error
+
+    def metrics(self):
+        p95 = self.latency.percentile(95)
+        return {
+            "state": self.breaker.state,
+            "deadline": self.deadline,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges
+        }
+
+
+dependencies = {
+    name: Dependency(name, float(os.getenv(f"DEADLINE_{name}".upper(), str(deadline))))
+    for name, deadline in DEFAULT_DEADLINES.items()
+}
+
+
+# Call fn through the named dependency's deadline and circuit breaker
+def guarded(name, fn, *args, hedge=False, **kwargs):
+    return dependencies[name].call(fn, *args, hedge=hedge, **kwargs)
+
+
+# guarded() for coroutine functions
+async def aguarded(name, fn, *args, **kwargs):
+    return await dependencies[name].acall(fn, *args, **kwargs)
+
+
+def dependency_metrics():
+    return {name: dependency.metrics() for name, dependency in dependencies.items()}
@@ -0,0 +1,89 @@
+import io
+import csv
+from dataclasses import dataclass, field, fields, asdict
+
+
+# Convert a raw cosine score from [-1,1] to a [0,100] similarity percentage
+def score_to_similarity(score):
+    similarity = round((score + 1) * 50, 2)
+    return max(0, min(100, similarity))
+
+
+# One retrieved product description or video segment
+@dataclass(frozen=True)
+class ProductMatch:
+    type: str
+    product_id: str
+    title: str
+    description: str
+    link: str
+    video_url: str
+    similarity: float
+    raw_score: float
+    start_time: float = 0.0
+    end_time: float = 0.0
+    poster: str = ""
+
+    @property
+    def is_video(self):
+        return self.type == "video"
+
+    @classmethod
+    def from_hit(cls, match_type, metadata, score):
+        return cls(
+            type=match_type,
+            product_id=metadata.get('product_id', ''),
+            title=metadata.get('title', 'Untitled'),
+            description=metadata.get('description', 'No description available'),
+            link=metadata.get('link', '#'),  # Default to '#' if no link
+            video_url=metadata.get('video_url', ''),
+            similarity=score_to_similarity(score),
+            raw_score=score,
+            start_time=float(metadata.get('start_time', 0) or 0),
+            end_time=float(metadata.get('end_time', 0) or 0),
+            poster=metadata.get('poster') or ""
+        )
+
+
+# Answer of the shopping assistant with the matches it was based on
+@dataclass(frozen=True)
+class RagResponse:
+    response: str
+    sources: tuple = field(default_factory=tuple)
+
+    @property
+    def text_sources(self):
+        return [source for source in self.sources if not source.is_video]
+
+    @property
+    def video_sources(self):
+        return [source for source in self.sources if source.is_video]
+
+    def to_dict(self):
+        return {
+            "response": self.response,
+            "metadata": {
+                "sources": [asdict(source) for source in self.sources],
+                "total_sources": len(self.sources),
+                "text_sources": len(self.text_sources),
+                "video_sources": len(self.video_sources)
+            } if self.sources else None
+        }
+
+
+CSV_FIELDS = [match_field.name for match_field in fields(ProductMatch)]
+
+
+# CSV text of batches of matches, one chunk per batch, so exports never hold
+# more than a batch in memory
+def iter_matches_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_FIELDS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(asdict(match) for match in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,333 @@
+import os
+import time
+import asyncio
+import heapq
+import random
+import logging
+import itertools
+import threading
+import contextlib
+import contextvars
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Default per-process limits as (requests per second, burst). Override with
+# RATE_LIMIT_<PROVIDER>_<ENDPOINT>=<rate>[/<burst>], e.g.
+# RATE_LIMIT_OPENAI_CHAT=5/10. With several worker processes, give each one
+# its share of the provider quota.
+DEFAULT_LIMITS = {
+    ('twelvelabs', 'embed'): (10, 10),
+    ('twelvelabs', 'embed_task'): (1, 2),
+    ('twelvelabs', 'embed_task_status'): (5, 5),
+    ('openai', 'chat'): (5, 10),
+}
+# Requests in flight per provider
+MAX_CONCURRENCY = int(os.getenv('PROVIDER_MAX_CONCURRENCY', '8'))
+# Retry settings for rate-limited and transient failures
+MAX_RETRIES = int(os.getenv('PROVIDER_MAX_RETRIES', '4'))
+BACKOFF_BASE = float(os.getenv('PROVIDER_BACKOFF_BASE', '0.5'))
+BACKOFF_MAX = float(os.getenv('PROVIDER_BACKOFF_MAX', '20'))
+# How often coroutines waiting for a token or slot check again
+ASYNC_POLL_SECONDS = 0.01
+# How often threads waiting for a token check whether their caller gave up
+CANCEL_POLL_SECONDS = 0.25
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Lane used by calls that don't pass an explicit priority
+_current_priority = contextvars.ContextVar('provider_priority', default=INTERACTIVE)
+# Event set once the caller of the enclosed provider calls stopped waiting
+_current_cancel = contextvars.ContextVar('provider_cancel', default=None)
+
+
+# Raised in place of queueing or retrying for a caller that has given up
+class CallCancelled(Exception):
+    pass
+
+
+# Run the enclosed provider calls in the given lane, e.g. background warm-up
+@contextlib.contextmanager
+def priority_lane(priority):
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+# Give up the enclosed provider calls once `event` is set: calls still
+# queued for a token, or waiting to retry, raise CallCancelled instead
+@contextlib.contextmanager
+def cancel_on(event):
+    token = _current_cancel.set(event)
+    try:
+        yield
+    finally:
+        _current_cancel.reset(token)
+
+
+# Lane and cancel event of provider calls made from here, so that work done
+# on behalf of this caller in another thread can adopt them
+def call_context():
+    return _current_priority.get(), _current_cancel.get()
+
+
+# Cancel event of a call shared by several callers: set once every one of
+# their events is set
+class AllCancelled:
+
+    def __init__(self, events):
+        self.events = events
+
+    def is_set(self):
+        return all(event.is_set() for event in self.events)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, CANCEL_POLL_SECONDS))
+        return True
+
+
+# Run the enclosed provider calls on behalf of callers with the given
+# call_context()s: in the most urgent of their lanes, and cancelled only once
+# all of them gave up (never, if any of them cannot give up)
+@contextlib.contextmanager
+def on_behalf_of(contexts):
+    events = [event for _, event in contexts]
+    cancelled = None if any(event is None for event in events) else AllCancelled(events)
+    with priority_lane(min(priority for priority, _ in contexts)), cancel_on(cancelled):
+        yield
+
+
+# Classic token bucket refilled continuously at `rate` tokens per second
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Take a token and return 0, or return the seconds until one is available
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# Queue of callers for one provider endpoint. Waiting callers are ordered by
+# (priority, arrival) and only the head may take a token, so interactive
+# queries always overtake queued background work.
+class _Lane:
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, ticket, cancelled=None):
+        started = time.monotonic()
+        # Waiters poll when their caller may give up, else sleep until woken
+        poll = CANCEL_POLL_SECONDS if cancelled is not None else None
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        raise CallCancelled("Caller gave up while queued")
+                    if self.waiting[0] == ticket:
+                        delay = self.bucket.take()
+                        if delay == 0:
+                            heapq.heappop(self.waiting)
+                            self.cond.notify_all()
+                            break
+                        self.cond.wait(min(delay, poll or delay))
+                    else:
+                        self.cond.wait(poll)
+            except BaseException:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+                raise
+            self.wait_seconds += time.monotonic() - started
+
+    # acquire() for coroutines: polls instead of blocking the event loop
+    async def acquire_async(self, ticket):
+        started = time.monotonic()
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+        try:
+            while True:
+                with self.cond:
+                    if self.waiting[0] == ticket:
+                        delay = self.bucket.take()
+                        if delay == 0:
+                            heapq.heappop(self.waiting)
+                            self.cond.notify_all()
+                            self.wait_seconds += time.monotonic() - started
+                            return
+                    else:
+                        delay = ASYNC_POLL_SECONDS
+                await asyncio.sleep(min(delay, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self.cond:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+            raise
+
+    def count(self, counter):
+        with self.cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+# Whether an SDK error is worth retrying: rate limits, timeouts and 5xx
+def is_retryable(error):
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if status in RETRYABLE_STATUS:
+        return True
+    name = type(error).__name__
+    return any(marker in name for marker in ('RateLimit', 'Timeout', 'Connection', 'ServiceUnavailable', 'InternalServer'))
+
+
+# Seconds the provider asked us to wait, if it sent a Retry-After header
+def retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+# Shared scheduler for every call to an external provider
+class RequestScheduler:
+
+    def __init__(self, limits, max_concurrency):
+        self.limits = limits
+        self.max_concurrency = max_concurrency
+        self._lanes = {}
+        self._slots = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls):
+        limits = dict(DEFAULT_LIMITS)
+        for provider, endpoint in DEFAULT_LIMITS:
+            value = os.getenv(f"RATE_LIMIT_{provider}_{endpoint}".upper())
+            if value:
+                rate, _, burst = value.partition('/')
+                limits[(provider, endpoint)] = (float(rate), float(burst or max(1.0, float(rate))))
+        return cls(limits, MAX_CONCURRENCY)
+
+    def _lane(self, provider, endpoint):
+        key = (provider, endpoint)
+        with self._lock:
+            if key not in self._lanes:
+                rate, burst = self.limits.get(key, (10, 10))
+                self._lanes[key] = _Lane(rate, burst)
+            if provider not in self._slots:
+                self._slots[provider] = threading.BoundedSemaphore(self.max_concurrency)
+                self._in_flight[provider] = 0
+            return self._lanes[key]
+
+    def _track(self, provider, delta):
+        with self._lock:
+            self._in_flight[provider] += delta
+
+    # Run fn(*args, **kwargs) within the endpoint's rate limit, retrying
+    # retryable failures with full-jitter exponential backoff. Time spent
+    # queued here is not part of fn: wrap fn itself (e.g. with guarded) to
+    # bound each attempt.
+    def call(self, provider, endpoint, fn, *args, priority=None, **kwargs):
+        if priority is None:
+            priority = _current_priority.get()
+        cancelled = _current_cancel.get()
+        lane = self._lane(provider, endpoint)
+        for attempt in range(MAX_RETRIES + 1):
+            lane.acquire((priority, next(self._sequence)), cancelled)
+            with self._slots[provider]:
+                self._track(provider, 1)
+                try:
+                    lane.count('calls')
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    if attempt == MAX_RETRIES or not is_retryable(e):
+                        lane.count('failures')
+                        raise
+                    delay = retry_after(e) or random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                    lane.count('retries')
+                    logger.warning("%s %s failed (%s), retrying in %.2fs", provider, endpoint, type(e).__name__, delay)
+                finally:
+                    self._track(provider, -1)
+            if cancelled is None:
+                time.sleep(delay)
+            elif cancelled.wait(delay):
+                raise CallCancelled("Caller gave up before the retry")
+
+    # call() for coroutine functions, sharing the same lanes, concurrency
+    # slots and counters
+    async def acall(self, provider, endpoint, fn, *args, priority=None, **kwargs):
+        if priority is None:
+            priority = _current_priority.get()
+        lane = self._lane(provider, endpoint)
+        slot = self._slots[provider]
+        for attempt in range(MAX_RETRIES + 1):
+            await lane.acquire_async((priority, next(self._sequence)))
+            while not slot.acquire(blocking=False):
+                await asyncio.sleep(ASYNC_POLL_SECONDS)
+            self._track(provider, 1)
+            try:
+                lane.count('calls')
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == MAX_RETRIES or not is_retryable(e):
+                    lane.count('failures')
+                    raise
+                delay = retry_after(e) or random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                lane.count('retries')
+                logger.warning("%s %s failed (%s), retrying in %.2fs", provider, endpoint, type(e).__name__, delay)
+            finally:
+                self._track(provider, -1)
+                slot.release()
+            await asyncio.sleep(delay)
+
+    # Queue depth and counters per provider endpoint
+    def metrics(self):
+        with self._lock:
+            lanes = dict(self._lanes)
+            in_flight = dict(self._in_flight)
+        return {
+            f"{provider}.{endpoint}": {
+                "queue_depth": len(lane.waiting),
+                "in_flight": in_flight.get(provider, 0),
+                "calls": lane.calls,
+                "retries": lane.retries,
+                "failures": lane.failures,
+                "wait_seconds": round(lane.wait_seconds, 3)
+            }
+            for (provider, endpoint), lane in lanes.items()
+        }
+
+
+scheduler = RequestScheduler.from_env()
@@ -0,0 +1,161 @@
+import sys
+import json
+import logging
+import argparse
+from clients import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Hot metadata fields stored as typed scalar columns next to the JSON
+# metadata, as (pymilvus DataType name, extra field params, default, scalar
+# index type). Filters on these columns use scalar indexes instead of
+# JSON-path scans. Types are named rather than imported so query paths can
+# use this table without loading pymilvus.
+SCALAR_COLUMNS = {
+    "product_id": ("VARCHAR", {"max_length": 128}, "", "INVERTED"),
+    "category": ("VARCHAR", {"max_length": 128}, "", "INVERTED"),
+    "video_url": ("VARCHAR", {"max_length": 2048}, "", "INVERTED"),
+    "price": ("FLOAT", {}, -1.0, "STL_SORT"),
+    "start_time": ("FLOAT", {}, 0.0, "STL_SORT"),
+    "end_time": ("FLOAT", {}, 0.0, "STL_SORT"),
+}
+
+DEFAULT_VECTOR_INDEX = {
+    "index_type": "HNSW",
+    "metric_type": "COSINE",
+    "params": {"M": 16, "efConstruction": 200}
+}
+MIGRATION_BATCH_SIZE = 1000
+
+
+# Whether a collection with these field names has the promoted scalar columns
+def has_scalar_columns(field_names):
+    names = set(field_names)
+    return all(name in names for name in SCALAR_COLUMNS)
+
+
+# Properties recorded as JSON in a collection description (e.g. the
+# embedding model written by reindex.py); {} for plain descriptions
+def collection_properties(description):
+    try:
+        properties = json.loads(description or "{}")
+    except ValueError:
+        return {}
+    return properties if isinstance(properties, dict) else {}
+
+
+# Values of the promoted columns for a row, taken from its metadata
+def scalar_values(metadata):
+    values = {}
+    for name, (data_type, _, default, _) in SCALAR_COLUMNS.items():
+        value = metadata.get(name)
+        if value is None or value == "":
+            values[name] = default
+        elif data_type == "FLOAT":
+            values[name] = float(value)
+        else:
+            values[name] = str(value)
+    return values
+
+
+def build_schema(dimension, properties=None):
+    from pymilvus import CollectionSchema, FieldSchema, DataType
+
+    fields = [
+        FieldSchema("id", DataType.INT64, is_primary=True),
+        FieldSchema("vector", DataType.FLOAT_VECTOR, dim=dimension),
+        FieldSchema("metadata", DataType.JSON),
+        FieldSchema("embedding_type", DataType.VARCHAR, max_length=32),
+    ]
+    for name, (data_type, params, _, _) in SCALAR_COLUMNS.items():
+        fields.append(FieldSchema(name, getattr(DataType, data_type), **params))
+    return CollectionSchema(fields, description=json.dumps(properties or {}))
+
+
+# Create a collection with the scalar-column schema and its indexes
+def create_collection(name, dimension, vector_index=None, properties=None, using="default"):
+    from pymilvus import Collection
+
+    collection = Collection(name, build_schema(dimension, properties), using=using)
+    collection.create_index("vector", vector_index or DEFAULT_VECTOR_INDEX)
+    collection.create_index("embedding_type", {"index_type": "INVERTED"}, index_name="embedding_type_idx")
+    for field_name, (_, _, _, index_type) in SCALAR_COLUMNS.items():
+        collection.create_index(field_name, {"index_type": index_type}, index_name=f"{field_name}_idx")
+    collection.load()
+    return collection
+
+
+# Index parameters of a collection's vector field, or None
+def vector_index(collection):
+    for index in collection.indexes:
+        if index.field_name == "vector":
+            return {key: value for key, value in index.params.items() if key in ("index_type", "metric_type", "params")}
+    return None
+
+
+# Copy every row of an old-schema collection into a new collection with the
+# promoted columns. Search keeps using the source until COLLECTION_NAME (or
+# its alias) is pointed at the target.
+def migrate_collection(source_name, target_name, batch_size=MIGRATION_BATCH_SIZE, progress=None):
+    from pymilvus import Collection, utility
+
+    report = progress or logger.info
+    # get_collection() also opens the connection
+    source = get_collection()
+    if source_name is not None:
+        source = Collection(source_name)
+        source.load()
+    if utility.has_collection(target_name):
+        raise ValueError(f"Collection {target_name} already exists")
+
+    dimension = next(field.params["dim"] for field in source.schema.fields if field.name == "vector")
+    target = create_collection(target_name, dimension, vector_index(source), collection_properties(source.description))
+
+    copied = 0
+    iterator = source.query_iterator(
+        batch_size=batch_size,
+        expr="id >= 0",
+        output_fields=["id", "vector", "metadata", "embedding_type"]
+    )
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            target.insert([
+                {
+                    "id": row["id"],
+                    "vector": row["vector"],
+                    "metadata": row["metadata"],
+                    "embedding_type": row["embedding_type"],
+                    **scalar_values(row["metadata"] or {})
+                }
+                for row in batch
+            ])
+            copied += len(batch)
+            report(f"Copied {copied} rows")
+    finally:
+        iterator.close()
+
+    target.flush()
+    source_rows, target_rows = source.num_entities, target.num_entities
+    if source_rows != target_rows:
+        raise RuntimeError(f"Row count mismatch after migration: {source_rows} != {target_rows}")
+    return {"source": source.name, "target": target_name, "rows": target_rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collection schema tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate", help="Copy a collection into the scalar-column schema")
+    migrate.add_argument("target", help="Name of the new collection")
+    migrate.add_argument("--source", help="Collection to copy (default: COLLECTION_NAME)")
+    migrate.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    print(json.dumps(migrate_collection(args.source, args.target, args.batch_size, progress=print), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
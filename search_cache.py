@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Search result cache settings
+SEARCH_CACHE_ENABLED = os.getenv('SEARCH_CACHE', '1') == '1'
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '2048'))
+# Versions only see writes made by this process; entries older than this are
+# searched again so other processes' inserts show up too
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))
+
+
+# Hash a query vector and its search parameters into a cache key
+def search_key(vector, params):
+    digest = hashlib.sha256(array('f', vector).tobytes())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# In-memory LRU of vector search results. Every shard has a version that
+# writes bump; an entry is only served while its shard is still at the
+# version the entry was searched under.
+class SearchResultCache:
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _version(self, shard):
+        return self._versions.get(shard, 0)
+
+    # Cached results (None on a miss) and the version a new search for the
+    # key must be stored under
+    def get(self, shard, key):
+        with self._lock:
+            version = self._version(shard)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, stored_at, results = entry
+                if entry_version == version and time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return results, version
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            return None, version
+
+    # Cache results unless the shard was written while they were searched
+    def put(self, shard, key, version, results):
+        with self._lock:
+            if version != self._version(shard):
+                return
+            self._entries[key] = (version, time.monotonic(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Invalidate the results of a shard. Its stale entries are dropped when
+    # next looked up or evicted.
+    def bump(self, shard):
+        with self._lock:
+            self._versions[shard] = self._versions.get(shard, 0) + 1
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "versions": dict(self._versions)
+            }
+
+
+search_cache = SearchResultCache(SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL)
@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from clients import COLLECTION_NAME, TOKEN, URL, _get_or_create, get_collection
+from schema import create_collection, vector_index, collection_properties
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Category shards. Products of each category in SHARD_CATEGORIES live in
+# their own collection "<COLLECTION_NAME>_<category>"; all other products
+# stay in COLLECTION_NAME. Each shard can be served by its own Milvus
+# deployment via SHARD_URL_<CATEGORY> (and SHARD_TOKEN_<CATEGORY>). An empty
+# SHARD_CATEGORIES keeps everything in COLLECTION_NAME.
+SHARD_CATEGORIES = [
+    category.strip().lower()
+    for category in os.getenv('SHARD_CATEGORIES', '').split(',')
+    if category.strip()
+]
+# Words in a query that select a category's shard, as
+# "category=word|word;category=word", e.g.
+# SHARD_KEYWORDS="dresses=dress|dresses|gown;shoes=shoe|shoes|sneakers".
+# A category without keywords is selected by its own name only.
+SHARD_KEYWORDS = {
+    category.strip().lower(): [word.strip().lower() for word in words.split('|') if word.strip()]
+    for category, _, words in (
+        item.partition('=') for item in os.getenv('SHARD_KEYWORDS', '').split(';') if item.strip()
+    )
+}
+# Threads for searching shards in parallel
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '16'))
+# How long a shard found missing is skipped before checking again
+SHARD_REFRESH_SECONDS = float(os.getenv('SHARD_REFRESH_SECONDS', '30'))
+
+_executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix='shard')
+
+
+def _slug(category):
+    return re.sub(r'[^a-z0-9]+', '_', category.lower()).strip('_')
+
+
+# Collection holding products of a category
+def shard_name(category):
+    if category and category.strip().lower() in SHARD_CATEGORIES:
+        return f"{COLLECTION_NAME}_{_slug(category)}"
+    return COLLECTION_NAME
+
+
+def all_shards():
+    return [COLLECTION_NAME] + [shard_name(category) for category in SHARD_CATEGORIES]
+
+
+# Open a shard's collection; a missing one is created when `create` is set
+# and otherwise returned as None
+def _open_shard(name, create=False):
+    from pymilvus import connections, Collection, utility
+
+    category = name[len(COLLECTION_NAME) + 1:].upper()
+    uri = os.getenv(f"SHARD_URL_{category}", URL)
+    connections.connect(alias=name, uri=uri, token=os.getenv(f"SHARD_TOKEN_{category}", TOKEN))
+
+    if not utility.has_collection(name, using=name):
+        if not create:
+            return None
+        # Shards are created with the base collection's layout
+        base = get_collection()
+        dimension = next(field.params['dim'] for field in base.schema.fields if field.name == 'vector')
+        logger.info("Creating shard %s on %s", name, uri)
+        return create_collection(
+            name, dimension, vector_index(base), collection_properties(base.description), using=name
+        )
+
+    collection = Collection(name, using=name)
+    collection.load()
+    return collection
+
+
+# Shards found missing, by when they were checked
+_missing = {}
+
+
+# Collection object of a shard, connected on first use. Returns None for a
+# shard that does not exist yet unless `create` is set; only ingestion and
+# `python shards.py create` create shards.
+def get_shard(name, create=False):
+    if name == COLLECTION_NAME:
+        return get_collection()
+    checked = _missing.get(name)
+    if not create and checked is not None and time.monotonic() - checked < SHARD_REFRESH_SECONDS:
+        return None
+
+    collection = _get_or_create(('shard', name), lambda: _open_shard(name, create))
+    if collection is None:
+        _missing[name] = time.monotonic()
+    else:
+        _missing.pop(name, None)
+    return collection
+
+
+# Embedding model a shard's vectors were made with (`default` when it does
+# not record one), or None when the shard does not exist
+def shard_model(name, default):
+    collection = get_shard(name)
+    if collection is None:
+        return None
+    return collection_properties(collection.description).get('embedding_model', default)
+
+
+# The given shards that exist, falling back to COLLECTION_NAME (which also
+# holds products ingested before their category was sharded)
+def available_shards(shards):
+    available = [shard for shard in shards if get_shard(shard) is not None]
+    return available or [COLLECTION_NAME]
+
+
+# Whole-word pattern matching any keyword of a category
+def _keyword_pattern(category):
+    words = SHARD_KEYWORDS.get(category) or [category]
+    return re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b")
+
+
+# Shards worth searching: those of the filtered categories, else those of
+# categories whose keywords appear in the query text, else all of them
+def select_shards(text="", filters=None):
+    if not SHARD_CATEGORIES:
+        return [COLLECTION_NAME]
+
+    category = (filters or {}).get('category')
+    if category:
+        categories = category if isinstance(category, (list, tuple)) else [category]
+        return available_shards(sorted({shard_name(str(item)) for item in categories}))
+
+    text = text.lower()
+    inferred = [
+        shard_name(category) for category in SHARD_CATEGORIES
+        if _keyword_pattern(category).search(text)
+    ]
+    return available_shards(inferred or all_shards())
+
+
+# Run fn(shard) for every shard, in parallel when there are several.
+# Returns {shard: result}; a failing shard is logged and left out unless
+# every shard failed.
+def fan_out(fn, shards):
+    if len(shards) == 1:
+        return {shards[0]: fn(shards[0])}
+
+    futures = {
+        shard: _executor.submit(contextvars.copy_context().run, fn, shard)
+        for shard in shards
+    }
+    results = {}
+    error = None
+    for shard, future in futures.items():
+        try:
+            results[shard] = future.result()
+        except Exception as e:
+            logger.warning("Shard %s failed: %s", shard, e)
+            error = e
+    if not results:
+        raise error
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Category shard tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("create", help="Create every configured shard that does not exist yet")
+    subcommands.add_parser("list", help="Show which configured shards exist")
+    args = parser.parse_args(argv)
+
+    for shard in all_shards():
+        if args.command == "create":
+            get_shard(shard, create=True)
+        print(f"{shard}: {'present' if get_shard(shard) is not None else 'missing'}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,418 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import base64
+import shutil
+import logging
+import argparse
+import threading
+import contextlib
+import numpy as np
+from dotenv import load_dotenv
+from snapshot import load_snapshot
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Precomputed "more like this" graph: for every product, its SIMILAR_TOP_N
+# nearest products by cosine similarity of pooled product vectors (the text
+# vector plus the mean of the fine video segment vectors). Built offline from
+# a snapshot (see snapshot.py) and kept current as insert_embeddings adds
+# products, so looking up similar items is a local array read. Layout of
+# SIMILAR_GRAPH_PATH:
+#   current            symlink to the live generation, swapped atomically
+#   graph-<id>/        one generation, never modified once written:
+#     vectors.f32        float32 [products, dimension] pooled unit vectors
+#     neighbors.i32      int32 [products, top_n] product indices, -1 if unused
+#     scores.f16         float16 [products, top_n] cosine similarities
+#     products.json      [product_id, title, link] per product
+#     manifest.json      product count, dimension and top_n
+#   pending.jsonl      products added since the live generation was written;
+#                      replayed on load and folded into a new generation
+#                      every SIMILAR_COMPACT_AFTER additions
+#   .lock              held by writers, across processes
+
+GRAPH_VERSION = 1
+SIMILAR_GRAPH_PATH = os.getenv('SIMILAR_GRAPH_PATH', '.cache/similar')
+SIMILAR_TOP_N = int(os.getenv('SIMILAR_TOP_N', '10'))
+# Products whose similarities are computed per matrix multiplication
+SIMILAR_BATCH_SIZE = int(os.getenv('SIMILAR_BATCH_SIZE', '1024'))
+# Added products appended to pending.jsonl before a new generation is written
+SIMILAR_COMPACT_AFTER = int(os.getenv('SIMILAR_COMPACT_AFTER', '256'))
+# Generations kept on disk, so readers that just resolved `current` can
+# still open the one they resolved
+KEEP_GENERATIONS = 3
+
+
+def _normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+# Pooled unit vector of one product
+def pool_product_vector(text_vector, video_vectors):
+    parts = []
+    if text_vector is not None:
+        parts.append(_normalize(np.asarray(text_vector, dtype=np.float32)))
+    if len(video_vectors):
+        parts.append(_normalize(_normalize(np.asarray(video_vectors, dtype=np.float32)).mean(axis=0)))
+    return _normalize(np.sum(parts, axis=0))
+
+
+# Top-n neighbors of each row of `queries` among `vectors`, as (indices,
+# scores) padded with -1 / -inf. `offset` is the index of the first query
+# row in `vectors`, so products are not their own neighbors.
+def _top_neighbors(queries, vectors, top_n, offset=None):
+    similarities = queries @ vectors.T
+    if offset is not None:
+        rows = np.arange(len(queries))
+        similarities[rows, rows + offset] = -np.inf
+
+    k = min(top_n, vectors.shape[0])
+    neighbors = np.full((len(queries), top_n), -1, dtype=np.int32)
+    scores = np.full((len(queries), top_n), -np.inf, dtype=np.float32)
+    if k:
+        candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(similarities, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        neighbors[:, :k] = np.take_along_axis(candidates, order, axis=1)
+        scores[:, :k] = np.take_along_axis(candidate_scores, order, axis=1)
+    neighbors[~np.isfinite(scores)] = -1
+    return neighbors, scores
+
+
+class SimilarityGraph:
+
+    def __init__(self, products, vectors, neighbors, scores):
+        self.products = products
+        # Rows past len(products) are spare capacity for add()
+        self._vectors = vectors
+        self._neighbors = neighbors
+        self._scores = scores
+        self.index = {product[0]: idx for idx, product in enumerate(products)}
+
+    @property
+    def vectors(self):
+        return self._vectors[:len(self.products)]
+
+    @property
+    def neighbors(self):
+        return self._neighbors[:len(self.products)]
+
+    @property
+    def scores(self):
+        return self._scores[:len(self.products)]
+
+    @property
+    def top_n(self):
+        return self._neighbors.shape[1]
+
+    def __len__(self):
+        return len(self.products)
+
+    # Double the row capacity when it runs out, so a run of adds copies the
+    # arrays a logarithmic number of times
+    def _reserve(self, rows):
+        capacity = self._vectors.shape[0]
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity, 16)
+        for name, fill in (("_vectors", 0), ("_neighbors", -1), ("_scores", 0)):
+            current = getattr(self, name)
+            grown = np.full((capacity, current.shape[1]), fill, dtype=current.dtype)
+            grown[:current.shape[0]] = current
+            setattr(self, name, grown)
+
+    # Similar products as dicts of product_id, title, link and score
+    def similar(self, product_id, limit=None):
+        idx = self.index.get(product_id)
+        if idx is None:
+            return []
+        items = []
+        for neighbor, score in zip(self.neighbors[idx], self.scores[idx]):
+            if neighbor < 0 or (limit is not None and len(items) >= limit):
+                break
+            neighbor_id, title, link = self.products[neighbor]
+            items.append({"product_id": neighbor_id, "title": title, "link": link, "score": float(score)})
+        return items
+
+    # Add a product, or replace one with the same ID, updating the neighbor
+    # lists of every product it now ranks in
+    def add(self, product_id, title, link, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        idx = self.index.get(product_id)
+        if idx is None:
+            idx = len(self.products)
+            self._reserve(idx + 1)
+            self.products.append([product_id, title, link])
+            self.index[product_id] = idx
+            self._neighbors[idx] = -1
+            self._scores[idx] = 0
+        else:
+            self.products[idx] = [product_id, title, link]
+        self._vectors[idx] = vector
+
+        neighbors, scores = _top_neighbors(vector[None, :], self.vectors, self.top_n, offset=idx)
+        self.neighbors[idx] = neighbors[0]
+        self.scores[idx] = np.where(neighbors[0] >= 0, scores[0], 0)
+
+        # Re-rank the product in every other list: drop its old entry, then
+        # insert it where it beats the weakest neighbor or fills a free slot
+        similarities = self.vectors @ vector
+        weakest = np.where(self.neighbors[:, -1] >= 0, self.scores[:, -1].astype(np.float32), -np.inf)
+        affected = np.flatnonzero((similarities > weakest) | (self.neighbors == idx).any(axis=1))
+        for row in affected:
+            if row == idx:
+                continue
+            entries = [
+                (float(score), int(neighbor))
+                for neighbor, score in zip(self.neighbors[row], self.scores[row])
+                if neighbor >= 0 and neighbor != idx
+            ]
+            entries.append((float(similarities[row]), idx))
+            entries.sort(reverse=True)
+            entries = entries[:self.top_n]
+            self.neighbors[row] = [neighbor for _, neighbor in entries] + [-1] * (self.top_n - len(entries))
+            self.scores[row] = [score for score, _ in entries] + [0] * (self.top_n - len(entries))
+
+    # Write the graph into a new directory; see _publish for making it live
+    def save(self, path):
+        os.makedirs(path)
+        self.vectors.astype(np.float32).tofile(os.path.join(path, "vectors.f32"))
+        self.neighbors.astype(np.int32).tofile(os.path.join(path, "neighbors.i32"))
+        self.scores.astype(np.float16).tofile(os.path.join(path, "scores.f16"))
+        with open(os.path.join(path, "products.json"), "w") as f:
+            json.dump(self.products, f)
+        manifest = {
+            "version": GRAPH_VERSION,
+            "created_at": time.time(),
+            "products": len(self.products),
+            "dimension": self.vectors.shape[1],
+            "top_n": self.top_n
+        }
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def load_graph(path):
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["version"] != GRAPH_VERSION:
+        raise ValueError(f"Unsupported graph version {manifest['version']}")
+    with open(os.path.join(path, "products.json")) as f:
+        products = json.load(f)
+
+    rows, dimension, top_n = manifest["products"], manifest["dimension"], manifest["top_n"]
+    return SimilarityGraph(
+        products,
+        np.fromfile(os.path.join(path, "vectors.f32"), dtype=np.float32).reshape(rows, dimension),
+        np.fromfile(os.path.join(path, "neighbors.i32"), dtype=np.int32).reshape(rows, top_n),
+        np.fromfile(os.path.join(path, "scores.f16"), dtype=np.float16).reshape(rows, top_n)
+    )
+
+
+# Pooled product vectors of a snapshot, with [product_id, title, link] rows
+def snapshot_products(snapshot):
+    product_ids = snapshot.columns["product_id"]
+    titles = snapshot.columns.get("title")
+    links = snapshot.columns.get("link")
+    text_rows = np.flatnonzero(snapshot.type_mask("text"))
+    video_rows = np.flatnonzero(snapshot.type_mask("video"))
+
+    index = {}
+    products = []
+    for row in np.concatenate([text_rows, video_rows]):
+        product_id = product_ids[row]
+        if product_id is not None and product_id not in index:
+            index[product_id] = len(products)
+            products.append([
+                product_id,
+                titles[row] if titles is not None else None,
+                links[row] if links is not None else None
+            ])
+
+    dimension = snapshot.vectors.shape[1]
+    text = np.zeros((len(products), dimension), dtype=np.float32)
+    video = np.zeros((len(products), dimension), dtype=np.float32)
+    video_counts = np.zeros(len(products), dtype=np.float32)
+    for rows, target in ((text_rows, text), (video_rows, video)):
+        owners = np.array([index.get(product_ids[row], -1) for row in rows], dtype=np.int64)
+        known = owners >= 0
+        np.add.at(target, owners[known], _normalize(np.asarray(snapshot.vectors[rows[known]])))
+        if target is video:
+            np.add.at(video_counts, owners[known], 1)
+
+    video /= np.maximum(video_counts, 1)[:, None]
+    vectors = _normalize(_normalize(text) + _normalize(video))
+    return products, vectors
+
+
+# Cross-process lock held while publishing a generation or adding products
+@contextlib.contextmanager
+def _writer_lock(path):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _pending_path(path):
+    return os.path.join(path, "pending.jsonl")
+
+
+# Directory name of the live generation, or None before the first build
+def _live_generation(path):
+    try:
+        return os.readlink(os.path.join(path, "current"))
+    except FileNotFoundError:
+        return None
+
+
+# Write the graph as a new generation and repoint `current` at it with a
+# rename, which replaces the symlink atomically. Call with the writer lock.
+def _publish(graph, path):
+    generation = f"graph-{time.time_ns()}-{os.getpid()}"
+    manifest = graph.save(os.path.join(path, generation))
+    link = os.path.join(path, f".{generation}.link")
+    os.symlink(generation, link)
+    os.replace(link, os.path.join(path, "current"))
+
+    generations = sorted(name for name in os.listdir(path) if name.startswith("graph-"))
+    for stale in generations[:-KEEP_GENERATIONS]:
+        shutil.rmtree(os.path.join(path, stale), ignore_errors=True)
+    return manifest
+
+
+# Build the graph from a snapshot with batched matrix multiplications
+def build_graph(snapshot_path, path=SIMILAR_GRAPH_PATH, top_n=SIMILAR_TOP_N, batch_size=SIMILAR_BATCH_SIZE, progress=None):
+    report = progress or logger.info
+    products, vectors = snapshot_products(load_snapshot(snapshot_path))
+    neighbors = np.full((len(products), top_n), -1, dtype=np.int32)
+    scores = np.zeros((len(products), top_n), dtype=np.float16)
+
+    for start in range(0, len(products), batch_size):
+        end = min(start + batch_size, len(products))
+        batch_neighbors, batch_scores = _top_neighbors(vectors[start:end], vectors, top_n, offset=start)
+        neighbors[start:end] = batch_neighbors
+        scores[start:end] = np.where(batch_neighbors >= 0, batch_scores, 0)
+        report(f"Ranked neighbors of {end}/{len(products)} products")
+
+    # Products added while this build ran stay in pending.jsonl and are
+    # replayed on top of the new generation
+    with _writer_lock(path):
+        return _publish(SimilarityGraph(products, vectors, neighbors, scores), path)
+
+
+# Graph of this process: the live generation plus the pending products
+# replayed up to `offset` bytes. Readers and add_product hold _graph_lock,
+# so a lookup never sees a half-applied add.
+_graph = {"graph": None, "generation": None, "offset": 0}
+_graph_lock = threading.Lock()
+
+
+# Bring this process's graph up to date with _graph_lock held: reload when
+# another process published a generation, then replay new pending products
+def _refresh(path):
+    generation = _live_generation(path)
+    if generation != _graph["generation"]:
+        _graph["graph"] = load_graph(os.path.join(path, generation)) if generation is not None else None
+        _graph["generation"], _graph["offset"] = generation, 0
+    graph = _graph["graph"]
+    if graph is None:
+        return None
+
+    try:
+        with open(_pending_path(path), "rb") as f:
+            if os.fstat(f.fileno()).st_size < _graph["offset"]:
+                # Folded into a generation published since `current` was read
+                _graph["generation"] = None
+                return _refresh(path)
+            f.seek(_graph["offset"])
+            data = f.read()
+    except FileNotFoundError:
+        return graph
+
+    # A line still being written is picked up on the next refresh
+    complete = data[:data.rfind(b"\n") + 1]
+    for line in complete.splitlines():
+        entry = json.loads(line)
+        vector = np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32)
+        graph.add(*entry["product"], vector)
+    _graph["offset"] += len(complete)
+    return graph
+
+
+def get_graph(path=SIMILAR_GRAPH_PATH):
+    with _graph_lock:
+        return _refresh(path)
+
+
+# Precomputed similar products, or [] when there is no graph
+def similar_products(product_id, limit=None):
+    try:
+        with _graph_lock:
+            graph = _refresh(SIMILAR_GRAPH_PATH)
+            return graph.similar(product_id, limit) if graph is not None else []
+    except Exception:
+        logger.exception("Error loading similarity graph")
+        return []
+
+
+# Add a newly inserted product to the graph, if one has been built. The
+# product is appended to pending.jsonl; every SIMILAR_COMPACT_AFTER
+# additions the graph is written out as a new generation.
+def add_product(product_id, title, link, text_vector, video_vectors, path=SIMILAR_GRAPH_PATH):
+    vector = pool_product_vector(text_vector, video_vectors).astype(np.float32)
+    with _writer_lock(path), _graph_lock:
+        graph = _refresh(path)
+        if graph is None:
+            return False
+        if vector.shape[0] != graph.vectors.shape[1]:
+            logger.warning("Embedding dimension changed; rebuild the similarity graph")
+            return False
+
+        line = json.dumps({
+            "product": [product_id, title, link],
+            "vector": base64.b64encode(vector.tobytes()).decode("ascii")
+        }).encode("utf-8") + b"\n"
+        with open(_pending_path(path), "ab") as f:
+            f.write(line)
+        graph.add(product_id, title, link, vector)
+        _graph["offset"] += len(line)
+
+        if _graph["offset"] >= SIMILAR_COMPACT_AFTER * len(line):
+            _publish(graph, path)
+            open(_pending_path(path), "wb").close()
+            _graph["generation"], _graph["offset"] = _live_generation(path), 0
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute product-to-product similarity")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build = subcommands.add_parser("build", help="Build the graph from a snapshot")
+    build.add_argument("snapshot")
+    build.add_argument("--path", default=SIMILAR_GRAPH_PATH)
+    build.add_argument("--top-n", type=int, default=SIMILAR_TOP_N)
+    build.add_argument("--batch-size", type=int, default=SIMILAR_BATCH_SIZE)
+    show = subcommands.add_parser("show", help="Print the similar products of a product")
+    show.add_argument("product_id")
+    show.add_argument("--path", default=SIMILAR_GRAPH_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        print(json.dumps(build_graph(args.snapshot, args.path, args.top_n, args.batch_size, progress=print), indent=2))
+    else:
+        graph = get_graph(args.path)
+        print(json.dumps(graph.similar(args.product_id) if graph is not None else [], indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
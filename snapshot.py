@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import numpy as np
+from clients import COLLECTION_NAME
+from resilience import guarded
+from schema import SCALAR_COLUMNS, has_scalar_columns
+from shards import all_shards, available_shards, get_shard
+
+logger = logging.getLogger(__name__)
+
+# Local snapshot of the collection and its category shards (see shards.py).
+# Every column is a flat binary file that the loader memory-maps without
+# copying:
+#   vectors.f32                    float32 [rows, dimension]
+#   id.i64                         int64 row IDs
+#   shard.u8                       uint8 codes into the manifest shards
+#   embedding_type.u8              uint8 codes into the manifest categories
+#   meta.<field>.f64               float64 numeric metadata (NaN if missing)
+#   meta.<field>.off / .utf8       int64 [rows, 2] start/end offsets (-1 if
+#                                  missing) + UTF-8 bytes of other metadata
+#   column.<field>.f64 / .off ...  typed scalar columns (see schema.py), same
+#                                  encodings, when the collection has them
+#   manifest.json                  row count, dimension and column layout
+# A metadata field is numeric while every value seen is a number; once any
+# other value shows up the column becomes a string one, numbers as JSON text.
+
+SNAPSHOT_VERSION = 3
+# Embedding type and shard codes are stored in one byte
+MAX_EMBEDDING_TYPES = 256
+MAX_SHARDS = 256
+EXPORT_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', '1000'))
+
+
+# Appends values of one field, padding rows where it was missing. `prefix`
+# is "meta" for metadata fields and "column" for scalar columns.
+class _ColumnWriter:
+
+    def __init__(self, directory, prefix, name, kind):
+        self.name = name
+        self.path = os.path.join(directory, f"{prefix}.{name}")
+        self._open(kind)
+
+    def _open(self, kind):
+        self.kind = kind
+        self.rows = 0
+        if kind == "float64":
+            self.file = open(f"{self.path}.f64", "wb")
+        else:
+            self.offsets = open(f"{self.path}.off", "wb")
+            self.file = open(f"{self.path}.utf8", "wb")
+            self.size = 0
+
+    def pad(self, rows):
+        missing = rows - self.rows
+        if missing <= 0:
+            return
+        if self.kind == "float64":
+            np.full(missing, np.nan, dtype=np.float64).tofile(self.file)
+        else:
+            np.full((missing, 2), -1, dtype=np.int64).tofile(self.offsets)
+        self.rows = rows
+
+    def write(self, row, value):
+        self.pad(row)
+        if self.kind == "float64":
+            np.array([value], dtype=np.float64).tofile(self.file)
+        else:
+            data = (value if isinstance(value, str) else json.dumps(value)).encode('utf-8')
+            self.file.write(data)
+            np.array([[self.size, self.size + len(data)]], dtype=np.int64).tofile(self.offsets)
+            self.size += len(data)
+        self.rows = row + 1
+
+    # Turn a numeric column into a string one, rewriting the numbers written
+    # so far as JSON text
+    def widen(self):
+        rows = self.rows
+        self.file.close()
+        values = np.fromfile(f"{self.path}.f64", dtype=np.float64)
+        os.remove(f"{self.path}.f64")
+        logger.info("Metadata field %s has non-numeric values; storing it as strings", self.name)
+
+        self._open("string")
+        for row in np.flatnonzero(~np.isnan(values)):
+            value = float(values[row])
+            self.write(int(row), int(value) if value.is_integer() else value)
+        self.pad(rows)
+
+    def close(self, rows):
+        self.pad(rows)
+        self.file.close()
+        if self.kind != "float64":
+            self.offsets.close()
+
+
+# Stream every row of the collection and of each existing category shard
+# into a snapshot directory. The snapshot is written next to `path` and
+# renamed into place once complete.
+def export_snapshot(path, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    report = progress or logger.info
+    shards = available_shards(all_shards())
+    if len(shards) > MAX_SHARDS:
+        raise ValueError(f"More than {MAX_SHARDS} shards; their codes do not fit shard.u8")
+    staging = f"{path}.partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    vectors = open(os.path.join(staging, "vectors.f32"), "wb")
+    ids = open(os.path.join(staging, "id.i64"), "wb")
+    types = open(os.path.join(staging, "embedding_type.u8"), "wb")
+    shard_codes = open(os.path.join(staging, "shard.u8"), "wb")
+    categories = {}
+    columns = {}
+    # Typed scalar columns, exported as stored rather than from metadata
+    scalar_columns = {}
+    rows = 0
+    dimension = None
+
+    try:
+        for code, shard in enumerate(shards):
+            collection = get_shard(shard)
+            shard_scalar_columns = has_scalar_columns(field.name for field in collection.schema.fields)
+            if shard_scalar_columns and not scalar_columns:
+                scalar_columns = {
+                    name: _ColumnWriter(staging, "column", name, "float64" if data_type == "FLOAT" else "string")
+                    for name, (data_type, _, _, _) in SCALAR_COLUMNS.items()
+                }
+
+            iterator = collection.query_iterator(
+                batch_size=batch_size,
+                expr="id >= 0",
+                output_fields=["id", "vector", "metadata", "embedding_type"] + (list(SCALAR_COLUMNS) if shard_scalar_columns else [])
+            )
+            try:
+                while True:
+                    batch = guarded('milvus_query', iterator.next)
+                    if not batch:
+                        break
+
+                    batch_vectors = np.asarray([row['vector'] for row in batch], dtype=np.float32)
+                    if dimension is None:
+                        dimension = batch_vectors.shape[1]
+                    elif batch_vectors.shape[1] != dimension:
+                        raise ValueError(f"{shard} has {batch_vectors.shape[1]}-dimensional vectors, expected {dimension}")
+                    batch_vectors.tofile(vectors)
+                    np.asarray([row['id'] for row in batch], dtype=np.int64).tofile(ids)
+                    np.full(len(batch), code, dtype=np.uint8).tofile(shard_codes)
+                    type_codes = [categories.setdefault(row['embedding_type'], len(categories)) for row in batch]
+                    if len(categories) > MAX_EMBEDDING_TYPES:
+                        raise ValueError(f"More than {MAX_EMBEDDING_TYPES} embedding types; their codes do not fit embedding_type.u8")
+                    np.asarray(type_codes, dtype=np.uint8).tofile(types)
+
+                    # Metadata values per field, typed by the whole batch
+                    batch_columns = {}
+                    for offset, row in enumerate(batch):
+                        for field, value in (row.get('metadata') or {}).items():
+                            if value is not None:
+                                batch_columns.setdefault(field, []).append((rows + offset, value))
+                        if shard_scalar_columns:
+                            for name, column in scalar_columns.items():
+                                if row.get(name) is not None:
+                                    column.write(rows + offset, row[name])
+
+                    for field, values in batch_columns.items():
+                        kind = "float64" if all(_is_number(value) for _, value in values) else "string"
+                        if field not in columns:
+                            columns[field] = _ColumnWriter(staging, "meta", field, kind)
+                        elif kind == "string" and columns[field].kind == "float64":
+                            columns[field].widen()
+                        for row, value in values:
+                            columns[field].write(row, value)
+
+                    rows += len(batch)
+                    report(f"Exported {rows} rows ({shard})")
+            finally:
+                iterator.close()
+    finally:
+        for handle in (vectors, ids, types, shard_codes):
+            handle.close()
+        for column in list(columns.values()) + list(scalar_columns.values()):
+            column.close(rows)
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "collection": COLLECTION_NAME,
+        "created_at": time.time(),
+        "rows": rows,
+        "dimension": dimension or 0,
+        "shards": shards,
+        "embedding_types": sorted(categories, key=categories.get),
+        "columns": {name: column.kind for name, column in columns.items()},
+        "scalar_columns": {name: column.kind for name, column in scalar_columns.items()}
+    }
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    return manifest
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _memmap(path, dtype, shape):
+    # np.memmap cannot map empty files
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+# String column backed by memory-mapped offsets and UTF-8 bytes; values are
+# decoded only when read
+class StringColumn:
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx]
+        if start < 0:
+            return None
+        return bytes(self.data[start:end]).decode('utf-8')
+
+
+# Read-only, zero-copy view of a snapshot directory
+class Snapshot:
+
+    def __init__(self, path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.manifest['version']}; export it again")
+
+        rows = self.manifest["rows"]
+        self.path = path
+        self.vectors = _memmap(os.path.join(path, "vectors.f32"), np.float32, (rows, self.manifest["dimension"]))
+        self.ids = _memmap(os.path.join(path, "id.i64"), np.int64, (rows,))
+        self.embedding_type_codes = _memmap(os.path.join(path, "embedding_type.u8"), np.uint8, (rows,))
+        self.embedding_types = self.manifest["embedding_types"]
+        self.shard_codes = _memmap(os.path.join(path, "shard.u8"), np.uint8, (rows,))
+        self.shards = self.manifest["shards"]
+        self.columns = self._open_columns("meta", self.manifest["columns"])
+        self.scalar_columns = self._open_columns("column", self.manifest.get("scalar_columns", {}))
+
+    def _open_columns(self, prefix, kinds):
+        rows = self.manifest["rows"]
+        columns = {}
+        for name, kind in kinds.items():
+            if kind == "float64":
+                columns[name] = _memmap(os.path.join(self.path, f"{prefix}.{name}.f64"), np.float64, (rows,))
+            else:
+                offsets = _memmap(os.path.join(self.path, f"{prefix}.{name}.off"), np.int64, (rows, 2))
+                data_path = os.path.join(self.path, f"{prefix}.{name}.utf8")
+                size = os.path.getsize(data_path)
+                columns[name] = StringColumn(offsets, _memmap(data_path, np.uint8, (size,)))
+        return columns
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    # Boolean mask of rows with the given embedding type
+    def type_mask(self, embedding_type):
+        if embedding_type not in self.embedding_types:
+            return np.zeros(len(self), dtype=bool)
+        return self.embedding_type_codes == self.embedding_types.index(embedding_type)
+
+    # Row as the collection stores it, metadata rebuilt from the columns
+    def row(self, idx):
+        row = {
+            "id": int(self.ids[idx]),
+            "vector": self.vectors[idx],
+            "metadata": _column_values(self.columns, idx),
+            "embedding_type": self.embedding_types[self.embedding_type_codes[idx]],
+            "shard": self.shards[self.shard_codes[idx]]
+        }
+        row.update(_column_values(self.scalar_columns, idx))
+        return row
+
+
+# Non-missing values of the given columns at a row, as Python values
+def _column_values(columns, idx):
+    values = {}
+    for name, column in columns.items():
+        value = column[idx]
+        if value is not None and not (isinstance(value, float) and np.isnan(value)):
+            values[name] = value.item() if isinstance(value, np.generic) else value
+    return values
+
+
+def load_snapshot(path):
+    return Snapshot(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the collection and its shards to a memory-mapped snapshot")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export = subcommands.add_parser("export", help="Stream every row into a snapshot directory")
+    export.add_argument("path")
+    export.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    info = subcommands.add_parser("info", help="Describe a snapshot")
+    info.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        manifest = export_snapshot(args.path, args.batch_size, progress=print)
+    else:
+        manifest = load_snapshot(args.path).manifest
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -1,73 +1,456 @@
+import io
 import os
+import json
+import heapq
+import itertools
+import time
 import uuid
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from dotenv import load_dotenv
-from twelvelabs import TwelveLabs
-from pymilvus import connections, Collection
-import streamlit as st
-from openai import OpenAI
-import numpy as np
+from clients import COLLECTION_NAME, get_twelvelabs_client, get_openai_client, get_collection
+from llm_cache import LLM_CACHE_ENABLED, completion_cache, prompt_fingerprint
+from results import ProductMatch, RagResponse
+from scheduler import scheduler, BACKGROUND
+from resilience import guarded, dependencies
+from batching import Coalescer
+from search_cache import SEARCH_CACHE_ENABLED, search_cache, search_key
+from profiling import stage
+from posters import attach_posters
+from shards import get_shard, all_shards, available_shards, shard_name, shard_model, select_shards, fan_out
+from schema import SCALAR_COLUMNS, has_scalar_columns, scalar_values, collection_properties
 
 load_dotenv()
 
-# Load environment variables
-COLLECTION_NAME = os.getenv('COLLECTION_NAME')
-URL = os.getenv('URL')
-TOKEN = os.getenv('TOKEN')
-TWELVELABS_API_KEY = os.getenv('TWELVELABS_API_KEY')
+logger = logging.getLogger(__name__)
 
-# Initialize connections
-openai_client = OpenAI()
-connections.connect(uri=URL, token=TOKEN)
-collection = Collection(COLLECTION_NAME)
-collection.load()
 
+# Parse clip layers given as "name:seconds" pairs, finest layer first
+def parse_clip_layers(spec):
+    layers = []
+    for item in spec.split(','):
+        name, _, seconds = item.strip().partition(':')
+        layers.append((name, float(seconds)))
+    return sorted(layers, key=lambda layer: layer[1])
 
-# Generate text and segmented video embeddings for a product
-def generate_embedding(product_info):
+
+# Embedding model of collections that do not record one. Collections built by
+# reindex.py record their model, so queries follow an alias swap.
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'Marengo-retrieval-2.7')
+# How often to re-read which collection COLLECTION_NAME resolves to
+COLLECTION_REFRESH_SECONDS = float(os.getenv('COLLECTION_REFRESH_SECONDS', '30'))
+
+# Category put in the text embedding of products that don't name one
+DEFAULT_CATEGORY = os.getenv('DEFAULT_CATEGORY', 'fashion apparel')
+
+# Clip granularities indexed for every video. The finest layer is embedded by
+# TwelveLabs directly; coarser layers are pooled from it at ingest time.
+CLIP_LAYERS = parse_clip_layers(os.getenv('CLIP_LAYERS', 'fine:6,coarse:30'))
+# Number of candidate videos the coarse layer hands to the fine search
+COARSE_CANDIDATES = int(os.getenv('COARSE_CANDIDATES', '10'))
+# Coarse segments fetched per candidate video, so that a few long videos
+# cannot fill every candidate slot
+COARSE_HITS_PER_VIDEO = int(os.getenv('COARSE_HITS_PER_VIDEO', '4'))
+# How often each shard is rescanned for videos without coarse clip layers
+LAYER_SCAN_SECONDS = float(os.getenv('LAYER_SCAN_SECONDS', '600'))
+# Longest video list a fine search is narrowed to; past it every fine
+# segment is searched
+MAX_NARROWED_VIDEOS = 1000
+# Consecutive segments at least this similar are merged at ingest (1 disables)
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.97'))
+
+# Window in which concurrent searches are coalesced into one batched call
+# (0 disables batching), and the largest batch
+BATCH_WINDOW_MS = float(os.getenv('BATCH_WINDOW_MS', '3'))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '32'))
+
+# Most results a deep browse or export pages through
+BROWSE_MAX_RESULTS = int(os.getenv('BROWSE_MAX_RESULTS', '5000'))
+
+# Number of products whose display metadata is kept in memory
+PRODUCT_CACHE_SIZE = int(os.getenv('PRODUCT_CACHE_SIZE', '5000'))
+# Number of recent queries whose embeddings and retrievals are kept in memory
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '256'))
+# Catalog changes are only announced within this process; retrievals older
+# than this are searched again so other processes' writes show up too
+RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '300'))
+
+# Chat model settings. LLM_DETERMINISTIC pins temperature to 0 so repeated
+# questions get the same answer, which is what the completion cache serves.
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-3.5-turbo')
+LLM_TEMPERATURE = 0 if os.getenv('LLM_DETERMINISTIC') == '1' else float(os.getenv('LLM_TEMPERATURE', '0.7'))
+
+SEARCH_PARAMS = {
+    "metric_type": "COSINE",
+    "params": {
+        "nprobe": 1024,
+        "ef": 64
+    }
+}
+
+
+# SEARCH_PARAMS for a search returning up to `limit` hits (per page, for
+# search iterators). HNSW rejects an ef below the number of hits requested.
+def search_params(limit):
+    return {**SEARCH_PARAMS, "params": {**SEARCH_PARAMS["params"], "ef": max(SEARCH_PARAMS["params"]["ef"], limit)}}
+
+
+# Retrieval cache of (stored at, matches), invalidated whenever
+# insert_embeddings changes the catalog and expired after RETRIEVAL_CACHE_TTL
+_retrieval_cache = OrderedDict()
+_retrieval_lock = threading.Lock()
+_catalog_generation = 0
+# Callables run after every catalog change
+catalog_listeners = []
+
+# Display metadata of recently seen products, shared by all sessions
+_product_cache = OrderedDict()
+_product_lock = threading.Lock()
+PRODUCT_DISPLAY_FIELDS = ("product_id", "title", "description", "link", "video_url")
+
+
+# Call a TwelveLabs or OpenAI endpoint through the rate-limit scheduler.
+# Each attempt, once it holds a token, is bounded by the dependency's
+# deadline and circuit breaker; queueing for the rate limit and backoff
+# between retries are not held against the provider. Only idempotent reads
+# should pass hedge=True.
+def provider_call(dependency, provider, endpoint, fn, *args, hedge=False, **kwargs):
+    return scheduler.call(provider, endpoint, guarded, dependency, fn, *args, hedge=hedge, **kwargs)
+
+
+# Vector search of one shard with a deadline, circuit breaker and hedging
+def _guarded_search(shard=COLLECTION_NAME, **kwargs):
+    return guarded(
+        'milvus_search',
+        get_shard(shard).search,
+        hedge=True,
+        timeout=dependencies['milvus_search'].deadline,
+        **kwargs
+    )
+
+
+# Run single-vector searches that share every other parameter as one
+# multi-vector search and hand each caller its own hits
+def _search_batch(key, items):
+    results = _guarded_search(data=[vector for vector, _ in items], **items[0][1])
+    return [results[idx] for idx in range(len(items))]
+
+
+# Embed the same text once for all concurrent callers; TwelveLabs embeds a
+# single text per request, so identical queries are all that can be shared
+def _embed_batch(key, items):
+    model_name, text = key
+    twelvelabs_client = get_twelvelabs_client()
+    response = provider_call(
+        'twelvelabs_embed', 'twelvelabs', 'embed',
+        twelvelabs_client.embed.create,
+        model_name=model_name,
+        text=text,
+        hedge=True
+    )
+    return [response] * len(items)
+
+
+_search_batcher = Coalescer(_search_batch, BATCH_WINDOW_MS, BATCH_MAX_SIZE)
+_embed_batcher = Coalescer(_embed_batch, BATCH_WINDOW_MS, BATCH_MAX_SIZE)
+
+
+# Search one shard (COLLECTION_NAME unless `shard` is given). Results of
+# single-vector searches are cached until the shard is written to; on a miss,
+# concurrent single-vector searches are coalesced into batched calls unless
+# BATCH_WINDOW_MS is 0.
+def search_collection(data, **kwargs):
+    if not SEARCH_CACHE_ENABLED or len(data) != 1:
+        return _search_uncached(data, **kwargs)
+
+    shard = kwargs.get('shard', COLLECTION_NAME)
+    cache_key = search_key(data[0], kwargs)
+    results, version = search_cache.get(shard, cache_key)
+    if results is None:
+        results = _search_uncached(data, **kwargs)
+        search_cache.put(shard, cache_key, version, results)
+    return results
+
+
+def _search_uncached(data, **kwargs):
+    if BATCH_WINDOW_MS <= 0 or len(data) != 1:
+        return _guarded_search(data=data, **kwargs)
+    key = json.dumps(kwargs, sort_keys=True, default=str)
+    return [_search_batcher.submit(key, (data[0], kwargs))]
+
+
+def batching_metrics():
+    return {"search": _search_batcher.metrics(), "embed": _embed_batcher.metrics()}
+
+
+def search_cache_metrics():
+    return search_cache.metrics()
+
+
+# Merge the per-shard hits of each query into the overall top `limit`
+def merge_shard_hits(shard_results, limit):
+    if len(shard_results) == 1:
+        return next(iter(shard_results.values()))
+    queries = len(next(iter(shard_results.values())))
+    return [
+        heapq.nlargest(
+            limit,
+            (hit for results in shard_results.values() for hit in results[idx]),
+            key=lambda hit: hit.score
+        )
+        for idx in range(queries)
+    ]
+
+
+# Embedding model and schema of the collection behind COLLECTION_NAME.
+# Re-read periodically: when COLLECTION_NAME is an alias, reindex.py can
+# point it at another collection while the app is running.
+_collection_state = {"checked": None, "name": None, "model": EMBEDDING_MODEL, "scalar_columns": False}
+_collection_state_lock = threading.Lock()
+
+
+def collection_state():
+    with _collection_state_lock:
+        checked = _collection_state['checked']
+        if checked is not None and time.monotonic() - checked < COLLECTION_REFRESH_SECONDS:
+            return dict(_collection_state)
+        _collection_state['checked'] = time.monotonic()
+        try:
+            info = guarded('milvus_query', get_collection().describe)
+        except Exception:
+            logger.exception("Error describing collection")
+            return dict(_collection_state)
+        
+        previous = _collection_state['name']
+        _collection_state.update(
+            name=info.get('collection_name'),
+            model=collection_properties(info.get('description')).get('embedding_model', EMBEDDING_MODEL),
+            scalar_columns=has_scalar_columns(field['name'] for field in info.get('fields', []))
+        )
+        state = dict(_collection_state)
+    
+    if previous is not None and previous != state['name']:
+        logger.info("Collection switched from %s to %s (model %s)", previous, state['name'], state['model'])
+        search_cache.bump(COLLECTION_NAME)
+        notify_catalog_changed()
+    return state
+
+
+# Model that embeds queries for the live collection
+def embedding_model():
+    return collection_state()['model']
+
+
+# Whether the collection has the promoted scalar columns (see schema.py).
+# Collections created before the migration keep everything in metadata.
+def uses_scalar_columns():
+    return collection_state()['scalar_columns']
+
+
+# Expression for a metadata field: its scalar column when the schema has
+# one, otherwise a JSON path into metadata
+def field_ref(name):
+    if name in SCALAR_COLUMNS and uses_scalar_columns():
+        return name
+    return f"metadata[{json.dumps(name)}]"
+
+
+# Shards to search for a query: select_shards() without shards whose vectors
+# come from another model than the live collection, e.g. after a reindex
+# swap. Those would return meaningless scores, so they are skipped loudly.
+def query_shards(text="", filters=None):
+    model = embedding_model()
+    shards = select_shards(text, filters)
+    usable = [
+        shard for shard in shards
+        if shard == COLLECTION_NAME or shard_model(shard, EMBEDDING_MODEL) in (None, model)
+    ]
+    if len(usable) < len(shards):
+        logger.error("Skipping shards not embedded with %s: %s", model, sorted(set(shards) - set(usable)))
+    return usable or [COLLECTION_NAME]
+
+
+# Filter expression and shards of a query; raises ValueError for bad filters
+def query_scope(text="", filters=None):
+    return filter_expr(filters), query_shards(text, filters)
+
+
+# Collection row for a vector, with the promoted columns filled in when the
+# schema has them
+def make_entry(vector, metadata, embedding_type, scalar_columns):
+    entry = {
+        "id": int(uuid.uuid4().int & (1<<63)-1),
+        "vector": vector,
+        "metadata": metadata,
+        "embedding_type": embedding_type
+    }
+    if scalar_columns:
+        entry.update(scalar_values(metadata))
+    return entry
+
+
+# Filters accepted by search_similar_videos and get_rag_response:
+#   product_id, category    a value or a list of values
+#   min_price, max_price    inclusive price bounds
+FILTER_KEYS = ("product_id", "category", "min_price", "max_price")
+
+
+# Turn a filters dict into a boolean expression ("" when there is nothing
+# to filter on). Raises ValueError for unknown keys or bad values.
+def filter_expr(filters):
+    if not filters:
+        return ""
+    unknown = sorted(set(filters) - set(FILTER_KEYS))
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(unknown)}")
+    
+    clauses = []
+    for name in ("product_id", "category"):
+        value = filters.get(name)
+        if value in (None, "", []):
+            continue
+        values = [str(item) for item in (value if isinstance(value, (list, tuple)) else [value])]
+        clauses.append(f"{field_ref(name)} in {json.dumps(values)}")
+    
+    min_price, max_price = filters.get("min_price"), filters.get("max_price")
+    if min_price is not None or max_price is not None:
+        try:
+            # Products without a price are never matched by a price filter
+            clauses.append(f"{field_ref('price')} >= {max(float(min_price or 0), 0)}")
+            if max_price is not None:
+                clauses.append(f"{field_ref('price')} <= {float(max_price)}")
+        except (TypeError, ValueError):
+            raise ValueError("Price filters must be numbers")
+    return " and ".join(clauses)
+
+
+# Embedding type stored for a clip layer. The finest layer keeps the original
+# "video" type so existing rows and filters stay valid.
+def layer_embedding_type(layer_name):
+    if layer_name == CLIP_LAYERS[0][0]:
+        return "video"
+    return f"video_{layer_name}"
+
+
+# Mean-pool consecutive segments into windows of at least clip_length seconds
+def pool_segments(video_embeddings, layer_name, clip_length):
+    windows = []
+    for segment in video_embeddings:
+        start_time = segment['metadata']['start_time']
+        if not windows or start_time - windows[-1][0]['metadata']['start_time'] >= clip_length:
+            windows.append([])
+        windows[-1].append(segment)
+
+    return [
+        merge_segments(window, layer=layer_name, clip_length=clip_length)
+        for window in windows
+    ]
+
+
+# Merge consecutive segments into one spanning their time range, with the
+# normalized mean of their vectors
+def merge_segments(window, **metadata):
+    import numpy as np
+
+    vectors = np.array([segment['embedding'] for segment in window], dtype=np.float32)
+    vector = vectors.mean(axis=0)
+    vector /= np.linalg.norm(vector) or 1.0
+    return {
+        'embedding': vector.tolist(),
+        'metadata': {
+            **window[0]['metadata'],
+            'end_time': window[-1]['metadata']['end_time'],
+            **metadata
+        }
+    }
+
+
+# Collapse runs of consecutive near-identical segments (static or repeated
+# shots) into one segment each. Returns the kept segments and the number
+# pruned.
+def dedupe_segments(video_embeddings, threshold):
+    if len(video_embeddings) < 2 or threshold >= 1:
+        return video_embeddings, 0
+
+    import numpy as np
+    vectors = np.array([segment['embedding'] for segment in video_embeddings], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    # Cosine similarity of each segment to the one before it
+    similarity = np.einsum('ij,ij->i', vectors[1:], vectors[:-1])
+    run_starts = np.flatnonzero(np.concatenate(([True], similarity < threshold)))
+    run_ends = np.append(run_starts[1:], len(video_embeddings))
+    
+    deduped = []
+    for start, end in zip(run_starts, run_ends):
+        if end - start == 1:
+            deduped.append(video_embeddings[start])
+        else:
+            deduped.append(merge_segments(video_embeddings[start:end], merged_segments=int(end - start)))
+    return deduped, len(video_embeddings) - len(deduped)
+
+
+# Generate text and segmented video embeddings for a product with the live
+# collection's model, or model_name. Progress messages go to the progress
+# callback (e.g. st.write) or the log.
+def generate_embedding(product_info, progress=None, model_name=None):
+    report = progress or logger.info
     try:
-        st.write("Starting embedding generation process...")
-        st.write(f"Processing product: {product_info['title']}")
+        model_name = model_name or embedding_model()
+        report("Starting embedding generation process...")
+        report(f"Processing product: {product_info['title']}")
         
-        twelvelabs_client = TwelveLabs(api_key=TWELVELABS_API_KEY)
-        st.write("TwelveLabs client initialized successfully")
+        twelvelabs_client = get_twelvelabs_client()
         
-        st.write("Attempting to generate text embedding...")
+        report("Attempting to generate text embedding...")
 
         text = f"product type: {product_info['title']}. " \
                f"product description: {product_info['desc']}. " \
-               f"product category: fashion apparel."
+               f"product category: {product_info.get('category') or DEFAULT_CATEGORY}."
                
-        st.write(f"Generating embedding for text: {text}")
+        report(f"Generating embedding for text: {text}")
         
-        text_embedding = twelvelabs_client.embed.create(
-            model_name="Marengo-retrieval-2.7",
-            text=text
+        text_embedding = provider_call(
+            'twelvelabs_embed', 'twelvelabs', 'embed',
+            twelvelabs_client.embed.create,
+            model_name=model_name,
+            text=text,
+            priority=BACKGROUND
         ).text_embedding.segments[0].embeddings_float
-        st.write("Text embedding generated successfully")
+        report("Text embedding generated successfully")
 
         
         # Create and wait for video embedding task
-        st.write("Creating video embedding task...")
-        video_task = twelvelabs_client.embed.task.create(
-            model_name="Marengo-retrieval-2.7",
+        report("Creating video embedding task...")
+        video_task = provider_call(
+            'twelvelabs_task', 'twelvelabs', 'embed_task',
+            twelvelabs_client.embed.task.create,
+            model_name=model_name,
             video_url=product_info['video_url'],
-            video_clip_length=6
+            video_clip_length=int(CLIP_LAYERS[0][1]),
+            priority=BACKGROUND
         )
         
         def on_task_update(task):
-            st.write(f"Video processing status: {task.status}")
+            report(f"Video processing status: {task.status}")
         
-        st.write("Waiting for video processing to complete...")
+        report("Waiting for video processing to complete...")
         video_task.wait_for_done(sleep_interval=2, callback=on_task_update)
         
         # Retrieve segmented video embeddings
-        video_task = video_task.retrieve()
+        video_task = provider_call(
+            'twelvelabs_task', 'twelvelabs', 'embed_task_status',
+            video_task.retrieve,
+            priority=BACKGROUND
+        )
         if not video_task.video_embedding or not video_task.video_embedding.segments:
             raise Exception("Failed to retrieve video embeddings")
         
         video_segments = video_task.video_embedding.segments
-        st.write(f"Retrieved {len(video_segments)} video segments")
+        report(f"Retrieved {len(video_segments)} video segments")
         
+        fine_layer, fine_clip_length = CLIP_LAYERS[0]
         video_embeddings = []
         for segment in video_segments:
             video_embeddings.append({
@@ -76,24 +459,58 @@ def generate_embedding(product_info):
                     'scope': 'clip',
                     'start_time': segment.start_offset_sec,
                     'end_time': segment.end_offset_sec,
-                    'video_url': product_info['video_url']
+                    'video_url': product_info['video_url'],
+                    'layer': fine_layer,
+                    'clip_length': fine_clip_length
                 }
             })
         
+        # Pool the fine segments into each coarser layer
+        layer_embeddings = {}
+        for layer_name, clip_length in CLIP_LAYERS[1:]:
+            layer_embeddings[layer_name] = pool_segments(video_embeddings, layer_name, clip_length)
+            report(f"Pooled {len(layer_embeddings[layer_name])} {layer_name} segments")
+        
+        # Drop near-duplicate fine segments
+        deduped_embeddings, pruned = dedupe_segments(video_embeddings, DEDUP_THRESHOLD)
+        report(
+            f"Pruned {pruned} of {len(video_embeddings)} near-duplicate segments "
+            f"({pruned / len(video_embeddings):.0%})"
+        )
+        
+        # Poster frames for the result lists, shared by segments starting at
+        # the same time on different layers
+        posters = attach_posters(
+            deduped_embeddings + [segment for segments in layer_embeddings.values() for segment in segments],
+            product_info['video_url']
+        )
+        report(f"Extracted {posters} poster frames")
+        
         return {
             'text_embedding': text_embedding,
-            'video_embeddings': video_embeddings
+            'video_embeddings': deduped_embeddings,
+            'layer_embeddings': layer_embeddings
         }, None
         
     except Exception as e:
-        st.error("Error in embedding generation")
-        st.error(f"Error message: {str(e)}")
+        logger.exception("Error in embedding generation")
         return None, str(e)
 
 
-# Insert text and all video segment embeddings
-def insert_embeddings(embeddings_data, product_info):
+# Insert text and all video segment embeddings into the product's category
+# shard, or into `collection` (e.g. a shadow collection being rebuilt by
+# reindex.py)
+def insert_embeddings(embeddings_data, product_info, progress=None, collection=None):
+    report = progress or logger.info
+    live = collection is None
+    shard = shard_name(product_info.get('category'))
     try:
+        if live and shard == COLLECTION_NAME:
+            target, scalar_columns = get_collection(), uses_scalar_columns()
+        else:
+            target = collection if not live else get_shard(shard, create=True)
+            scalar_columns = has_scalar_columns(field.name for field in target.schema.fields)
+        
         metadata = {
             "product_id": product_info['product_id'],
             "title": product_info['title'],
@@ -101,273 +518,401 @@ def insert_embeddings(embeddings_data, product_info):
             "video_url": product_info['video_url'],
             "link": product_info['link']
         }
+        # Optional fields used by filtered search
+        if product_info.get('category'):
+            metadata['category'] = product_info['category']
+        if product_info.get('price') not in (None, ""):
+            metadata['price'] = float(product_info['price'])
         
         # Insert text embedding
-        text_entry = {
-            "id": int(uuid.uuid4().int & (1<<63)-1),
-            "vector": embeddings_data['text_embedding'],
-            "metadata": metadata,
-            "embedding_type": "text"
-        }
-        collection.insert([text_entry])
-        st.write("Text embedding inserted successfully")
+        text_entry = make_entry(embeddings_data['text_embedding'], metadata, "text", scalar_columns)
+        target.insert([text_entry])
+        report("Text embedding inserted successfully")
         
         # Insert each video segment embedding
         for video_segment in embeddings_data['video_embeddings']:
-            video_entry = {
-                "id": int(uuid.uuid4().int & (1<<63)-1),
-                "vector": video_segment['embedding'],
-                "metadata": {**metadata, **video_segment['metadata']},
-                "embedding_type": "video"
-            }
-            collection.insert([video_entry])
+            video_entry = make_entry(video_segment['embedding'], {**metadata, **video_segment['metadata']}, "video", scalar_columns)
+            target.insert([video_entry])
+        
+        report(f"Inserted {len(embeddings_data['video_embeddings'])} video segment embeddings")
+        
+        # Insert the coarser clip layers used for candidate selection
+        for layer_name, layer_segments in embeddings_data.get('layer_embeddings', {}).items():
+            for video_segment in layer_segments:
+                target.insert([make_entry(
+                    video_segment['embedding'],
+                    {**metadata, **video_segment['metadata']},
+                    layer_embedding_type(layer_name),
+                    scalar_columns
+                )])
+            report(f"Inserted {len(layer_segments)} {layer_name} segment embeddings")
         
-        st.write(f"Inserted {len(embeddings_data['video_embeddings'])} video segment embeddings")
+        if not live:
+            return True
+        
+        # Cached search results of the shard are now stale
+        search_cache.bump(shard)
+        remember_products([metadata])
+        
+        # Cached answers that mention this product are now stale
+        completion_cache.invalidate_products([product_info['product_id']])
+        notify_catalog_changed()
+        update_similar_products(metadata, embeddings_data)
         return True
         
     except Exception as e:
-        st.error(f"Error inserting embeddings: {str(e)}")
+        logger.exception("Error inserting embeddings")
+        if live:
+            # Some rows may have been written before the failure
+            search_cache.bump(shard)
         return False
 
 
-# Search for similar video segments using image query
-def search_similar_videos(image_file, top_k=5):
-    
+# Add a new product to the precomputed similarity graph. The product is
+# already searchable, so a failure here is only logged.
+def update_similar_products(metadata, embeddings_data):
     try:
-        twelvelabs_client = TwelveLabs(api_key=TWELVELABS_API_KEY)
-        image_embedding = twelvelabs_client.embed.create(
-            model_name="Marengo-retrieval-2.7",
-            image_file=image_file
-        ).image_embedding.segments[0].embeddings_float
-        
-        search_params = {
-            "metric_type": "COSINE",
-            "params": {
-                "nprobe": 1024,
-                "ef": 64
-            }
-        }
-        
-        results = collection.search(
-            data=[image_embedding],
+        from similar import add_product
+        add_product(
+            metadata['product_id'],
+            metadata['title'],
+            metadata['link'],
+            embeddings_data['text_embedding'],
+            [segment['embedding'] for segment in embeddings_data['video_embeddings']]
+        )
+    except Exception:
+        logger.exception("Error updating similar products")
+
+
+# Find fine video segments in the given shards (default: COLLECTION_NAME),
+# searching them in parallel and merging the top_k. `filters` is an extra
+# expression applied to every search.
+def search_video_segments(query_embedding, top_k, output_fields, filters="", shards=None):
+    shard_results = fan_out(
+        lambda shard: _search_video_shard(shard, query_embedding, top_k, output_fields, filters),
+        shards or [COLLECTION_NAME]
+    )
+    return merge_shard_hits(shard_results, top_k)
+
+
+# Coarse-to-fine search of one shard: pick candidate videos on the coarsest
+# layer, then search only the fine segments of those videos and of videos
+# that have no coarse layer yet (see backfill.py)
+def _search_video_shard(shard, query_embedding, top_k, output_fields, filters):
+    extra = f" and ({filters})" if filters else ""
+    expr = f"embedding_type == '{layer_embedding_type(CLIP_LAYERS[0][0])}'" + extra
+    
+    # Until the shard has been scanned for videos missing the coarse layer,
+    # every fine segment is searched
+    missing = videos_missing_layers_cached(shard) if len(CLIP_LAYERS) > 1 else None
+    if missing is not None:
+        coarse_results = search_collection(
+            data=[query_embedding],
+            shard=shard,
             anns_field="vector",
-            param=search_params,
-            limit=top_k,
-            expr="embedding_type == 'video'",
+            param=search_params(COARSE_CANDIDATES * COARSE_HITS_PER_VIDEO),
+            limit=COARSE_CANDIDATES * COARSE_HITS_PER_VIDEO,
+            expr=f"embedding_type == '{layer_embedding_type(CLIP_LAYERS[-1][0])}'" + extra,
             output_fields=["metadata"]
         )
-
-        search_results = []
-        for hits in results:
+        # Best-scoring distinct videos first
+        candidate_urls = []
+        for hits in coarse_results:
             for hit in hits:
-                metadata = hit.metadata
-                # Convert score from [-1,1] to [0,100] range
-                similarity = round((hit.score + 1) * 50, 2)
-                similarity = max(0, min(100, similarity))
-                
-                search_results.append({
-                    'Title': metadata.get('title', ''),
-                    'Description': metadata.get('description', ''),
-                    'Link': metadata.get('link', ''),
-                    'Start Time': f"{metadata.get('start_time', 0):.1f}s",
-                    'End Time': f"{metadata.get('end_time', 0):.1f}s",
-                    'Video URL': metadata.get('video_url', ''),
-                    'Similarity': f"{similarity}%",
-                    'Raw Score': hit.score
-                })
+                url = hit.metadata.get('video_url')
+                if url and url not in candidate_urls and len(candidate_urls) < COARSE_CANDIDATES:
+                    candidate_urls.append(url)
+        videos = sorted(set(candidate_urls) | missing)
+        if videos and len(videos) <= MAX_NARROWED_VIDEOS:
+            expr += f" and {field_ref('video_url')} in {json.dumps(videos)}"
+    
+    return search_collection(
+        data=[query_embedding],
+        shard=shard,
+        anns_field="vector",
+        param=search_params(top_k),
+        limit=top_k,
+        expr=expr,
+        output_fields=output_fields
+    )
+
+
+# Video URLs of a shard that have fine segments but no coarsest-layer rows:
+# ingested before the clip layers existed and not backfilled yet
+def videos_missing_layers(shard=COLLECTION_NAME, batch_size=1000):
+    fine = layer_embedding_type(CLIP_LAYERS[0][0])
+    coarse = layer_embedding_type(CLIP_LAYERS[-1][0])
+    videos = {fine: set(), coarse: set()}
+    iterator = get_shard(shard).query_iterator(
+        batch_size=batch_size,
+        expr=f"embedding_type in {json.dumps([fine, coarse])}",
+        output_fields=["metadata", "embedding_type"]
+    )
+    try:
+        while True:
+            batch = guarded('milvus_query', iterator.next)
+            if not batch:
+                break
+            for row in batch:
+                if row['metadata'].get('video_url'):
+                    videos[row['embedding_type']].add(row['metadata']['video_url'])
+    finally:
+        iterator.close()
+    return videos[fine] - videos[coarse]
+
+
+# videos_missing_layers per shard as (scanned at, videos, scan running).
+# Scans run in the background so searches never wait for one.
+_missing_layers = {}
+_missing_layers_lock = threading.Lock()
+
+
+# Last scanned videos_missing_layers(shard), or None before the first scan
+# finished. Starts a rescan every LAYER_SCAN_SECONDS.
+def videos_missing_layers_cached(shard):
+    with _missing_layers_lock:
+        scanned_at, videos, scanning = _missing_layers.get(shard, (None, None, False))
+        if not scanning and (scanned_at is None or time.monotonic() - scanned_at >= LAYER_SCAN_SECONDS):
+            _missing_layers[shard] = (scanned_at, videos, True)
+            threading.Thread(target=_scan_missing_layers, args=(shard,), name="layer-scan", daemon=True).start()
+    return videos
+
+
+def _scan_missing_layers(shard):
+    try:
+        videos = videos_missing_layers(shard)
+    except Exception:
+        logger.exception("Error scanning %s for videos without clip layers", shard)
+        videos = None
+    with _missing_layers_lock:
+        previous = _missing_layers.get(shard, (None, None, False))[1]
+        _missing_layers[shard] = (time.monotonic(), videos if videos is not None else previous, False)
+
+
+# Build the coarser clip layers of a video that only has fine segments
+def backfill_clip_layers(video_url, shard=COLLECTION_NAME):
+    collection = get_shard(shard)
+    rows = collection.query(
+        expr=f"embedding_type == '{layer_embedding_type(CLIP_LAYERS[0][0])}' and {field_ref('video_url')} == {json.dumps(video_url)}",
+        output_fields=["vector", "metadata"]
+    )
+    if not rows:
+        return 0
+    
+    rows.sort(key=lambda row: row['metadata'].get('start_time', 0))
+    fine_segments = [{'embedding': row['vector'], 'metadata': row['metadata']} for row in rows]
+    scalar_columns = has_scalar_columns(field.name for field in collection.schema.fields)
+    
+    inserted = 0
+    for layer_name, clip_length in CLIP_LAYERS[1:]:
+        entries = [
+            make_entry(segment['embedding'], segment['metadata'], layer_embedding_type(layer_name), scalar_columns)
+            for segment in pool_segments(fine_segments, layer_name, clip_length)
+        ]
+        collection.insert(entries)
+        inserted += len(entries)
+    
+    search_cache.bump(shard)
+    with _missing_layers_lock:
+        scanned_at, videos, scanning = _missing_layers.get(shard, (None, None, False))
+        if videos is not None:
+            _missing_layers[shard] = (scanned_at, videos - {video_url}, scanning)
+    return inserted
+
+
+# Embed a query image. Takes the raw bytes so that retried and hedged
+# attempts each upload their own copy.
+def embed_image(image_bytes, model_name):
+    return get_twelvelabs_client().embed.create(
+        model_name=model_name,
+        image_file=io.BytesIO(image_bytes)
+    ).image_embedding.segments[0].embeddings_float
+
+
+# Search for similar video segments using image query, optionally narrowed
+# by filters (see FILTER_KEYS). Returns a list of ProductMatch, or None if
+# the search failed.
+def search_similar_videos(image_file, top_k=5, filters=None):
+    expr, shards = query_scope(filters=filters)
+    
+    try:
+        image_file.seek(0)
+        image_bytes = image_file.read()
+        with stage("embed_image"):
+            image_embedding = embed_query_image(image_bytes)
         
-        # Sort by similarity score in descending order
-        search_results.sort(key=lambda x: float(x['Similarity'].rstrip('%')), reverse=True)
+        with stage("search_video"):
+            results = search_video_segments(image_embedding, top_k, ["metadata"], expr, shards)
+
+        with stage("results"):
+            remember_products(hit.metadata for hits in results for hit in hits)
+            search_results = [
+                ProductMatch.from_hit("video", hit.metadata, hit.score)
+                for hits in results
+                for hit in hits
+            ]
+            
+            # Sort by similarity score in descending order
+            search_results.sort(key=lambda match: match.similarity, reverse=True)
         
         return search_results
         
     except Exception as e:
+        logger.exception("Error in visual search")
         return None
 
 
+# Browse video segments similar to an image, best first, in batches of
+# ProductMatch. Returns a generator backed by Milvus search iterators (one per
+# shard, merged lazily by score), so only the current batches are in memory.
+# Bad filters and embedding failures raise here, before the first batch;
+# closing the generator releases the iterators.
+def iter_similar_videos(image_bytes, filters=None, batch_size=50, limit=BROWSE_MAX_RESULTS):
+    extra = filter_expr(filters)
+    expr = f"embedding_type == '{layer_embedding_type(CLIP_LAYERS[0][0])}'" + (f" and ({extra})" if extra else "")
+    shards = query_shards(filters=filters)
+    image_embedding = embed_query_image(image_bytes)
+    return _iter_match_batches(image_embedding, expr, shards, batch_size, limit)
 
 
+def _iter_match_batches(vector, expr, shards, batch_size, limit):
+    streams = [_iter_shard_hits(shard, vector, expr, batch_size, limit) for shard in shards]
+    hits = itertools.islice(heapq.merge(*streams, key=lambda hit: -hit.score), limit)
+    try:
+        while True:
+            batch = list(itertools.islice(hits, batch_size))
+            if not batch:
+                return
+            remember_products(hit.metadata for hit in batch)
+            yield [ProductMatch.from_hit("video", hit.metadata, hit.score) for hit in batch]
+    finally:
+        for stream in streams:
+            stream.close()
+
 
-def get_rag_response(question):
+# Hits of one shard in descending score order, fetched a page at a time
+def _iter_shard_hits(shard, vector, expr, batch_size, limit):
+    iterator = guarded(
+        'milvus_search',
+        get_shard(shard).search_iterator,
+        data=[vector],
+        anns_field="vector",
+        param=search_params(batch_size),
+        batch_size=batch_size,
+        limit=limit,
+        expr=expr,
+        output_fields=["metadata"]
+    )
     try:
-        # Initialize TwelveLabs client
-        twelvelabs_client = TwelveLabs(api_key=TWELVELABS_API_KEY)
-        
-        # Generate embedding for the question with fashion context
-        question_with_context = f"fashion product: {question}"
-        question_embedding = twelvelabs_client.embed.create(
-            model_name="Marengo-retrieval-2.7",
-            text=question_with_context
-        ).text_embedding.segments[0].embeddings_float
-        
-        search_params = {
-            "metric_type": "COSINE",
-            "params": {
-                "nprobe": 1024,
-                "ef": 64
-            }
-        }
-        
-        # Search for relevant text embeddings
-        text_results = collection.search(
-            data=[question_embedding],
+        while True:
+            page = guarded('milvus_search', iterator.next)
+            if not page:
+                return
+            yield from page
+    finally:
+        iterator.close()
+
+
+# Embed a search query with the live collection's model
+def embed_query_text(text):
+    return _embed_query(embedding_model(), text)
+
+
+# Embed a query image with the live collection's model
+def embed_query_image(image_bytes):
+    return provider_call(
+        'twelvelabs_embed', 'twelvelabs', 'embed',
+        embed_image, image_bytes, embedding_model(),
+        hedge=True
+    )
+
+
+# Embeddings of recently asked queries, per model
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _embed_query(model_name, text):
+    return _embed_batcher.submit((model_name, text), text).text_embedding.segments[0].embeddings_float
+
+
+# Cached matches for a retrieval key (None on a miss or once expired) and
+# the catalog generation a new search for it must be stored under
+def cached_matches(cache_key):
+    with _retrieval_lock:
+        entry = _retrieval_cache.get(cache_key)
+        if entry is not None:
+            stored_at, matches = entry
+            if time.monotonic() - stored_at < RETRIEVAL_CACHE_TTL:
+                _retrieval_cache.move_to_end(cache_key)
+                return matches, _catalog_generation
+            del _retrieval_cache[cache_key]
+        return None, _catalog_generation
+
+
+# Cache matches unless the catalog changed while they were searched
+def store_matches(cache_key, generation, matches):
+    with _retrieval_lock:
+        if generation == _catalog_generation:
+            _retrieval_cache[cache_key] = (time.monotonic(), matches)
+            _retrieval_cache.move_to_end(cache_key)
+            while len(_retrieval_cache) > QUERY_CACHE_SIZE:
+                _retrieval_cache.popitem(last=False)
+
+
+# Search product descriptions in the given shards
+def search_text_matches(query_embedding, limit, expr="", shards=None):
+    shard_results = fan_out(
+        lambda shard: search_collection(
+            data=[query_embedding],
+            shard=shard,
             anns_field="vector",
-            param=search_params,
-            limit=2,
-            expr="embedding_type == 'text'",
+            param=search_params(limit),
+            limit=limit,
+            expr="embedding_type == 'text'" + (f" and ({expr})" if expr else ""),
             output_fields=["metadata"]
-        )
-        
-        # Search for relevant video segments
-        video_results = collection.search(
-            data=[question_embedding],
-            anns_field="vector",
-            param=search_params,
-            limit=3,
-            expr="embedding_type == 'video'",
-            output_fields=["metadata", "vector"]  # Add vector to output fields
-        )
-        
-        st.write(f"Retrieved {len(video_results)} video results")
+        ),
+        shards or [COLLECTION_NAME]
+    )
+    return merge_shard_hits(shard_results, limit)
+
+
+# Search text and video matches for a question in the given shards,
+# optionally narrowed by a filter expression. Results are cached until the
+# catalog changes or RETRIEVAL_CACHE_TTL passes; a search that overlaps a
+# catalog change is not cached.
+def retrieve_matches(question, expr="", shards=None):
+    shards = tuple(shards or [COLLECTION_NAME])
+    cache_key = (question, expr, shards)
+    matches, generation = cached_matches(cache_key)
+    if matches is not None:
+        return matches
+    
+    # Generate embedding for the question with fashion context
+    with stage("embed_query"):
+        question_embedding = embed_query_text(f"fashion product: {question}")
+    
+    # Search for relevant text embeddings
+    with stage("search_text"):
+        text_results = search_text_matches(question_embedding, 2, expr, shards)
+    
+    # Search for relevant video segments
+    with stage("search_video"):
+        video_results = search_video_segments(question_embedding, 3, ["metadata"], expr, shards)
+    
+    matches = (text_results, video_results)
+    store_matches(cache_key, generation, matches)
+    return matches
+
+
+# Drop cached retrievals and notify listeners (e.g. the warm-up thread)
+def notify_catalog_changed():
+    global _catalog_generation
+    with _retrieval_lock:
+        _catalog_generation += 1
+        _retrieval_cache.clear()
+    for listener in catalog_listeners:
+        listener()
 
-        # Process text results
-        text_docs = []
-        for hits in text_results:
-            for hit in hits:
-                metadata = hit.metadata
-                similarity = round((hit.score + 1) * 50, 2)
-                similarity = max(0, min(100, similarity))
-                
-                text_docs.append({
-                    "title": metadata.get('title', 'Untitled'),
-                    "description": metadata.get('description', 'No description available'),
-                    "product_id": metadata.get('product_id', ''),
-                    "video_url": metadata.get('video_url', ''),
-                    "link": metadata.get('link', '#'),  # Default to '#' if no link
-                    "similarity": similarity,
-                    "raw_score": hit.score,
-                    "type": "text"
-                })
-
-        # Process video results
-        video_docs = []
-        video_semantic_info = []
-        video_embeds = []
-        seen_products = set()  # Track unique products
-        
-        st.write("=== Starting Video Processing ===")
-        
-        for hits in video_results:
-            st.write(f"\nProcessing {len(hits)} video hits")
-            for hit in hits:
-                metadata = hit.metadata
-                st.write("\nFull metadata:", metadata)
-                
-                similarity = round((hit.score + 1) * 50, 2)
-                similarity = max(0, min(100, similarity))
-                
-                start_time = metadata.get('start_time', 0)
-                end_time = metadata.get('end_time', 0)
-                video_url = metadata.get('video_url', '')
-                product_link = metadata.get('link', '#')  # Default to '#' if no link
-                
-                st.write("\nProcessing video:")
-                st.write(f"- Title: {metadata.get('title', 'Untitled')}")
-                st.write(f"- Video URL: {video_url}")
-                st.write(f"- Product Link: {product_link}")
-                st.write(f"- Start Time: {start_time}")
-                st.write(f"- End Time: {end_time}")
-                st.write(f"- Similarity: {similarity}%")
-                
-                # Generate video embed HTML
-                if video_url:
-                    st.write("\nGenerating video embed...")
-                    try:
-                        embed_html = create_video_embed(video_url, start_time, end_time)
-                        st.write("Embed HTML generated successfully")
-                        st.write("Embed HTML preview:", embed_html[:200] + "..." if len(embed_html) > 200 else embed_html)
-                        
-                        product_key = f"{metadata.get('product_id', '')}_{start_time}_{end_time}"
-                        if product_key not in seen_products:
-                            # Log the hit entity
-                            st.write("\nHit entity fields:", hit.entity.keys())
-                            embedding_vector = hit.entity.get('vector', [])
-                            st.write(f"Retrieved embedding vector of length: {len(embedding_vector)}")
-                            
-                            video_embeds.append({
-                                'title': metadata.get('title', 'Untitled'),
-                                'embed_html': embed_html,
-                                'similarity': similarity,
-                                'start_time': start_time,
-                                'end_time': end_time,
-                                'video_url': video_url,
-                                'embedding_vector': embedding_vector
-                            })
-                            seen_products.add(product_key)
-                            st.write("Video embed and embedding vector added to list")
-                    except Exception as e:
-                        st.error(f"Error creating video embed: {str(e)}")
-                else:
-                    st.write("No video URL found in metadata")
-                
-                video_docs.append({
-                    "title": metadata.get('title', 'Untitled'),
-                    "description": metadata.get('description', 'No description available'),
-                    "product_id": metadata.get('product_id', ''),
-                    "similarity": similarity,
-                    "raw_score": hit.score,
-                    "type": "video",
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "video_url": video_url,
-                    "link": product_link
-                })
-                
-                video_semantic_info.append(
-                    f"Video '{metadata.get('title', 'Untitled')}' shows {similarity}% match to the query. "
-                    f"Relevant segment: {start_time}s to {end_time}s"
-                )
-
-        if not text_docs and not video_docs:
-            return {
-                "response": "I couldn't find any matching products. Try describing what you're looking for differently.",
-                "metadata": None
-            }
-
-        # Create context for LLM
-        combined_context = []
-        
-        # Add text results context
-        for doc in text_docs:
-            combined_context.append(
-                f"Product: {doc['title']}\n"
-                f"Description: {doc['description']}\n"
-                f"Match Score: {doc['similarity']}%"
-            )
-        
-        # Add semantic information about video matches
-        if video_semantic_info:
-            combined_context.append("\nVideo Content Analysis:\n" + "\n".join(video_semantic_info))
-            
-        # Add video descriptions with time segments
-        for doc in video_docs:
-            combined_context.append(
-                f"Product Video: {doc['title']}\n"
-                f"Description: {doc['description']}\n"
-                f"Video Embedding Vector: {doc.get('embedding_vector', [])}\n"
-                f"Match Score: {doc['similarity']}%\n"
-                f"Segment Timing: {doc['start_time']}s to {doc['end_time']}s"
-            )
-        
-        # Join all context together
-        full_context = "\n\n".join(combined_context)
-        
 
-        # Create messages for chat completion
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a professional fashion advisor and AI shopping assistant.
+SYSTEM_PROMPT = """You are a professional fashion advisor and AI shopping assistant.
                 You have access to both text descriptions and video content.
                 Use this multimodal information to provide accurate and relevant recommendations.
                 Pay attention to the match scores and video segments to prioritize the most relevant content.
@@ -384,126 +929,166 @@ def get_rag_response(question):
                 
                 Keep your response engaging and natural while maintaining this clear structure.
                 Focus on being helpful and specific rather than promotional."""
-            },
-            {
-                "role": "user",
-                "content": f"""Query: {question}
+
+NO_MATCHES_RESPONSE = "I couldn't find any matching products. Try describing what you're looking for differently."
+ERROR_RESPONSE = "I encountered an error while processing your request. Please try again."
+
+
+# Remember the display metadata of products seen in search hits or inserts
+def remember_products(metadatas):
+    with _product_lock:
+        for metadata in metadatas:
+            product_id = metadata.get('product_id')
+            if not product_id:
+                continue
+            _product_cache[product_id] = {field: metadata.get(field) for field in PRODUCT_DISPLAY_FIELDS}
+            _product_cache.move_to_end(product_id)
+        while len(_product_cache) > PRODUCT_CACHE_SIZE:
+            _product_cache.popitem(last=False)
+
+
+# Display metadata for the given product IDs, fetching products that are no
+# longer cached from the collection. Unknown products are left out.
+def lookup_products(product_ids):
+    with _product_lock:
+        products = {product_id: _product_cache[product_id] for product_id in product_ids if product_id in _product_cache}
+    
+    missing = sorted(set(product_ids) - set(products))
+    if missing:
+        try:
+            shard_rows = fan_out(
+                lambda shard: guarded(
+                    'milvus_query',
+                    get_shard(shard).query,
+                    expr=f"embedding_type == 'text' and {field_ref('product_id')} in {json.dumps(missing)}",
+                    output_fields=["metadata"],
+                    timeout=dependencies['milvus_query'].deadline
+                ),
+                available_shards(all_shards())
+            )
+        except Exception:
+            logger.exception("Error looking up products")
+            return products
+        metadatas = [row['metadata'] for rows in shard_rows.values() for row in rows]
+        remember_products(metadatas)
+        for metadata in metadatas:
+            products[metadata['product_id']] = {field: metadata.get(field) for field in PRODUCT_DISPLAY_FIELDS}
+    return products
+
+
+# Turn raw text and video search hits into ProductMatch sources
+def matches_to_sources(text_results, video_results):
+    remember_products(hit.metadata for hits in (*text_results, *video_results) for hit in hits)
+    text_docs = [ProductMatch.from_hit("text", hit.metadata, hit.score) for hits in text_results for hit in hits]
+    video_docs = [ProductMatch.from_hit("video", hit.metadata, hit.score) for hits in video_results for hit in hits]
+    return text_docs + video_docs
+
+
+# Create the chat messages that ask the LLM to answer from the sources
+def build_rag_messages(question, sources):
+    text_docs = [source for source in sources if not source.is_video]
+    video_docs = [source for source in sources if source.is_video]
+    
+    # Create context for LLM
+    combined_context = []
+    
+    # Add text results context
+    for doc in text_docs:
+        combined_context.append(
+            f"Product: {doc.title}\n"
+            f"Description: {doc.description}\n"
+            f"Match Score: {doc.similarity}%"
+        )
+    
+    # Add semantic information about video matches
+    if video_docs:
+        video_semantic_info = [
+            f"Video '{doc.title}' shows {doc.similarity}% match to the query. "
+            f"Relevant segment: {doc.start_time}s to {doc.end_time}s"
+            for doc in video_docs
+        ]
+        combined_context.append("\nVideo Content Analysis:\n" + "\n".join(video_semantic_info))
+        
+    # Add video descriptions with time segments
+    for doc in video_docs:
+        combined_context.append(
+            f"Product Video: {doc.title}\n"
+            f"Description: {doc.description}\n"
+            f"Match Score: {doc.similarity}%\n"
+            f"Segment Timing: {doc.start_time}s to {doc.end_time}s"
+        )
+    
+    # Join all context together
+    full_context = "\n\n".join(combined_context)
+    
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"""Query: {question}
 
 Available Products and Content Analysis:
 {full_context}
 
 Please provide fashion advice and product recommendations based on these options."""
-            }
-        ]
+        }
+    ]
 
-        # Get response from OpenAI
-        chat_response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
 
-        # Display video embeds in the UI
-        st.write("\n=== Displaying Video Results ===")
-        st.write(f"Number of video embeds: {len(video_embeds)}")
-        
-        if video_embeds:
-            st.write("### Relevant Video Segments")
-            for idx, video in enumerate(video_embeds):
-                st.write(f"\nDisplaying video {idx + 1}:")
-                st.write(f"**{video['title']}** (Similarity: {video['similarity']}%)")
-                st.write(f"Segment: {video['start_time']}s to {video['end_time']}s")
-                
-                try:
-                    st.write("Attempting to display video embed...")
-                    st.components.v1.html(video['embed_html'], height=400)
-                    st.write("Video embed displayed successfully")
-                except Exception as e:
-                    st.error(f"Error displaying video {idx + 1}: {str(e)}")
-                st.write("---")
-        else:
-            st.write("No video embeds to display")
+# Arguments of the chat completion request for the messages
+def chat_request(messages):
+    return {
+        "model": LLM_MODEL,
+        "messages": messages,
+        "temperature": LLM_TEMPERATURE,
+        "max_tokens": 500,
+        "timeout": dependencies['openai_chat'].deadline
+    }
 
-        # Format and return response
-        return {
-            "response": chat_response.choices[0].message.content,
-            "metadata": {
-                "sources": text_docs + video_docs,
-                "total_sources": len(text_docs) + len(video_docs),
-                "text_sources": len(text_docs),
-                "video_sources": len(video_docs),
-                "video_embeds": video_embeds
-            }
-        }
-    
-    except Exception as e:
-        st.error(f"Error in multimodal RAG: {str(e)}")
-        st.error(f"Full error details: {str(e)}")  # Fixed error logging
-        return {
-            "response": "I encountered an error while processing your request. Please try again.",
-            "metadata": None
-        }
-# Extract video ID and platform from URL
-def get_video_id_from_url(video_url):
 
-    try:
-        if 'vimeo.com' in video_url:
-            video_id = video_url.split('/')[-1].split('?')[0]
-            return video_id, 'vimeo'
-        else:
-            return video_url, 'direct'
-    except Exception as e:
-        st.error(f"Error processing video URL: {str(e)}")
-        return None, None
+# Answer the chat messages, reusing the cached answer when the same prompt
+# was answered before
+def complete_answer(messages, sources):
+    cache_key = prompt_fingerprint(LLM_MODEL, LLM_TEMPERATURE, messages)
+    answer = completion_cache.get(cache_key) if LLM_CACHE_ENABLED else None
+    if answer is None:
+        # Get response from OpenAI
+        chat_response = provider_call(
+            'openai_chat', 'openai', 'chat',
+            get_openai_client().chat.completions.create,
+            **chat_request(messages)
+        )
+        answer = chat_response.choices[0].message.content
+        if LLM_CACHE_ENABLED:
+            completion_cache.put(cache_key, answer, {source.product_id for source in sources})
+    return answer
 
-# Format time in seconds to URL compatible format
-def format_time_for_url(time_in_seconds):
-    try:
-        return str(int(float(time_in_seconds)))
-    except:
-        return "0"
 
-def create_video_embed(video_url, start_time=0, end_time=0):
+# Answer a shopping question from the retrieved products, optionally
+# narrowed by filters (see FILTER_KEYS). Returns a RagResponse whose sources
+# are empty when nothing matched or on error.
+def get_rag_response(question, filters=None):
+    expr, shards = query_scope(question, filters)
+    
     try:
-        video_id, platform = get_video_id_from_url(video_url)
-        start_seconds = format_time_for_url(start_time)
+        with stage("retrieve"):
+            text_results, video_results = retrieve_matches(question, expr, shards)
+        with stage("sources"):
+            sources = matches_to_sources(text_results, video_results)
+        logger.debug("Retrieved %d sources", len(sources))
         
-        if not video_id:
-            return f"<p>Unable to process video URL: {video_url}</p>"
+        if not sources:
+            return RagResponse(NO_MATCHES_RESPONSE)
         
-        if platform == 'vimeo':
-            return f"""
-                <iframe 
-                    width="100%" 
-                    height="315" 
-                    src="https://player.vimeo.com/video/{video_id}?autoplay=0#t={start_seconds}s"
-                    frameborder="0" 
-                    allow="fullscreen; picture-in-picture" 
-                    allowfullscreen>
-                </iframe>
-            """
-        elif platform == 'direct':
-            return f"""
-                <video 
-                    width="100%" 
-                    height="315" 
-                    controls 
-                    preload="metadata"
-                    id="video-player">
-                    <source src="{video_url}" type="video/mp4">
-                    Your browser does not support the video tag.
-                </video>
-                <script>
-                    document.getElementById('video-player').addEventListener('loadedmetadata', function() {{
-                        this.currentTime = {start_time};
-                        this.pause();
-                    }});
-                </script>
-            """
-        else:
-            return f"<p>Unsupported video platform for URL: {video_url}</p>"
-            
+        with stage("prompt"):
+            messages = build_rag_messages(question, sources)
+        with stage("complete"):
+            answer = complete_answer(messages, sources)
+        return RagResponse(answer, tuple(sources))
+    
     except Exception as e:
-        st.error(f"Error creating video embed: {str(e)}")
-        return f"<p>Error creating video embed for URL: {video_url}</p>"
+        logger.exception("Error in multimodal RAG")
+        return RagResponse(ERROR_RESPONSE)
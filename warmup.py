@@ -0,0 +1,72 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+from utils import get_rag_response, catalog_listeners
+from scheduler import priority_lane, BACKGROUND
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Example queries shown on the chat page before the first message
+SUGGESTIONS = [
+    "Show me black dresses for a party",
+    "I'm looking for men's black t-shirts",
+    "What are the latest bridal collection designs?",
+    "Find me a casual black dress",
+    "Show me t-shirts for men",
+    "Can you suggest bridal wear?"
+]
+
+# Extra popular queries to keep warm, separated by "|"
+POPULAR_QUERIES = [query.strip() for query in os.getenv('WARMUP_QUERIES', '').split('|') if query.strip()]
+# Seconds between scheduled refreshes of the warm queries
+WARMUP_INTERVAL = float(os.getenv('WARMUP_INTERVAL', '3600'))
+WARMUP_ENABLED = os.getenv('WARMUP', '1') == '1'
+
+_refresh = threading.Event()
+_start_lock = threading.Lock()
+_thread = None
+
+
+# Queries kept warm: the suggestions followed by the configured popular ones
+def warmup_queries():
+    return list(dict.fromkeys(SUGGESTIONS + POPULAR_QUERIES))
+
+
+# Run each query once so its embedding, retrieval and answer are cached.
+# Provider calls go through the background lane so users are served first.
+def warm_up(queries):
+    warmed = 0
+    for query in queries:
+        try:
+            with priority_lane(BACKGROUND):
+                response = get_rag_response(query)
+            if response.sources:
+                warmed += 1
+        except Exception:
+            logger.exception("Warm-up failed for query %r", query)
+    logger.info("Warmed %d of %d queries", warmed, len(queries))
+    return warmed
+
+
+def _run():
+    while True:
+        warm_up(warmup_queries())
+        # Sleep until the next scheduled refresh or an earlier catalog change
+        _refresh.wait(WARMUP_INTERVAL)
+        _refresh.clear()
+
+
+# Start the background warm-up thread once per process
+def start_warmup():
+    global _thread
+    if not WARMUP_ENABLED:
+        return
+    with _start_lock:
+        if _thread is not None:
+            return
+        catalog_listeners.append(_refresh.set)
+        _thread = threading.Thread(target=_run, name="query-warmup", daemon=True)
+        _thread.start()